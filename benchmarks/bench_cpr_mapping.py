@@ -0,0 +1,98 @@
+"""
+Benchmark of building the CPR mapping from a synthetic 100k-row employee sheet, comparing the previous row-by-row
+iterrows loop with the vectorized column operations in FileHandler.build_cpr_mapping.
+
+Reading the sheet costs the same for both, so it is timed once on its own, and the two implementations
+are then timed on the already read rows - see bench_sheet_ingest for the read itself.
+
+Run from the repository root with:
+    python -m benchmarks.bench_cpr_mapping
+"""
+import os
+import tempfile
+import time
+
+from unittest import mock
+
+import pandas as pd
+
+from helper_scripts import sheet_snapshot
+
+from helper_scripts.file_handler import FileHandler
+
+ROW_COUNT = 100_000
+
+# Every 1000th row has a malformed CPR number, which made the previous implementation crash when sorting
+MALFORMED_EVERY = 1_000
+
+
+def iterrows_mapping(df: pd.DataFrame) -> dict:
+    """The previous implementation of build_cpr_mapping, after the sheet was read."""
+
+    df = df.sort_values(by='CPR', key=lambda col: col.astype(int))
+
+    cpr_dict = {}
+    for _, row in df.iterrows():
+        cpr_value = row['CPR']
+
+        if pd.isna(cpr_value):
+            continue
+
+        cpr_value = cpr_value.strip()
+
+        cpr_dict[cpr_value] = {
+            "tjenestenummer": row['Tjenestenummer'] if not pd.isna(row['Tjenestenummer']) else "",
+            "navn": row['Navn'] if not pd.isna(row['Navn']) else "",
+            "stilling": row['Stilling'] if not pd.isna(row['Stilling']) else ""
+        }
+
+    return cpr_dict
+
+
+def main():
+    """Writes the synthetic sheet, and times the read and both mapping implementations."""
+
+    df = pd.DataFrame({
+        "Tjenestenummer": [str(i) for i in range(ROW_COUNT)],
+        "CPR": [f"{i:010d}" if i % MALFORMED_EVERY else f"{i:09d}X" for i in range(ROW_COUNT, 0, -1)],
+        "Navn": [f"Testperson {i}" for i in range(ROW_COUNT)],
+        "Stilling": ["Pædagog"] * ROW_COUNT,
+    })
+
+    with tempfile.TemporaryDirectory() as directory:
+        print(f"Writing a {ROW_COUNT}-row sheet ...")
+
+        df.to_excel(os.path.join(directory, "employees.xlsx"), sheet_name="Ark1", index=False)
+
+        file_handler = FileHandler(directory=directory)
+
+        start = time.perf_counter()
+        sheet = pd.read_excel(
+            os.path.join(directory, "employees.xlsx"),
+            sheet_name="Ark1",
+            converters={"CPR": str, "Tjenestenummer": str, "Navn": str, "Stilling": str}
+        )
+        print(f"{'read_excel':>24}: {time.perf_counter() - start:8.2f} s")
+
+        start = time.perf_counter()
+        valid_rows = sheet[sheet["CPR"].str.fullmatch(r"\d{10}")]
+        iterrows_dict = iterrows_mapping(valid_rows)
+        print(f"{'iterrows (valid rows)':>24}: {time.perf_counter() - start:8.2f} s")
+
+        try:
+            iterrows_mapping(sheet)
+
+        except ValueError as e:
+            print(f"{'iterrows (all rows)':>24}: crashed - {e}")
+
+        # The read is replaced by the already read rows, so only the mapping itself is timed
+        with mock.patch.object(sheet_snapshot, "load_sheet_columns", return_value=sheet.copy()):
+            start = time.perf_counter()
+            cpr_dict, rejected_rows = file_handler.build_cpr_mapping(filename="employees.xlsx", sheet_name="Ark1")
+            print(f"{'vectorized (all rows)':>24}: {time.perf_counter() - start:8.2f} s")
+
+        print(f"{len(cpr_dict)} rows mapped, {len(rejected_rows)} rows rejected, same mapping as iterrows: {cpr_dict == iterrows_dict}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark of the peak memory use when journalizing a folder of PDF files, comparing the previous eager loading of every file
+with the lazy file index, where each file is read right before its upload.
+
+Each mode runs in its own process, so the peak RSS of one does not hide the other. Peak RSS is read with the resource module, which is not available on Windows.
+
+Run from the repository root with:
+    python -m benchmarks.bench_pdf_loading
+"""
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+from pathlib import Path
+
+from handle_journalization.upload_pipeline import run_upload_pipeline
+
+from helper_scripts.file_handler import FileHandler
+
+FILE_COUNT = 500
+
+FILE_SIZE_BYTES = 512 * 1024
+
+
+def peak_rss_mb() -> float:
+    """Returns the peak resident set size of the current process in megabytes."""
+
+    import resource  # pylint: disable=import-outside-toplevel
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # ru_maxrss is reported in bytes on macOS, and in kilobytes on Linux
+    return peak_rss / (1024 * 1024) if sys.platform == "darwin" else peak_rss / 1024
+
+
+def fake_upload(_employee, document_bytes: bytes) -> int:
+    """Stands in for the upload, touching the bytes without keeping them."""
+
+    return len(document_bytes)
+
+
+def run_eager(folder: str) -> None:
+    """The previous implementation - every file is read into a dictionary before the first upload."""
+
+    pdf_files = {}
+    for file in Path(folder).glob('*.pdf'):
+        pdf_files[file.stem.split('_med_log')[0]] = file.read_bytes()
+
+    for ssn, document_bytes in pdf_files.items():
+        fake_upload(ssn, document_bytes)
+
+
+def run_lazy(folder: str) -> None:
+    """The file index - the files are read by the pipeline loader, and released once uploaded."""
+
+    pdf_files = FileHandler(directory=folder).index_files_by_cpr(folder_path=folder)
+
+    run_upload_pipeline(
+        items=list(pdf_files),
+        item_size=lambda ssn: pdf_files[ssn][1],
+        load_item=lambda ssn: Path(pdf_files[ssn][0]).read_bytes(),
+        upload_item=fake_upload,
+        write_result=lambda result: None,
+        max_workers=4,
+        max_in_flight_bytes=8 * FILE_SIZE_BYTES,
+    )
+
+
+def main():
+    """Creates a folder of synthetic PDF files, and runs each mode in a separate process."""
+
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(FILE_COUNT):
+            with open(os.path.join(folder, f"{i:010d}_med_log.pdf"), "wb") as pdf_file:
+                pdf_file.write(b"%PDF-1.4\n" + os.urandom(FILE_SIZE_BYTES - 9))
+
+        print(f"{FILE_COUNT} files of {FILE_SIZE_BYTES // 1024} KB ({FILE_COUNT * FILE_SIZE_BYTES / (1024 * 1024):.0f} MB in total)\n")
+        print(f"{'mode':>6} {'wall time (s)':>14} {'peak RSS (MB)':>14}")
+
+        for mode in ("eager", "lazy"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_pdf_loading", mode, folder],
+                check=True, capture_output=True, text=True
+            ).stdout
+
+            print(output.strip())
+
+
+def run_mode(mode: str, folder: str) -> None:
+    """Runs a single mode, and prints its wall time and peak RSS."""
+
+    start = time.perf_counter()
+
+    if mode == "eager":
+        run_eager(folder)
+
+    else:
+        run_lazy(folder)
+
+    print(f"{mode:>6} {time.perf_counter() - start:>14.2f} {peak_rss_mb():>14.1f}")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3:
+        run_mode(sys.argv[1], sys.argv[2])
+
+    else:
+        main()
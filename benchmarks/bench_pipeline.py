@@ -0,0 +1,278 @@
+"""
+End-to-end benchmark of the two phases, identify_employee_folders and handle_journalization, against the stub GetOrganized server.
+
+For each scale a synthetic employee sheet and a folder with one PDF per employee are generated, and both phases are run with the same
+shared session, caches, retry policy and circuit breaker as main.main, against a stub server in its own process, answering with a fixed latency.
+Each scale runs in its own process as well, so the peak RSS and the CPU time are those of the robot alone. Peak RSS is read with the resource
+module, which is not available on Windows.
+
+The results are compared with benchmarks/baseline.json, and a metric more than --tolerance above its baseline is reported as a regression.
+The baseline is only comparable when made on the same machine, with the same latency and number of workers - update it with --update-baseline.
+
+Run from the repository root with:
+    python -m benchmarks.bench_pipeline
+    python -m benchmarks.bench_pipeline --scales 1000 10000 50000 --latency 0.03 --workers 8
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+from mbu_dev_shared_components.getorganized.objects import CaseDataJson
+
+from benchmarks.bench_pdf_loading import peak_rss_mb
+from benchmarks.run_offline import PDF_BYTES, OfflineOrchestratorConnection, write_employee_list, EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME
+
+from handle_journalization.main import handle_journalization
+
+from helper_scripts.call_metrics import CallMetrics
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.contact_cache import ContactCache
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.file_handler import FileHandler
+from helper_scripts.go_client import create_go_session
+from helper_scripts.metadata_cache import MetadataCache
+from helper_scripts.retry_policy import CircuitBreaker, RetryPolicy
+from helper_scripts.run_state_store import RunStateStore
+
+from identify_employee_folders.main import identify_employee_folders
+
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), "baseline.json")
+
+# The metrics compared with the baseline - for all of them, lower is better
+COMPARED_METRICS = ["wall_seconds", "cpu_seconds", "requests_per_cpr"]
+
+
+def cpu_seconds() -> float:
+    """Returns the user and system CPU time used by the current process so far."""
+
+    process_times = os.times()
+
+    return process_times.user + process_times.system
+
+
+def start_stub_process(latency: float) -> tuple[subprocess.Popen, str]:
+    """Starts the stub server in its own process, waits until it accepts connections, and returns it with its base url."""
+
+    with socket.socket() as probe_socket:
+        probe_socket.bind(("127.0.0.1", 0))
+
+        port = probe_socket.getsockname()[1]
+
+    stub_process = subprocess.Popen(  # pylint: disable=consider-using-with
+        [sys.executable, "-m", "benchmarks.stub_go_server", "--port", str(port), "--latency", str(latency)],
+        stdout=subprocess.DEVNULL,
+    )
+
+    deadline = time.monotonic() + 10
+
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+
+            return stub_process, f"http://127.0.0.1:{port}"
+
+        except OSError:
+            if time.monotonic() > deadline:
+                stub_process.kill()
+
+                raise
+
+            time.sleep(0.05)
+
+
+def measure_phase(run_phase, metrics: CallMetrics, cpr_count: int) -> dict:
+    """Runs a phase, and returns its wall time, CPU time and the number of GetOrganized requests it sent."""
+
+    requests_before = sum(row["calls"] for row in metrics.summary())
+
+    cpu_before, start = cpu_seconds(), time.perf_counter()
+
+    run_phase()
+
+    wall_seconds, phase_cpu_seconds = time.perf_counter() - start, cpu_seconds() - cpu_before
+
+    requests_sent = sum(row["calls"] for row in metrics.summary()) - requests_before
+
+    return {
+        "wall_seconds": round(wall_seconds, 2),
+        "cpu_seconds": round(phase_cpu_seconds, 2),
+        "requests": requests_sent,
+        "requests_per_cpr": round(requests_sent / cpr_count, 2),
+        "cprs_per_second": round(cpr_count / wall_seconds, 1),
+    }
+
+
+def run_scale(cpr_count: int, latency: float, workers: int) -> dict:
+    """Runs both phases for one scale, in the current process, and returns the measurements."""
+
+    stub_process, api_endpoint = start_stub_process(latency)
+
+    try:
+        with tempfile.TemporaryDirectory() as folder_path:
+            files_to_journalize_path = os.path.join(folder_path, "udsendte_dokumenter")
+
+            os.makedirs(files_to_journalize_path)
+
+            for cpr in write_employee_list(folder_path, cpr_count):
+                with open(os.path.join(files_to_journalize_path, f"{cpr}.pdf"), mode="wb") as pdf_file:
+                    pdf_file.write(PDF_BYTES)
+
+            metrics = CallMetrics()
+
+            client_options = {
+                "session": create_go_session("bench", "bench", pool_maxsize=workers),
+                "retry_policy": RetryPolicy(),
+                "circuit_breaker": CircuitBreaker(),
+                "metrics": metrics,
+            }
+
+            case_handler = CaseHandler(
+                api_endpoint, "bench", "bench", metadata_cache=MetadataCache(), contact_cache=ContactCache(secret="bench"), **client_options
+            )
+
+            document_handler = DocumentHandler(api_endpoint, "bench", "bench", **client_options)
+
+            file_handler = FileHandler(directory=folder_path)
+
+            run_state = RunStateStore(os.path.join(folder_path, "masseforsendelse_state.db"))
+
+            try:
+                identify = measure_phase(lambda: identify_employee_folders(
+                    file_handler=file_handler,
+                    case_handler=case_handler,
+                    case_data_handler=CaseDataJson(),
+                    run_state=run_state,
+                    employee_list_filename=EMPLOYEE_LIST_FILENAME,
+                    employee_list_sheet_name=EMPLOYEE_LIST_SHEET_NAME,
+                    case_type="PER",
+                    case_title="Ansættelse og lønaftaler",
+                    max_workers=workers,
+                ), metrics, cpr_count)
+
+                journalization = measure_phase(lambda: handle_journalization(
+                    orchestrator_connection=OfflineOrchestratorConnection(api_endpoint),
+                    file_handler=file_handler,
+                    document_handler=document_handler,
+                    run_state=run_state,
+                    files_to_journalize_path=files_to_journalize_path,
+                    journalized_filename="Benchmark",
+                    document_category="Udgående",
+                    case_type="PER",
+                    max_workers=workers,
+                    journalize_and_finalize=True,
+                ), metrics, cpr_count)
+
+                statuses = {"resolved_cases": run_state.count_by_status("resolved_cases"), "uploaded_docs": run_state.count_by_status("uploaded_docs")}
+
+            finally:
+                run_state.close()
+
+    finally:
+        stub_process.kill()
+
+        stub_process.wait()
+
+    return {"identify": identify, "journalization": journalization, "peak_rss_mb": round(peak_rss_mb(), 1), "statuses": statuses}
+
+
+def compare_with_baseline(scale: str, result: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Returns a line for every metric of the result more than tolerance above its baseline."""
+
+    regressions = []
+
+    baseline_result = baseline.get("results", {}).get(scale)
+
+    if not baseline_result:
+        return regressions
+
+    for phase in ("identify", "journalization"):
+        for metric in COMPARED_METRICS:
+            value, baseline_value = result[phase][metric], baseline_result[phase][metric]
+
+            if value > baseline_value * (1 + tolerance):
+                regressions.append(f"{scale} CPRs, {phase} {metric}: {value} against a baseline of {baseline_value}")
+
+    if result["peak_rss_mb"] > baseline_result["peak_rss_mb"] * (1 + tolerance):
+        regressions.append(f"{scale} CPRs, peak_rss_mb: {result['peak_rss_mb']} against a baseline of {baseline_result['peak_rss_mb']}")
+
+    return regressions
+
+
+def main():
+    """Runs every scale in its own process, prints the report, and compares it with the baseline."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scales", type=int, nargs="+", default=[1000])
+    parser.add_argument("--latency", type=float, default=0.03, help="the latency of every stub server response, in seconds")
+    parser.add_argument("--workers", type=int, default=8)
+    parser.add_argument("--tolerance", type=float, default=0.3, help="the share a metric may grow before it is a regression")
+    parser.add_argument("--update-baseline", action="store_true")
+    parser.add_argument("--run-scale", type=int, default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scale:
+        # The child process - the result is printed as JSON on the last line
+        print(json.dumps(run_scale(args.run_scale, args.latency, args.workers)))
+
+        return
+
+    settings = {"latency": args.latency, "workers": args.workers}
+
+    baseline = {}
+
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH, mode="r", encoding="utf-8") as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if baseline.get("settings") != settings:
+        print(f"The baseline was made with {baseline.get('settings')}, not {settings} - it is not compared\n")
+
+        baseline = {"settings": settings, "results": {}} if args.update_baseline else {}
+
+    print(f"{'CPRs':>7} {'phase':>15} {'wall (s)':>9} {'CPU (s)':>8} {'requests':>9} {'req/CPR':>8} {'CPR/s':>7} {'peak RSS (MB)':>14}")
+
+    regressions = []
+
+    for scale in args.scales:
+        output = subprocess.run(
+            [sys.executable, "-m", "benchmarks.bench_pipeline", "--run-scale", str(scale), "--latency", str(args.latency), "--workers", str(args.workers)],
+            check=True, capture_output=True, text=True
+        ).stdout
+
+        result = json.loads(output.strip().splitlines()[-1])
+
+        for phase in ("identify", "journalization"):
+            phase_result = result[phase]
+
+            print(
+                f"{scale:>7} {phase:>15} {phase_result['wall_seconds']:>9.2f} {phase_result['cpu_seconds']:>8.2f} {phase_result['requests']:>9} "
+                f"{phase_result['requests_per_cpr']:>8.2f} {phase_result['cprs_per_second']:>7.1f} {result['peak_rss_mb']:>14.1f}"
+            )
+
+        regressions += compare_with_baseline(str(scale), result, baseline, args.tolerance)
+
+        if args.update_baseline:
+            baseline.setdefault("results", {})[str(scale)] = result
+
+    if args.update_baseline:
+        with open(BASELINE_PATH, mode="w", encoding="utf-8") as baseline_file:
+            json.dump(baseline, baseline_file, indent=2)
+
+        print(f"\nBaseline written to {BASELINE_PATH}")
+
+    elif regressions:
+        print("\nRegressions against the baseline:")
+
+        for regression in regressions:
+            print(f"  {regression}")
+
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
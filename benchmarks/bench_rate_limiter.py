@@ -0,0 +1,90 @@
+"""
+Benchmark of the endpoint rate limiter against the local stub GetOrganized server, given a capacity above which it answers 429.
+
+Each scenario runs a pool of worker threads sending metadata lookups for a fixed time, and reports the throughput of successful calls,
+the number of 429 responses, the time the workers were throttled by the limiter, and the rate the metadata class ended at.
+
+Run from the repository root with:
+    python -m benchmarks.bench_rate_limiter
+"""
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_go_server import start_stub_server
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.go_client import create_go_session
+from helper_scripts.rate_limiter import AimdSettings, EndpointRateLimiter
+
+SERVER_CAPACITY = 100
+
+RUN_SECONDS = 5
+
+WORKER_COUNT = 8
+
+SCENARIOS = [
+    # name, rate limiter
+    ("no limiter", None),
+    ("fixed 80 req/s", EndpointRateLimiter(rates={"metadata": 80})),
+    ("fixed 300 req/s", EndpointRateLimiter(rates={"metadata": 300})),
+    ("AIMD from 300 req/s", EndpointRateLimiter(rates={"metadata": 300}, aimd=AimdSettings(increase_per_second=5))),
+]
+
+
+def run_scenario(name: str, rate_limiter: EndpointRateLimiter) -> None:
+    """Runs one scenario against a fresh stub server, and prints its line of the report."""
+
+    server, api_endpoint = start_stub_server(capacity=SERVER_CAPACITY)
+
+    case_handler = CaseHandler(
+        api_endpoint,
+        "user",
+        "password",
+        session=create_go_session("user", "password", pool_maxsize=WORKER_COUNT),
+        rate_limiter=rate_limiter,
+    )
+
+    deadline = time.monotonic() + RUN_SECONDS
+
+    def worker(_) -> int:
+        succeeded = 0
+
+        while time.monotonic() < deadline:
+            if case_handler.get_case_metadata("/_goapi/Cases/Metadata/PER-2025-000001-001").ok:
+                succeeded += 1
+
+        return succeeded
+
+    with ThreadPoolExecutor(max_workers=WORKER_COUNT) as executor:
+        succeeded = sum(executor.map(worker, range(WORKER_COUNT)))
+
+    server.shutdown()
+
+    if rate_limiter:
+        metadata_stats = rate_limiter.stats()["metadata"]
+
+        throttled_seconds, final_rate = metadata_stats["throttled_seconds"], metadata_stats["rate"]
+
+    else:
+        throttled_seconds, final_rate = 0.0, 0.0
+
+    print(
+        f"{name:>22} {succeeded / RUN_SECONDS:>12.0f} {server.counters['faults']:>7} "
+        f"{throttled_seconds:>14.1f} {final_rate:>11.1f}"
+    )
+
+
+def main():
+    """Runs every scenario."""
+
+    print(f"Server capacity: {SERVER_CAPACITY} req/s, {WORKER_COUNT} workers, {RUN_SECONDS} s per scenario")
+
+    print(f"{'scenario':>22} {'ok calls/s':>12} {'429s':>7} {'throttled (s)':>14} {'final rate':>11}")
+
+    for scenario in SCENARIOS:
+        run_scenario(*scenario)
+
+
+if __name__ == "__main__":
+    main()
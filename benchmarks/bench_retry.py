@@ -0,0 +1,90 @@
+"""
+Benchmark of the retry policy and the circuit breaker against the local stub GetOrganized server, with injected faults.
+
+Each scenario sends a mix of idempotent lookups and non-idempotent uploads from a pool of worker threads, and reports the share of
+calls that ended in a successful response, the number of requests the server received, and the wall time.
+
+Run from the repository root with:
+    python -m benchmarks.bench_retry
+"""
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.stub_go_server import start_stub_server
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.go_client import create_go_session
+from helper_scripts.retry_policy import CircuitBreaker, RetryPolicy
+
+CALL_COUNT = 400
+
+WORKER_COUNT = 8
+
+SCENARIOS = [
+    # name, server fault options, retry policy, circuit breaker
+    ("no faults, no retries", {}, None, None),
+    ("10% 503, no retries", {"fault_rate": 0.1}, None, None),
+    ("10% 503, retries", {"fault_rate": 0.1}, RetryPolicy(max_attempts=4, base_delay=0.01, max_delay=0.2), None),
+    ("10% 502, retries", {"fault_rate": 0.1, "fault_status": 502}, RetryPolicy(max_attempts=4, base_delay=0.01, max_delay=0.2), None),
+    (
+        "30% 429 + Retry-After, breaker",
+        {"fault_rate": 0.3, "fault_status": 429, "retry_after": 0.05},
+        RetryPolicy(max_attempts=6, base_delay=0.01, max_delay=0.2),
+        CircuitBreaker(failure_threshold=5, cooldown_seconds=0.1),
+    ),
+]
+
+
+def run_scenario(name: str, fault_options: dict, retry_policy: RetryPolicy, circuit_breaker: CircuitBreaker) -> None:
+    """Runs one scenario against a fresh stub server, and prints its line of the report."""
+
+    server, api_endpoint = start_stub_server(seed=42, **fault_options)
+
+    session = create_go_session("user", "password", pool_maxsize=WORKER_COUNT)
+
+    handler_options = {"session": session, "retry_policy": retry_policy, "circuit_breaker": circuit_breaker}
+
+    case_handler = CaseHandler(api_endpoint, "user", "password", **handler_options)
+
+    document_handler = DocumentHandler(api_endpoint, "user", "password", **handler_options)
+
+    def call(index: int) -> bool:
+        # Every fourth call is an upload, which is only sent again when the server turned it away with 429 or 503
+        if index % 4 == 0:
+            response = document_handler.upload_document({"Bytes": ""}, "/_goapi/Documents/AddToCase")
+
+        else:
+            response = case_handler.get_case_metadata("/_goapi/Cases/Metadata/PER-2025-000001-001")
+
+        return response.ok
+
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=WORKER_COUNT) as executor:
+        results = list(executor.map(call, range(CALL_COUNT)))
+
+    wall_seconds = time.perf_counter() - start
+
+    server.shutdown()
+
+    opened = circuit_breaker.counters["opened"] if circuit_breaker else 0
+
+    print(
+        f"{name:>32} {sum(results) / len(results):>9.1%} {server.counters['requests']:>9} "
+        f"{server.counters['faults']:>7} {opened:>7} {wall_seconds:>8.2f}"
+    )
+
+
+def main():
+    """Runs every scenario."""
+
+    print(f"{'scenario':>32} {'success':>9} {'requests':>9} {'faults':>7} {'opened':>7} {'wall (s)':>8}")
+
+    for scenario in SCENARIOS:
+        run_scenario(*scenario)
+
+
+if __name__ == "__main__":
+    main()
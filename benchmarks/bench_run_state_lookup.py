@@ -0,0 +1,80 @@
+"""
+Benchmark of the resume checks as the run state grows, comparing a full pandas re-read of the exported checkpoint CSV, as the versions
+before the run state did on every check, with RunStateStore.is_case_resolved and RunStateStore.is_document_uploaded.
+
+Half of the CPR numbers looked up are in the run state, and half are not, as on a re-run after a crash halfway through the mailing.
+
+Run from the repository root with:
+    python -m benchmarks.bench_run_state_lookup
+"""
+import os
+import tempfile
+import time
+
+import pandas as pd
+
+from helper_scripts import run_state_store
+from helper_scripts.run_state_store import RunStateStore
+
+TABLE_SIZES = [1_000, 20_000, 100_000]
+
+LOOKUPS_PER_SIZE = 2_000
+
+# The pandas path is far too slow to run for every lookup, so it is only timed on a handful of them
+PANDAS_LOOKUPS = 10
+
+
+def pandas_lookup(file_path: str, cpr: str) -> bool:
+    """The resume check of the versions before the run state - the whole checkpoint file is parsed on every call."""
+
+    df = pd.read_csv(file_path, dtype={"cpr": str})
+
+    return cpr in df["cpr"].values
+
+
+def time_lookups(lookup, cprs: list[str]) -> float:
+    """Returns the mean time of a lookup in microseconds."""
+
+    start = time.perf_counter()
+
+    for cpr in cprs:
+        lookup(cpr)
+
+    return (time.perf_counter() - start) / len(cprs) * 1_000_000
+
+
+def main():
+    """Fills run states of increasing size, and times the lookups against each of them."""
+
+    print(f"{'rows':>8} {'pandas re-read (us/lookup)':>28} {'is_case_resolved (us/lookup)':>30} {'is_document_uploaded (us/lookup)':>34}")
+
+    with tempfile.TemporaryDirectory() as directory:
+        for table_size in TABLE_SIZES:
+            store = RunStateStore(os.path.join(directory, f"masseforsendelse_state_{table_size}.db"))
+
+            try:
+                store.record_resolved_cases([
+                    (f"{i:010d}", f"PER-2025-{i:06d}-001", run_state_store.CASE_RESOLVED, None) for i in range(table_size)
+                ])
+                store.record_uploaded_docs([
+                    (f"{i:010d}", f"PER-2025-{i:06d}-001", str(i), run_state_store.DOC_UPLOADED, None) for i in range(table_size)
+                ])
+
+                csv_path = store.export_csv("resolved_cases", os.path.join(directory, f"employee_case_ids_{table_size}.csv"))
+
+                lookup_cprs = [f"{i:010d}" for i in range(0, table_size * 2, max(1, (table_size * 2) // LOOKUPS_PER_SIZE))]
+
+                pandas_us = time_lookups(lambda cpr, path=csv_path: pandas_lookup(path, cpr), lookup_cprs[:PANDAS_LOOKUPS])
+
+                case_us = time_lookups(store.is_case_resolved, lookup_cprs)
+
+                document_us = time_lookups(store.is_document_uploaded, lookup_cprs)
+
+            finally:
+                store.close()
+
+            print(f"{table_size:>8} {pandas_us:>28.1f} {case_us:>30.1f} {document_us:>34.1f}")
+
+
+if __name__ == "__main__":
+    main()
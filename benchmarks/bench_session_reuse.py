@@ -0,0 +1,86 @@
+"""
+Benchmark of the per-request latency against the local stub GetOrganized server, comparing a new connection per call,
+as in mbu_dev_shared_components, with the pooled keep-alive session shared by the handlers.
+
+The stub serves plain HTTP, so only the TCP setup is saved here - against GetOrganized, every new connection also pays a TLS and NTLM handshake.
+
+Run from the repository root with:
+    python -m benchmarks.bench_session_reuse
+"""
+import statistics
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+
+from mbu_dev_shared_components.getorganized import cases
+
+from benchmarks.stub_go_server import start_stub_server
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.go_client import create_go_session
+
+REQUEST_COUNT = 300
+
+WORKER_COUNT = 8
+
+
+def timed(call) -> float:
+    """Returns the latency of a single call in milliseconds."""
+
+    start = time.perf_counter()
+
+    response = call()
+    response.raise_for_status()
+
+    return (time.perf_counter() - start) * 1000
+
+
+def report(name: str, latencies: list[float], wall_seconds: float) -> None:
+    """Prints the latency percentiles and the throughput of a run."""
+
+    latencies = sorted(latencies)
+
+    print(
+        f"{name:>28} {statistics.median(latencies):>9.2f} {latencies[int(len(latencies) * 0.95)]:>9.2f} "
+        f"{len(latencies) / wall_seconds:>10.0f}"
+    )
+
+
+def main():
+    """Runs each client mode against the stub server."""
+
+    server, api_endpoint = start_stub_server()
+
+    case_handler = CaseHandler(
+        api_endpoint=api_endpoint,
+        api_username="user",
+        api_password="password",
+        session=create_go_session("user", "password", pool_maxsize=WORKER_COUNT),
+    )
+
+    endpoint_path = "/_goapi/Cases/Metadata/PER-2025-000001-001"
+
+    print(f"{'mode':>28} {'p50 (ms)':>9} {'p95 (ms)':>9} {'req/s':>10}")
+
+    start = time.perf_counter()
+    latencies = [timed(lambda: cases.get_case_metadata(f"{api_endpoint}{endpoint_path}", "user", "password")) for _ in range(REQUEST_COUNT)]
+    report("new connection, serial", latencies, time.perf_counter() - start)
+
+    start = time.perf_counter()
+    latencies = [timed(lambda: case_handler.get_case_metadata(endpoint_path)) for _ in range(REQUEST_COUNT)]
+    report("pooled session, serial", latencies, time.perf_counter() - start)
+
+    with ThreadPoolExecutor(max_workers=WORKER_COUNT) as executor:
+        start = time.perf_counter()
+        latencies = list(executor.map(lambda _: timed(lambda: cases.get_case_metadata(f"{api_endpoint}{endpoint_path}", "user", "password")), range(REQUEST_COUNT)))
+        report(f"new connection, {WORKER_COUNT} threads", latencies, time.perf_counter() - start)
+
+        start = time.perf_counter()
+        latencies = list(executor.map(lambda _: timed(lambda: case_handler.get_case_metadata(endpoint_path)), range(REQUEST_COUNT)))
+        report(f"pooled session, {WORKER_COUNT} threads", latencies, time.perf_counter() - start)
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
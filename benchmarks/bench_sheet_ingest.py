@@ -0,0 +1,106 @@
+"""
+Benchmark of reading the employee sheet from a synthetic HR export with many columns, comparing pd.read_excel on the whole sheet with
+the streaming reader of helper_scripts.sheet_snapshot restricted to the four required columns, and with a re-run loading the cached snapshot.
+
+Each mode runs in its own process, so the peak RSS of one does not hide the other, and the sheet is written by a process of its own as well,
+as Linux carries the peak RSS of a process over to the programs it starts. Peak RSS is read with the resource module, which is not available on Windows.
+
+Run from the repository root with:
+    python -m benchmarks.bench_sheet_ingest
+    python -m benchmarks.bench_sheet_ingest --rows 200000
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import pandas as pd
+
+from benchmarks.bench_pdf_loading import peak_rss_mb
+
+from helper_scripts import sheet_snapshot
+
+SHEET_NAME = "Ansatte"
+
+REQUIRED_COLUMNS = ["CPR", "Tjenestenummer", "Navn", "Stilling"]
+
+# An HR export has many more columns than the four the robot needs
+EXTRA_COLUMN_COUNT = 20
+
+
+def write_sheet(file_path: str, row_count: int) -> None:
+    """Writes a synthetic HR export, with the required columns among the extra ones."""
+
+    columns = {f"Felt {i}": [f"Værdi {i}-{row}" for row in range(row_count)] for i in range(EXTRA_COLUMN_COUNT // 2)}
+
+    columns.update({
+        "Tjenestenummer": [str(row) for row in range(row_count)],
+        "CPR": [f"{row:010d}" for row in range(row_count, 0, -1)],
+        "Navn": [f"Testperson {row}" for row in range(row_count)],
+        "Stilling": ["Pædagog"] * row_count,
+    })
+
+    columns.update({f"Felt {i}": [row * i for row in range(row_count)] for i in range(EXTRA_COLUMN_COUNT // 2, EXTRA_COLUMN_COUNT)})
+
+    pd.DataFrame(columns).to_excel(file_path, sheet_name=SHEET_NAME, index=False)
+
+
+def run_mode(mode: str, file_path: str) -> None:
+    """Reads the sheet in a single mode, and prints its wall time and peak RSS."""
+
+    snapshot_path = f"{file_path}.snapshot.json"
+
+    start = time.perf_counter()
+
+    if mode == "read_excel":
+        df = pd.read_excel(file_path, sheet_name=SHEET_NAME, converters={column: str for column in REQUIRED_COLUMNS})[REQUIRED_COLUMNS]
+
+    else:
+        # 'streaming' writes the snapshot, which 'snapshot' then loads
+        df = sheet_snapshot.load_sheet_columns(file_path, SHEET_NAME, REQUIRED_COLUMNS, snapshot_path=snapshot_path)
+
+    print(f"{mode:>10} {time.perf_counter() - start:>14.3f} {peak_rss_mb():>14.1f} {len(df):>8}")
+
+
+def main():
+    """Writes the synthetic sheet, and runs each mode in a separate process."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50_000)
+    parser.add_argument("--run-mode", nargs=2, default=None, help=argparse.SUPPRESS)
+    parser.add_argument("--write-sheet", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_mode:
+        run_mode(*args.run_mode)
+
+        return
+
+    if args.write_sheet:
+        write_sheet(args.write_sheet, args.rows)
+
+        return
+
+    with tempfile.TemporaryDirectory() as directory:
+        file_path = os.path.join(directory, "employees.xlsx")
+
+        print(f"Writing a {args.rows}-row sheet with {EXTRA_COLUMN_COUNT + len(REQUIRED_COLUMNS)} columns ...")
+
+        subprocess.run([sys.executable, "-m", "benchmarks.bench_sheet_ingest", "--rows", str(args.rows), "--write-sheet", file_path], check=True)
+
+        print(f"{os.path.getsize(file_path) / (1024 * 1024):.1f} MB\n")
+        print(f"{'mode':>10} {'wall time (s)':>14} {'peak RSS (MB)':>14} {'rows':>8}")
+
+        for mode in ("read_excel", "streaming", "snapshot"):
+            output = subprocess.run(
+                [sys.executable, "-m", "benchmarks.bench_sheet_ingest", "--run-mode", mode, file_path],
+                check=True, capture_output=True, text=True
+            ).stdout
+
+            print(output.strip())
+
+
+if __name__ == "__main__":
+    main()
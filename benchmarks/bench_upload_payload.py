@@ -0,0 +1,74 @@
+"""
+Benchmark of the upload payload, comparing the previous list of integers with the base64 encoded 'Bytes' field.
+
+For each document size, the peak memory used to build the payload and the time to serialize it to JSON are reported per MB of PDF.
+Both payloads are also decoded again, to check that they carry exactly the same bytes.
+
+Run from the repository root with:
+    python -m benchmarks.bench_upload_payload
+"""
+import base64
+import json
+import os
+import time
+import tracemalloc
+
+from helper_scripts.document_handler import DocumentHandler
+
+DOCUMENT_SIZES_MB = [1, 5, 20]
+
+
+def build_list_payload(document_bytes: bytes) -> list:
+    """The previous encoding of the 'Bytes' field."""
+
+    return list(document_bytes)
+
+
+def build_base64_payload(document_bytes: bytes) -> str:
+    """The current encoding of the 'Bytes' field."""
+
+    return DocumentHandler.encode_document_bytes(document_bytes)
+
+
+def measure(build_payload, document_bytes: bytes) -> tuple[float, float, int, str]:
+    """Returns the peak memory in bytes, the serialization time in seconds, the JSON size in bytes and the JSON itself."""
+
+    tracemalloc.start()
+    payload = build_payload(document_bytes)
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    start = time.perf_counter()
+    serialized = json.dumps({"Bytes": payload})
+    serialization_seconds = time.perf_counter() - start
+
+    return peak_memory, serialization_seconds, len(serialized), serialized
+
+
+def main():
+    """Measures both encodings for each document size."""
+
+    print(f"{'size (MB)':>9} {'encoding':>9} {'memory (MB/MB)':>15} {'serialize (ms/MB)':>18} {'JSON (MB/MB)':>13}")
+
+    for size_mb in DOCUMENT_SIZES_MB:
+        document_bytes = os.urandom(size_mb * 1024 * 1024)
+
+        decoded = {}
+
+        for name, build_payload in (("list", build_list_payload), ("base64", build_base64_payload)):
+            peak_memory, serialization_seconds, json_size, serialized = measure(build_payload, document_bytes)
+
+            print(
+                f"{size_mb:>9} {name:>9} {peak_memory / (1024 * 1024) / size_mb:>15.2f} "
+                f"{serialization_seconds * 1000 / size_mb:>18.2f} {json_size / (1024 * 1024) / size_mb:>13.2f}"
+            )
+
+            field = json.loads(serialized)["Bytes"]
+            decoded[name] = bytes(field) if isinstance(field, list) else base64.b64decode(field)
+
+        # Both encodings must carry the same document
+        assert decoded["list"] == decoded["base64"] == document_bytes
+
+
+if __name__ == "__main__":
+    main()
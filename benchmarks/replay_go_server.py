@@ -0,0 +1,153 @@
+"""
+A local GetOrganized server replaying a recording made with helper_scripts.call_recorder, for running the robot offline and reproducibly.
+
+A request is answered with the recorded response to the same method, path and request body. If the same request was recorded several times,
+the recorded responses are replayed in turn, so e.g. a 503 followed by a 200 is replayed the same way. A request that was not recorded
+as such - an upload of a different document, or a search with another date - is answered with the recorded responses to the same endpoint,
+with the IDs in the path ignored. The latency and the fault injection of the stub server apply on top of the recording.
+
+Run from the repository root with:
+    python -m benchmarks.replay_go_server go_recording.jsonl --port 8080 --latency 0.05 --fault-rate 0.1
+"""
+import argparse
+import itertools
+import json
+import threading
+
+from collections import defaultdict
+
+from benchmarks.stub_go_server import StubGetOrganizedHandler, StubGetOrganizedServer, add_stub_arguments, get_stub_options
+
+from helper_scripts.call_metrics import normalize_endpoint
+from helper_scripts.call_recorder import hash_request_body
+
+
+class ReplayGetOrganizedHandler(StubGetOrganizedHandler):
+    """Answers every request from the recording of the server."""
+
+    def _replay(self, method: str) -> None:
+        body = self._read_body().decode("utf-8", errors="replace")
+
+        self.server.wait_latency()
+
+        if self._send_fault():
+            return
+
+        exchange = self.server.find_exchange(method, self.path, body)
+
+        if exchange is None:
+            self._send_json(404, {"Message": f"No recorded response for {method} {self.path}"})
+
+            return
+
+        encoded_body = exchange["body"].encode("utf-8")
+
+        self.send_response(exchange["status"])
+        self.send_header("Content-Type", exchange["content_type"] or "application/json")
+        self.send_header("Content-Length", str(len(encoded_body)))
+
+        if exchange.get("retry_after"):
+            self.send_header("Retry-After", exchange["retry_after"])
+
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Replays a GET request."""
+
+        self._replay("GET")
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Replays a POST request."""
+
+        self._replay("POST")
+
+
+class ReplayGetOrganizedServer(StubGetOrganizedServer):
+    """
+    A stub server answering from a recording.
+
+    Attributes:
+    - exchanges (dict): The recorded exchanges per method, path and request body hash, each cycled through in the recorded order.
+    - endpoint_exchanges (dict): The recorded exchanges per normalized endpoint, used for requests that were not recorded as such.
+    - counters (Counter): The counters of the stub server, and the number of requests answered 'replayed' exactly, as 'fallback', or 'missing'.
+    """
+    def __init__(self, server_address: tuple, recording_path: str, **stub_options):
+        super().__init__(server_address, **stub_options)
+        self.RequestHandlerClass = ReplayGetOrganizedHandler
+        self.counters.update(replayed=0, fallback=0, missing=0)
+
+        exchanges, endpoint_exchanges = defaultdict(list), defaultdict(list)
+
+        with open(recording_path, mode="r", encoding="utf-8") as recording_file:
+            for line in recording_file:
+                exchange = json.loads(line)
+
+                exchanges[(exchange["method"], exchange["path"], exchange["request_sha256"])].append(exchange)
+
+                endpoint_exchanges[normalize_endpoint(exchange["method"], exchange["path"])].append(exchange)
+
+        self.exchanges = {key: itertools.cycle(values) for key, values in exchanges.items()}
+        self.endpoint_exchanges = {key: itertools.cycle(values) for key, values in endpoint_exchanges.items()}
+        self._replay_lock = threading.Lock()
+
+    def find_exchange(self, method: str, path: str, body: str) -> dict | None:
+        """Returns the next recorded exchange answering the request, or None if the endpoint was never recorded."""
+
+        with self._replay_lock:
+            exact_exchanges = self.exchanges.get((method, path, hash_request_body(body)))
+
+            if exact_exchanges is not None:
+                self.counters["replayed"] += 1
+
+                return next(exact_exchanges)
+
+            fallback_exchanges = self.endpoint_exchanges.get(normalize_endpoint(method, path))
+
+            if fallback_exchanges is not None:
+                self.counters["fallback"] += 1
+
+                return next(fallback_exchanges)
+
+            self.counters["missing"] += 1
+
+            return None
+
+
+def start_replay_server(recording_path: str, port: int = 0, **stub_options) -> tuple[ReplayGetOrganizedServer, str]:
+    """
+    Starts the replay server in a background thread.
+
+    Parameters:
+    - recording_path (str): The path of the recording made with helper_scripts.call_recorder.CallRecorder.
+    - port (int): The port to listen on - 0 picks a free port.
+    - stub_options: Passed on to StubGetOrganizedServer - latency, fault_rate, fault_status, retry_after, seed and capacity.
+
+    Returns:
+    - tuple: The running server, and its base url to use as the GetOrganized api endpoint.
+    """
+
+    server = ReplayGetOrganizedServer(("127.0.0.1", port), recording_path, **stub_options)
+
+    threading.Thread(target=server.serve_forever, name="replay_go_server", daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def main():
+    """Runs the replay server in the foreground."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("recording_path")
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = ReplayGetOrganizedServer(("127.0.0.1", args.port), args.recording_path, **get_stub_options(args))
+
+    print(f"Replaying {args.recording_path} on http://127.0.0.1:{args.port}")
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,236 @@
+"""
+Runs main.main end-to-end against a local GetOrganized server, without Orchestrator and without touching production.
+
+By default the run goes against the stub server, with a generated employee list and one small PDF per employee. Given a recording made
+with main.main(go_recording_path=...), the run goes against the replay server instead, with the pseudonymized employee list written
+next to the recording. Either way the server can add latency and inject faults, and every run starts from an empty run state,
+so a change to the throughput can be measured the same way every time.
+
+Run from the repository root with:
+    python -m benchmarks.run_offline --employees 500 --latency 0.02 --workers 8
+    python -m benchmarks.run_offline --employees 500 --latency 0.02 --workers 8 --stream
+    python -m benchmarks.run_offline --recording go_recording.jsonl --latency 0.05 --fault-rate 0.05
+"""
+import argparse
+import os
+import tempfile
+import time
+import uuid
+
+from collections import Counter
+from types import SimpleNamespace
+
+import pandas as pd
+
+from OpenOrchestrator.database.queues import QueueStatus
+
+from benchmarks.replay_go_server import start_replay_server
+from benchmarks.stub_go_server import start_stub_server
+
+from helper_scripts.file_handler import FileHandler
+
+import main as masseforsendelse
+
+EMPLOYEE_LIST_FILENAME = "Masseforsendelse.xlsx"
+
+EMPLOYEE_LIST_SHEET_NAME = "Ansatte"
+
+# A minimal, valid PDF - the content of the documents does not matter to GetOrganized's upload endpoint
+PDF_BYTES = b"%PDF-1.4\n1 0 obj<</Type/Catalog>>endobj\ntrailer<</Root 1 0 R>>\n%%EOF\n"
+
+
+class OfflineOrchestratorConnection:
+    """
+    Stands in for OrchestratorConnection, with the constants and credentials main.main needs, and the log and the queues kept in memory.
+
+    Attributes:
+    - constants (dict): The value of each constant.
+    - log_counts (Counter): The number of messages logged at each level.
+    - queues (dict): The elements of each queue, in the order they were created.
+    """
+    def __init__(self, api_endpoint: str):
+        self.constants = {
+            "go_api_endpoint": api_endpoint,
+            "DbConnectionString": "",
+            "journalizing_tmp_path": tempfile.gettempdir(),
+        }
+        self.log_counts = Counter()
+        self.queues = {}
+
+    def get_constant(self, constant_name: str) -> SimpleNamespace:
+        """Returns the constant, with its value."""
+
+        return SimpleNamespace(name=constant_name, value=self.constants[constant_name])
+
+    def get_credential(self, credential_name: str) -> SimpleNamespace:
+        """Returns a credential with a fixed username and password - the local servers accept anything."""
+
+        return SimpleNamespace(name=credential_name, username="offline", password="offline")
+
+    def log_trace(self, _message: str) -> None:
+        """Counts a trace message."""
+
+        self.log_counts["trace"] += 1
+
+    def log_info(self, _message: str) -> None:
+        """Counts an info message."""
+
+        self.log_counts["info"] += 1
+
+    def log_error(self, _message: str) -> None:
+        """Counts an error message."""
+
+        self.log_counts["error"] += 1
+
+    def bulk_create_queue_elements(self, queue_name: str, references: tuple, data: tuple, created_by: str = None) -> None:
+        """Adds the queue elements to the queue, with the status New."""
+
+        self.queues.setdefault(queue_name, []).extend(
+            SimpleNamespace(id=str(uuid.uuid4()), reference=reference, data=element_data, created_by=created_by, status=QueueStatus.NEW, message=None)
+            for reference, element_data in zip(references, data)
+        )
+
+    def get_queue_elements(self, queue_name: str, offset: int = 0, limit: int = 100) -> tuple:
+        """Returns a page of the elements of the queue."""
+
+        return tuple(self.queues.get(queue_name, [])[offset:offset + limit])
+
+    def get_next_queue_element(self, queue_name: str) -> SimpleNamespace | None:
+        """Returns the first New element of the queue, set to In Progress - or None if there is none."""
+
+        for queue_element in self.queues.get(queue_name, []):
+            if queue_element.status == QueueStatus.NEW:
+                queue_element.status = QueueStatus.IN_PROGRESS
+
+                return queue_element
+
+        return None
+
+    def set_queue_element_status(self, element_id: str, status: QueueStatus, message: str = None) -> None:
+        """Sets the status and message of a queue element."""
+
+        for queue_elements in self.queues.values():
+            for queue_element in queue_elements:
+                if queue_element.id == element_id:
+                    queue_element.status, queue_element.message = status, message
+
+    def count_queue_statuses(self) -> dict:
+        """Returns the number of elements with each status, over all queues."""
+
+        return dict(Counter(queue_element.status.value for queue_elements in self.queues.values() for queue_element in queue_elements))
+
+
+def write_employee_list(folder_path: str, employee_count: int) -> list[str]:
+    """Writes a generated employee list with the stub server's employment code, and returns the CPR numbers."""
+
+    cprs = [f"{i:010d}" for i in range(1, employee_count + 1)]
+
+    pd.DataFrame({
+        "Tjenestenummer": "12345",
+        "CPR": cprs,
+        "Navn": [f"Testperson {i}" for i in range(1, employee_count + 1)],
+        "Stilling": "Pædagog",
+    }).to_excel(os.path.join(folder_path, EMPLOYEE_LIST_FILENAME), sheet_name=EMPLOYEE_LIST_SHEET_NAME, index=False)
+
+    return cprs
+
+
+def copy_recorded_employee_list(folder_path: str, recording_path: str) -> list[str]:
+    """Copies the pseudonymized employee list of a recording into the run folder, and returns its CPR numbers."""
+
+    recorded_employees = pd.read_excel(f"{os.path.splitext(recording_path)[0]}_employees.xlsx", sheet_name=None, dtype=str)
+
+    _, employees = next(iter(recorded_employees.items()))
+
+    employees.to_excel(os.path.join(folder_path, EMPLOYEE_LIST_FILENAME), sheet_name=EMPLOYEE_LIST_SHEET_NAME, index=False)
+
+    cpr_mapping, _ = FileHandler(directory=folder_path).build_cpr_mapping(filename=EMPLOYEE_LIST_FILENAME, sheet_name=EMPLOYEE_LIST_SHEET_NAME)
+
+    return list(cpr_mapping)
+
+
+def main():
+    """Prepares the run folder, starts the local server, and runs main.main against it."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--recording", default=None, help="replay this recording instead of running against the stub server")
+    parser.add_argument("--record", default="", help="record the run to this file, e.g. to check that a recording replays")
+    parser.add_argument("--employees", type=int, default=200, help="the number of generated employees, when running against the stub server")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--fault-status", type=int, default=503)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--stream", action="store_true", help="stream the two phases, as with main.main(stream_phases=True)")
+    parser.add_argument("--queue", action="store_true", help="run in the queue-driven mode, with an in-memory queue")
+    parser.add_argument("--case-index", action="store_true", help="build the local case index before the run, so the cases are not searched for")
+    parser.add_argument("--sub-cases", type=int, default=0, help="the number of sub-cases per employee folder, so the sub-cases are probed")
+    args = parser.parse_args()
+
+    server_options = {"latency": args.latency, "fault_rate": args.fault_rate, "fault_status": args.fault_status, "seed": args.seed}
+
+    if args.recording:
+        server, api_endpoint = start_replay_server(args.recording, **server_options)
+
+    else:
+        # The case search of the stub server finds a salary case for every generated employee, for the case index to be built from
+        server, api_endpoint = start_stub_server(**server_options, case_folders=args.employees if args.case_index else 0, sub_cases=args.sub_cases)
+
+    with tempfile.TemporaryDirectory() as folder_path:
+        files_to_journalize_path = os.path.join(folder_path, "udsendte_dokumenter")
+
+        os.makedirs(files_to_journalize_path)
+
+        if args.recording:
+            cprs = copy_recorded_employee_list(folder_path, args.recording)
+
+        else:
+            cprs = write_employee_list(folder_path, args.employees)
+
+        for cpr in cprs:
+            with open(os.path.join(files_to_journalize_path, f"{cpr}.pdf"), mode="wb") as pdf_file:
+                pdf_file.write(PDF_BYTES)
+
+        orchestrator_connection = OfflineOrchestratorConnection(api_endpoint)
+
+        start = time.perf_counter()
+
+        masseforsendelse.main(
+            orchestrator_connection=orchestrator_connection,
+            masseforsendelse_folder_path=folder_path,
+            employee_list_filename=EMPLOYEE_LIST_FILENAME,
+            employee_list_sheet_name=EMPLOYEE_LIST_SHEET_NAME,
+            files_to_journalize_path=files_to_journalize_path,
+            final_journalized_filename="Offline test",
+            document_category="Udgående",
+            case_type="PER",
+            case_title="Ansættelse og lønaftaler",
+            resolution_workers=args.workers,
+            upload_workers=args.workers,
+            journalize_and_finalize=True,
+            log_level=args.log_level,
+            log_filename="",
+            progress_report_seconds=10,
+            go_recording_path=args.record,
+            stream_phases=args.stream,
+            queue_name="Masseforsendelse offline" if args.queue else "",
+            case_index_path=os.path.join(folder_path, "case_index.db") if args.case_index else "",
+            case_index_refresh="full" if args.case_index else "",
+            case_index_start_date="2024-01-01",
+        )
+
+        wall_seconds = time.perf_counter() - start
+
+        print(f"{len(cprs)} employees in {wall_seconds:.2f} s ({len(cprs) / wall_seconds:.1f} employees/s)")
+        print(f"Server: {dict(server.counters)}")
+        print(f"Orchestrator log: {dict(orchestrator_connection.log_counts)}")
+
+        if args.queue:
+            print(f"Queue: {orchestrator_connection.count_queue_statuses()}")
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,351 @@
+"""
+A local stub of the GetOrganized endpoints used by the robot, for benchmarking the client layer without touching production.
+
+The server speaks HTTP/1.1 with keep-alive, so connection reuse in the client can be measured, and every response can be delayed by a fixed latency.
+A share of the requests can be answered with an error status instead, optionally with a Retry-After header, to exercise the retry policy and the circuit breaker,
+and the server can be given a capacity, above which it answers 429, to exercise the rate limiters.
+
+Run from the repository root with:
+    python -m benchmarks.stub_go_server --port 8080 --latency 0.05 --fault-rate 0.1
+"""
+import argparse
+import json
+import random
+import re
+import threading
+import time
+
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubGetOrganizedHandler(BaseHTTPRequestHandler):
+    """Answers the GetOrganized endpoints with small, fixed responses."""
+
+    protocol_version = "HTTP/1.1"
+
+    # Headers and body are sent in one write, without Nagle's algorithm - otherwise every keep-alive response waits on a delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        """Silences the default request logging, which would dominate the measurements."""
+
+    def _send_json(self, status: int, body: dict) -> None:
+        encoded_body = json.dumps(body).encode("utf-8")
+
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded_body)))
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+    def _send_fault(self) -> bool:
+        """Answers the request with an injected error, if the server picks one, and returns True if it did."""
+
+        fault_status = self.server.pick_fault()
+
+        if fault_status is None:
+            return False
+
+        encoded_body = json.dumps({"Message": "Injected fault"}).encode("utf-8")
+
+        self.send_response(fault_status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(encoded_body)))
+
+        if self.server.faults.retry_after is not None:
+            self.send_header("Retry-After", str(self.server.faults.retry_after))
+
+        self.end_headers()
+        self.wfile.write(encoded_body)
+
+        return True
+
+    def _read_body(self) -> bytes:
+        content_length = int(self.headers.get("Content-Length", 0))
+
+        return self.rfile.read(content_length) if content_length else b""
+
+    def do_GET(self):  # pylint: disable=invalid-name
+        """Answers the case metadata endpoint."""
+
+        self.server.wait_latency()
+
+        if self._send_fault():
+            return
+
+        match = re.match(r"^/_goapi/Cases/Metadata/(?P<case_id>[^/?]+)", self.path)
+
+        if not match:
+            self._send_json(404, {"Message": f"Unknown path {self.path}"})
+
+            return
+
+        case_id = match.group("case_id")
+
+        # A sub-case guessed from an empty folder ID, e.g. '-001', does not exist either
+        if not re.match(r"^[A-Z]+-\d{4}-\d{6}(-\d{3})?$", case_id):
+            self._send_json(500, {"Message": f"The case {case_id} does not exist"})
+
+            return
+
+        case_title = "Ansættelse og lønaftaler"
+
+        sub_case_match = re.match(r"^.+-(?P<number>\d{3})$", case_id)
+
+        if sub_case_match and self.server.sub_cases:
+            # GetOrganized answers a case that does not exist with a 500 - the salary case is the last sub-case of each folder
+            if int(sub_case_match.group("number")) > self.server.sub_cases:
+                self._send_json(500, {"Message": f"The case {case_id} does not exist"})
+
+                return
+
+            if int(sub_case_match.group("number")) < self.server.sub_cases:
+                case_title = "Personalesag"
+
+        # The employee folder PER-2025-000007 belongs to the employee with the CPR number 0000000007, as generated by benchmarks/run_offline.py
+        folder_match = re.match(r"^PER-2025-(?P<number>\d{6})$", case_id)
+
+        contact_data = f' ows_CCMContactData="Testperson;#{int(folder_match.group("number"))};#{folder_match.group("number").zfill(10)}"' if folder_match else ""
+
+        metadata = f'<z:row xmlns:z="#RowsetSchema" ows_CaseID="{case_id}" ows_Title="{case_title}" ows_EmploymentCode="12345"{contact_data} />'
+
+        self._send_json(200, {"Metadata": metadata})
+
+    def do_POST(self):  # pylint: disable=invalid-name
+        """Answers the contact, case search, document upload and document search endpoints."""
+
+        body = self._read_body()
+
+        self.server.wait_latency()
+
+        if self._send_fault():
+            return
+
+        path = self.path.lower()
+
+        if path.endswith("/contacts/readitem"):
+            self._send_json(200, {"FullName": "Test Testperson", "ID": "1234"})
+
+        elif path.endswith("/cases/findbycaseproperties/") and self.server.sub_cases and "ows_Title" in body.decode("utf-8"):
+            # With sub-cases, the search on the case title finds nothing, so the robot falls back to probing the sub-cases of the folder
+            self._send_json(200, {"CasesInfo": []})
+
+        elif path.endswith("/cases/findbycaseproperties/"):
+            self._send_json(200, {"CasesInfo": [{"CaseID": "PER-2025-000001-001", "RelativeUrl": "/cases/PER/PER-2025-000001"}]})
+
+        elif path.endswith("/documents/addtocase"):
+            self._send_json(200, {"DocId": self.server.next_document_id(json.loads(body))})
+
+        elif path.endswith("/search/modernsearch") and json.loads(body or b"{}").get("QueryType") == "Case":
+            self._send_json(200, {"Rows": {"Results": self.server.find_cases(json.loads(body))}})
+
+        elif path.endswith("/search/results") or path.endswith("/search/modernsearch"):
+            self._send_json(200, {"Rows": {"Results": []}})
+
+        elif "/documents/markmultipleascaserecord/" in path or "/documents/finalizemultiple/" in path:
+            rejected_document_ids = self.server.rejected_document_ids.intersection(json.loads(body).get("DocumentIds", []))
+
+            if rejected_document_ids:
+                self._send_json(400, {"Message": f"The documents {sorted(rejected_document_ids)} can not be journalized or finalized"})
+
+            else:
+                self._send_json(200, {})
+
+        else:
+            self._send_json(404, {"Message": f"Unknown path {self.path}"})
+
+
+@dataclass
+class StubFaults:
+    """
+    The faults injected by the stub server.
+
+    Attributes:
+    - rate (float): The share of requests answered with the fault status instead, between 0 and 1.
+    - status (int): The HTTP status of the injected faults.
+    - retry_after (float): Optional number of seconds sent in a Retry-After header with the injected faults.
+    - capacity (float): Optional number of requests per second the server handles - requests above it are answered with 429.
+    """
+    rate: float = 0.0
+    status: int = 503
+    retry_after: float = None
+    capacity: float = 0
+
+
+class StubGetOrganizedServer(ThreadingHTTPServer):
+    """
+    A threaded HTTP server holding the configuration shared by the request handlers.
+
+    Attributes:
+    - latency (float): The number of seconds every response is delayed.
+    - faults (StubFaults): The faults injected, built from the fault_ keyword arguments, retry_after and capacity.
+    - counters (Counter): The number of 'requests' received, the number of 'faults' injected, and the number of 'documents' uploaded.
+    - uploaded_files (Counter): The number of documents uploaded per filename and document category.
+    - case_folders (int): The number of employee folders the case search finds, each with a salary case - PER-2025-000001-001 and so on.
+    - sub_cases (int): The number of sub-cases in every employee folder, the last one being the salary case - the metadata of a higher numbered
+      sub-case is answered with a 500, as for a case that does not exist. With 0, every sub-case exists and is a salary case.
+    - rejected_document_ids (set): The document IDs GetOrganized can not journalize or finalize - a call with any of them is answered with a 400.
+    """
+    daemon_threads = True
+
+    def __init__(
+        self,
+        server_address: tuple,
+        latency: float = 0.0,
+        fault_rate: float = 0.0,
+        fault_status: int = 503,
+        retry_after: float = None,
+        seed: int = None,
+        capacity: float = 0,
+        case_folders: int = 0,
+        sub_cases: int = 0,
+        rejected_document_ids: set = None,
+    ):
+        super().__init__(server_address, StubGetOrganizedHandler)
+        self.case_folders = case_folders
+        self.sub_cases = sub_cases
+        self.rejected_document_ids = set(rejected_document_ids or ())
+        self.latency = latency
+        self.faults = StubFaults(rate=fault_rate, status=fault_status, retry_after=retry_after, capacity=capacity)
+        self.counters = Counter(requests=0, faults=0, documents=0)
+        self.uploaded_files = Counter()
+        self._random = random.Random(seed)
+        self._capacity_bucket = (capacity, 0.0)
+        self._lock = threading.Lock()
+
+    def pick_fault(self) -> int | None:
+        """Counts the request, and returns the status of an injected fault, or None if the request should be answered normally."""
+
+        with self._lock:
+            self.counters["requests"] += 1
+
+            if self.faults.capacity > 0:
+                # A token bucket holding at most one second of capacity - an empty bucket means the server is over capacity
+                tokens, last_refill = self._capacity_bucket
+
+                now = time.monotonic()
+
+                tokens = min(self.faults.capacity, tokens + (now - last_refill) * self.faults.capacity)
+
+                self._capacity_bucket = (tokens - 1 if tokens >= 1 else tokens, now)
+
+                if tokens < 1:
+                    self.counters["faults"] += 1
+
+                    return 429
+
+            if self._random.random() >= self.faults.rate:
+                return None
+
+            self.counters["faults"] += 1
+
+            return self.faults.status
+
+    def find_cases(self, payload: dict) -> list[dict]:
+        """
+        Returns a page of the salary cases created in the date range of a case search. The employee folder number n is created
+        on day n % 365 of 2024, so a search over a window of dates finds a share of the folders.
+        """
+
+        date_filter = payload["CaseQueryFieldCollection"][0]
+
+        start_date, end_date = date_filter["Value"][:10], date_filter["ToValue"][:10]
+
+        cases = [
+            {"CaseID": f"PER-2025-{number:06d}-001", "Title": "Ansættelse og lønaftaler"}
+            for number in range(1, self.case_folders + 1)
+            if start_date <= (date(2024, 1, 1) + timedelta(days=number % 365)).isoformat() < end_date
+        ]
+
+        page_size, page_index = payload["PageSize"], payload["QueryPageIndex"]
+
+        return cases[page_size * page_index:page_size * (page_index + 1)]
+
+    def wait_latency(self) -> None:
+        """Delays the current response by the configured latency."""
+
+        if self.latency > 0:
+            threading.Event().wait(self.latency)
+
+    def next_document_id(self, document: dict) -> int:
+        """Counts an uploaded document, and returns a new, unique document ID."""
+
+        category_match = re.search(r'ows_Korrespondance="(?P<category>[^"]*)"', document.get("Metadata", ""))
+
+        with self._lock:
+            self.counters["documents"] += 1
+            self.uploaded_files[(document.get("FileName"), category_match.group("category") if category_match else None)] += 1
+
+            return self.counters["documents"]
+
+
+def start_stub_server(port: int = 0, latency: float = 0.0, **fault_options) -> tuple[StubGetOrganizedServer, str]:
+    """
+    Starts the stub server in a background thread.
+
+    Parameters:
+    - port (int): The port to listen on - 0 picks a free port.
+    - latency (float): The number of seconds every response is delayed.
+    - fault_options: Passed on to StubGetOrganizedServer - fault_rate, fault_status, retry_after, seed, capacity, case_folders, sub_cases
+      and rejected_document_ids.
+
+    Returns:
+    - tuple: The running server, and its base url to use as the GetOrganized api endpoint.
+    """
+
+    server = StubGetOrganizedServer(("127.0.0.1", port), latency=latency, **fault_options)
+
+    threading.Thread(target=server.serve_forever, name="stub_go_server", daemon=True).start()
+
+    return server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def add_stub_arguments(parser: argparse.ArgumentParser) -> None:
+    """Adds the command line options of the latency and the injected faults to a parser."""
+
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--fault-rate", type=float, default=0.0)
+    parser.add_argument("--fault-status", type=int, default=503)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--capacity", type=float, default=0)
+    parser.add_argument("--case-folders", type=int, default=0, help="the number of employee folders the case search finds")
+    parser.add_argument("--sub-cases", type=int, default=0, help="the number of sub-cases in every employee folder, the last one being the salary case")
+
+
+def get_stub_options(args: argparse.Namespace) -> dict:
+    """Returns the keyword arguments of StubGetOrganizedServer, from the options added by add_stub_arguments."""
+
+    return {
+        "latency": args.latency,
+        "fault_rate": args.fault_rate,
+        "fault_status": args.fault_status,
+        "retry_after": args.retry_after,
+        "seed": args.seed,
+        "capacity": args.capacity,
+        "case_folders": args.case_folders,
+        "sub_cases": args.sub_cases,
+    }
+
+
+def main():
+    """Runs the stub server in the foreground."""
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    add_stub_arguments(parser)
+    args = parser.parse_args()
+
+    server = StubGetOrganizedServer(("127.0.0.1", args.port), **get_stub_options(args))
+
+    print(f"Stub GetOrganized server listening on http://127.0.0.1:{args.port}")
+
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
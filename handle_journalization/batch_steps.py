@@ -0,0 +1,204 @@
+"""
+This module journalizes and finalizes the uploaded documents in batches, as a separate phase after the uploads.
+
+GetOrganized's MarkMultipleAsCaseRecord and FinalizeMultiple endpoints both accept a list of document IDs, so the documents
+collected in the run state are sent in chunks, instead of one call per document. A chunk that GetOrganized rejects with a client error
+is split in two, and the halves are sent on their own, until the documents that make it fail are isolated - the rest of the chunk still goes through.
+A server or connection error is not caused by the documents, so splitting would only send the same failing call again and again -
+the step is stopped instead, and the documents left are picked up on the next run.
+"""
+import logging
+import time
+
+from dataclasses import dataclass
+
+import requests
+
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.retry_policy import REJECTED_STATUSES
+from helper_scripts.run_state_store import RunStateStore
+
+logger = logging.getLogger(__name__)
+
+BATCH_STEP_ENDPOINTS = {
+    "journalize": '/_goapi/Documents/MarkMultipleAsCaseRecord/ByDocumentId',
+    "finalize": '/_goapi/Documents/FinalizeMultiple/ByDocumentId',
+}
+
+
+@dataclass
+class BatchStepStats:
+    """
+    The outcome of a batch step, for the log.
+
+    Attributes:
+    - documents (int): The number of documents the step was run for.
+    - succeeded (int): The number of documents the step succeeded for.
+    - failed (int): The number of documents isolated as failing, stored with their error text in the run state.
+    - unsent (int): The number of documents left when the step was stopped by a server or connection error, stored with its error text in the run state.
+    - calls (int): The number of calls sent to GetOrganized, including retries and the calls on split chunks.
+    """
+    documents: int = 0
+    succeeded: int = 0
+    failed: int = 0
+    unsent: int = 0
+    calls: int = 0
+
+
+def _is_document_error(error: requests.RequestException) -> bool:
+    """Returns True if GetOrganized rejected the documents of a call with a client error, rather than failing to handle the call at all."""
+
+    response = getattr(error, "response", None)
+
+    return isinstance(error, requests.HTTPError) and response is not None and 400 <= response.status_code < 500 and response.status_code not in REJECTED_STATUSES
+
+
+def run_batch_step(
+    step: str,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    chunk_size: int = 200,
+    max_attempts: int = 1,
+    retry_wait_sec: float = 5,
+) -> BatchStepStats:
+    """
+    Runs a batch step for every uploaded document in the run state that still needs it.
+
+    Parameters:
+    - step (str): 'journalize' or 'finalize'. Only documents that are journalized can be finalized.
+    - document_handler (DocumentHandler): The handler sending the calls.
+    - run_state (RunStateStore): The run state the documents are read from, and the outcomes are stored in.
+    - chunk_size (int): The maximum number of documents sent in one call.
+    - max_attempts (int): The number of times a chunk is sent before it is split - or, for a single document, marked as failed.
+      Timeouts and overload errors are already retried by the retry policy of the document handler, so this is only worth raising without one.
+    - retry_wait_sec (float): The number of seconds to wait between attempts.
+
+    A chunk is only split when GetOrganized answers it with a client error. On a server or connection error, the step is stopped, and the error text
+    is stored for every document not handled yet, so they are sent on the next run.
+
+    Returns:
+    - BatchStepStats: The number of documents and calls of the step.
+    """
+
+    send_chunk = document_handler.journalize_document if step == "journalize" else document_handler.finalize_document
+
+    documents = run_state.get_documents_for_batch_step(step)
+
+    stats = BatchStepStats(documents=len(documents))
+
+    def send_with_retries(chunk: list[tuple]) -> requests.RequestException | None:
+        """Sends a chunk, retrying failed attempts, and returns the error of the last attempt, or None if it succeeded."""
+
+        # The doc IDs come back from the database as text, but GetOrganized returned them as integers
+        document_ids = [int(doc_id) if str(doc_id).isdigit() else doc_id for _, doc_id in chunk]
+
+        error = None
+
+        for attempt in range(max_attempts):
+            if attempt:
+                time.sleep(retry_wait_sec)
+
+            stats.calls += 1
+
+            try:
+                send_chunk(document_ids, BATCH_STEP_ENDPOINTS[step])
+
+                return None
+
+            except requests.RequestException as e:
+                error = e
+
+        return error
+
+    def process_chunk(chunk: list[tuple]) -> str | None:
+        """Sends a chunk, splitting it until the failing documents are isolated, and returns the error text if the step has to be stopped."""
+
+        error = send_with_retries(chunk)
+
+        if error is None:
+            run_state.record_batch_step(step, [cpr for cpr, _ in chunk])
+
+            stats.succeeded += len(chunk)
+
+            return None
+
+        if not _is_document_error(error):
+            return str(error)
+
+        if len(chunk) == 1:
+            run_state.record_batch_step(step, [cpr for cpr, _ in chunk], error=str(error))
+
+            stats.failed += 1
+
+            return None
+
+        # We split the chunk in two, so a single bad document ID does not hold back the rest of the chunk
+        middle = len(chunk) // 2
+
+        return process_chunk(chunk[:middle]) or process_chunk(chunk[middle:])
+
+    for start in range(0, len(documents), chunk_size):
+        stop_error = process_chunk(documents[start:start + chunk_size])
+
+        if stop_error is not None:
+            # The chunks, and the halves of a split chunk, are handled in order, so the documents not handled yet are the ones after those counted
+            unsent_documents = documents[stats.succeeded + stats.failed:]
+
+            run_state.record_batch_step(step, [cpr for cpr, _ in unsent_documents], error=stop_error)
+
+            stats.unsent = len(unsent_documents)
+
+            logger.error("The %s step was stopped by GetOrganized failing - %d document(s) are left for the next run: %s", step, stats.unsent, stop_error)
+
+            break
+
+    return stats
+
+
+def journalize_and_finalize_documents(
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    chunk_size: int = 200,
+    max_attempts: int = 1,
+    retry_wait_sec: float = 5,
+) -> dict[str, BatchStepStats]:
+    """
+    Journalizes, and then finalizes, every uploaded document in the run state that is not done yet.
+
+    Documents that fail a step are stored with the error text in the batch_error column, and are picked up again on the next run.
+    If the journalize step is stopped by a server or connection error, the finalize step is not run.
+    The parameters are passed on to run_batch_step.
+
+    Returns:
+    - dict: The BatchStepStats of each step.
+    """
+
+    all_stats = {}
+
+    for step in ("journalize", "finalize"):
+        logger.debug("Running the %s step in chunks of %d documents.", step, chunk_size)
+
+        stats = run_batch_step(
+            step=step,
+            document_handler=document_handler,
+            run_state=run_state,
+            chunk_size=chunk_size,
+            max_attempts=max_attempts,
+            retry_wait_sec=retry_wait_sec,
+        )
+
+        logger.info("%s: %s", step, stats)
+
+        if stats.failed:
+            logger.error("The %s step failed for %d document(s) - they will be retried on the next run", step, stats.failed)
+
+        else:
+            logger.debug("The %s step succeeded for %d document(s) in %d call(s).", step, stats.succeeded, stats.calls)
+
+        all_stats[step] = stats
+
+        if stats.unsent:
+            # GetOrganized is failing, so the next step is left for the next run as well
+            break
+
+    return all_stats
@@ -2,14 +2,15 @@
 This module handles the journalization process for case management.
 It contains functionality to upload and journalize documents, and manage case data.
 """
+import logging
 import time
 
-from typing import Optional
-
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
 from helper_scripts.document_handler import DocumentHandler
 
+logger = logging.getLogger(__name__)
+
 
 class DatabaseError(Exception):
     """Custom exception for database related errors."""
@@ -46,51 +47,27 @@ def journalize_file(
     salary_document_to_journalize_as_byte_stream,
     orchestrator_connection: OrchestratorConnection
 ):
-    """Journalize associated files in the 'Document' folder under the citizen case."""
-
-    def call_journalization(journalize_and_finalize: bool = False) -> Optional[str]:
-        # Logic that actually calls all the functions
-        print("ABOUT TO CALL JOURNALIZATION FUNCTIONS ... \n")
-        try:
-            orchestrator_connection.log_trace("Uploading document(s) to the case.")
-            print("Uploading document(s) to the case.")
-
-            document_id = process_documents()
-
-            print(f"Document ID: {document_id}")
-
-            document_ids = []
-            document_ids.append(document_id)
-
-            journalize_and_finalize = False
-            # journalize_and_finalize = True
-
-            if journalize_and_finalize:
-                orchestrator_connection.log_trace("Journalizing documents in the case.")
-                print("Journalizing documents in the case.")
-                handle_journalization(document_ids)
-
-                orchestrator_connection.log_trace("Finalizing document(s) in the case.")
-                print("Finalizing document(s) in the case.")
-                handle_finalization(document_ids)
-
-            status_message = "Success"
+    """
+    Journalize associated files in the 'Document' folder under the citizen case.
 
-            return document_id, status_message
+    Returns:
+        A tuple of the document ID of the uploaded document, and the status message 'Success'.
 
-        except (DatabaseError, RequestError) as e:
-            print(f"An error occurred: {e}")
+    Raises:
+        RequestError: If the upload failed - the error, as any other, is raised to the caller, which stores its text in the run state.
+    """
 
-            status_message = "Error"
+    def call_journalization() -> tuple[str, str]:
+        # Logic that actually calls all the functions - a failure is raised as it is, so its cause is not lost
+        logger.debug("Uploading document(s) to case %s.", case_id)
 
-            return "Journalization process was unsuccessfull", status_message
+        document_id = process_documents()
 
-        except Exception as e:
-            print(f"An unexpected error occurred during file journalization: {e}")
+        # The document is journalized and finalized later, together with the other uploaded documents - see batch_steps.py
 
-            status_message = "Error"
+        status_message = "Success"
 
-            return "Journalization process was unsuccessfull", status_message
+        return document_id, status_message
 
     def process_documents():
         """N/A"""
@@ -101,86 +78,45 @@ def journalize_file(
 
         return doc_id
 
-    def upload_single_document(received_date, document_category, wait_sec=5):
+    def upload_single_document(received_date, document_category):
         """N/A"""
 
         file_bytes = salary_document_to_journalize_as_byte_stream
 
-        upload_status = "failed"
-
-        upload_attempts = 0
-
         file_bytes.seek(0)
-        data_in_bytes = list(file_bytes.read())
-
-        while upload_status == "failed" and upload_attempts < 1:
-            document_data = document_handler.create_document_metadata(
-                case_id=case_id,
-                filename=filename_with_extension,
-                data_in_bytes=data_in_bytes,
-                overwrite="true",  # Determines if the document should be overwritten if it already exists - based on the filename!
-                document_date=received_date,
-                document_title=filename_without_extension,
-                document_receiver="",
-                document_category=document_category
-            )
-
-            response = document_handler.upload_document(document_data, '/_goapi/Documents/AddToCase')
-
-            print(f"response: {response}")
-            print(f"response.ok: {response.ok}")
-            print(f"response.status_code: {response.status_code}")
-            print(f"response.text: {response.text}")
-            print(f"response.json(): {response.json()}\n")
 
-            upload_attempts += 1
+        # The document is sent as a base64 string, instead of a list of integers, which holds an 8 byte pointer per byte of the document
+        data_in_bytes = document_handler.encode_document_bytes(file_bytes.read())
 
-            if response.ok:
-                upload_status = "succeeded"
+        document_data = document_handler.create_document_metadata(
+            case_id=case_id,
+            filename=filename_with_extension,
+            data_in_bytes=data_in_bytes,
+            overwrite="true",  # Determines if the document should be overwritten if it already exists - based on the filename!
+            document_date=received_date,
+            document_title=filename_without_extension,
+            document_receiver="",
+            document_category=document_category
+        )
 
-            else:
-                time.sleep(wait_sec)
+        # Failed uploads are sent again by the retry policy of the document handler, when it is safe to do so
+        response = document_handler.upload_document(document_data, '/_goapi/Documents/AddToCase')
 
-        attempts_string = f"{upload_attempts} attempt"
+        upload_status = "succeeded" if response.ok else "failed"
 
-        attempts_string += "s" if upload_attempts > 1 else ""
-
-        orchestrator_connection.log_trace(f"Uploading {filename_with_extension} {upload_status} after {attempts_string}")
+        logger.debug("Uploading %s to case %s %s with status %s", filename_with_extension, case_id, upload_status, response.status_code)
 
         if not response.ok:
-            log_and_raise_error(orchestrator_connection, "An error occurred when uploading the document.", RequestError("Request response failed."))
+            log_and_raise_error(orchestrator_connection, "An error occurred when uploading the document.", RequestError(f"Request response failed with status {response.status_code}."))
 
         document_id = response.json()["DocId"]
 
-        orchestrator_connection.log_trace(f"Document uploaded with ID: {document_id}\n")
+        logger.debug("Document uploaded with ID: %s", document_id)
 
         return document_id
 
-    def handle_journalization(document_ids):
-        orchestrator_connection.log_trace("Journalizing document.")
-        print("Journalizing document.")
-        response = document_handler.journalize_document(document_ids, '/_goapi/Documents/MarkMultipleAsCaseRecord/ByDocumentId')
-
-        if not response.ok:
-            log_and_raise_error(orchestrator_connection, "An error occurred while journalizing the document.", RequestError("Request response failed."))
-
-        orchestrator_connection.log_trace("Document was journalized.")
-        print("Document was journalized.\n")
-
-    def handle_finalization(document_ids):
-        orchestrator_connection.log_trace("Finalizing document.")
-        print("Finalizing document.")
-        response = document_handler.finalize_document(document_ids, '/_goapi/Documents/FinalizeMultiple/ByDocumentId')
-
-        if not response.ok:
-            log_and_raise_error(orchestrator_connection, "An error occurred while finalizing the document.", RequestError("Request response failed."))
-
-        orchestrator_connection.log_trace("Document was finalized.")
-        print("Document was finalized.\n")
-
     doc_id = call_journalization()
 
-    orchestrator_connection.log_trace("Document journalization process completed.")
-    print("Document journalization process completed.")
+    logger.debug("Document journalization process completed for case %s.", case_id)
 
     return doc_id
@@ -2,123 +2,384 @@
 THIS IS A TEST SCRIPT
 """
 
+import logging
+import os
+
+from datetime import date
+
 from io import BytesIO
 
 from pathlib import Path
 
+from typing import Iterable
+
+import requests
+
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
 
+from handle_journalization import batch_steps
 from handle_journalization import journalize_process as jp
+from handle_journalization import upload_pipeline
 
 from helper_scripts import helper_functions
 
+from helper_scripts import run_state_store
+
 from helper_scripts.file_handler import FileHandler
 from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.logging_setup import PeriodicSummary
+from helper_scripts.progress_reporter import ProgressReporter
+from helper_scripts.run_state_store import RunStateStore
 
-LINE_BREAK = "\n\n\n-------------------------------------------------------------------------------------------------------------------------\n\n\n"
+logger = logging.getLogger(__name__)
+
+# The salary case ID given to the employees in CPRS_TO_IGNORE - their documents are skipped on purpose
+SPECIAL_CASE_ID = "SPECIAL CASE - CHECK CPRS_TO_IGNORE"
 
 
 def handle_journalization(
     orchestrator_connection: OrchestratorConnection,
     file_handler: FileHandler,
     document_handler: DocumentHandler,
-    csv_file: Path,
+    run_state: RunStateStore,
     files_to_journalize_path: str = "",
     journalized_filename: str = "",
     document_category: str = "",
-) -> None:
+    case_type: str = "",
+    search_start_date: str = "2000-01-01",
+    search_end_date: str = "",
+    max_workers: int = 1,
+    max_in_flight_bytes: int = 200 * 1024 * 1024,
+    write_batch_size: int = 50,
+    journalize_and_finalize: bool = False,
+    batch_chunk_size: int = 200,
+    summary_every: int = 100,
+    progress: ProgressReporter = None,
+) -> str:
 
     """
     main function for the script
+
+    The employees with a resolved salary case are read from the run state, and the outcome of every upload is stored in its uploaded_docs table,
+    which is exported to journalized_docs.csv at the end.
+    The documents are uploaded by a pipeline - a loader stage, max_workers upload workers and a single writer storing the outcomes in the original order.
+    max_in_flight_bytes caps the total size of the documents loaded, but not yet uploaded.
+    If the upload for one employee fails, the failure is stored with its error text and retried on the next run, while the other employees keep going.
+    Before the uploads, the documents already journalized with the journalized_filename title, in cases of case_type created between search_start_date
+    and search_end_date (default today), are found with one paged search, so no employee needs a search of their own.
+    If journalize_and_finalize is set, every uploaded document in the run state is then journalized and finalized, batch_chunk_size documents per call.
+    The outcome of each employee is logged at DEBUG, with a summary line at INFO every summary_every employees.
+    If a progress reporter is given, it is fed the status of every employee, and reports the throughput and ETA of the uploads.
     """
 
-    cpr_mapping = file_handler.get_cpr_csv_mapping(csv_file)
+    cpr_mapping = run_state.get_resolved_cases()
 
-    journalized_docs = file_handler.load_or_create_csv_with_headers("journalized_docs.csv", headers=["cpr", "doc_id"])
+    # Only the paths and sizes of the documents are indexed up front - each document is read right before it is uploaded, and released again afterwards
+    pdf_files = file_handler.index_files_by_cpr(folder_path=files_to_journalize_path, extension=".pdf")
 
-    pdf_files = {}
-    folder = Path(files_to_journalize_path)
-    for file in folder.glob('*.pdf'):
-        ssn = file.stem.split('_med_log')[0]
+    employees_to_journalize = []
 
-        pdf_files[ssn] = file.read_bytes()
+    for ssn, employees_salary_case_id in cpr_mapping.items():
+        if run_state.is_document_uploaded(ssn):
+            logger.debug("SSN %s already exists in journalized_docs. Skipping...", ssn)
 
-    for i, (key, value) in enumerate(cpr_mapping.items()):
-        ssn = key
+            continue
 
-        employees_salary_case_id = value
+        employees_to_journalize.append((ssn, employees_salary_case_id))
+
+    logger.info("%d employee(s) to journalize, %d already done", len(employees_to_journalize), len(cpr_mapping) - len(employees_to_journalize))
+
+    journalized_documents = None
+
+    if employees_to_journalize:
+        journalized_documents = find_journalized_documents(
+            document_handler=document_handler,
+            journalized_filename=journalized_filename,
+            case_type=case_type,
+            search_start_date=search_start_date,
+            search_end_date=search_end_date,
+        )
+
+    if progress:
+        progress.start(total=len(employees_to_journalize), already_done=len(cpr_mapping) - len(employees_to_journalize))
+
+    upload_employee_documents(
+        orchestrator_connection=orchestrator_connection,
+        document_handler=document_handler,
+        run_state=run_state,
+        employees=employees_to_journalize,
+        pdf_files=pdf_files,
+        journalized_filename=journalized_filename,
+        document_category=document_category,
+        journalized_documents=journalized_documents,
+        max_workers=max_workers,
+        max_in_flight_bytes=max_in_flight_bytes,
+        write_batch_size=write_batch_size,
+        summary=PeriodicSummary(logger, "Journalization", every=summary_every, total=len(employees_to_journalize)),
+        progress=progress,
+    )
+
+    return finish_journalization(
+        file_handler=file_handler,
+        document_handler=document_handler,
+        run_state=run_state,
+        journalize_and_finalize=journalize_and_finalize,
+        batch_chunk_size=batch_chunk_size,
+    )
+
+
+def find_journalized_documents(
+    document_handler: DocumentHandler,
+    journalized_filename: str,
+    case_type: str,
+    search_start_date: str = "2000-01-01",
+    search_end_date: str = "",
+) -> set | None:
+    """
+    Finds the documents already journalized with the journalized_filename title, in cases of case_type created between search_start_date
+    and search_end_date (default today), with one paged search.
 
-        journalized_file_doc_id = None
+    Returns:
+        The index from helper_functions.build_journalized_documents_index, or None if the search failed - each employee's case is then searched on its own.
+    """
 
-        print(f"ssn: {ssn} - case_id for employees salary_case_folder: {employees_salary_case_id}\n")
+    try:
+        return helper_functions.build_journalized_documents_index(
+            document_handler=document_handler,
+            title=journalized_filename,
+            start_date=search_start_date,
+            end_date=search_end_date or date.today().isoformat(),
+            case_type_prefix=case_type,
+        )
 
-        is_already_journalized = False
+    except (requests.RequestException, ValueError) as e:
+        # Without the index, we fall back to searching each employee's case on its own
+        logger.warning("The pre-scan for already journalized documents failed: %s - searching per employee instead", e)
 
-        if file_handler.cpr_exists_in_csv(output_filename="journalized_docs.csv", cpr=ssn):
-            print(f"SSN {ssn} already exists in journalized_docs. Skipping...\n")
+        return None
 
-            print(LINE_BREAK)
 
-            continue
+def upload_employee_documents(
+    orchestrator_connection: OrchestratorConnection,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    employees: Iterable[tuple],
+    pdf_files: dict,
+    journalized_filename: str,
+    document_category: str,
+    journalized_documents: set = None,
+    max_workers: int = 1,
+    max_in_flight_bytes: int = 200 * 1024 * 1024,
+    write_batch_size: int = 50,
+    summary: PeriodicSummary = None,
+    progress: ProgressReporter = None,
+) -> list[upload_pipeline.PipelineResult]:
+    """
+    Uploads the document of each employee through the upload pipeline, and stores the outcomes in the uploaded_docs table of the run state.
 
-        if employees_salary_case_id == "SPECIAL CASE - CHECK CPRS_TO_IGNORE":
-            print("special case - skipping !!!")
+    employees is an iterable of (ssn, salary case ID) - it is consumed by the loader of the pipeline as the uploads go, so it can be a stream
+    of employees still being resolved. pdf_files is the index from FileHandler.index_files_by_cpr.
+    The summary and the progress reporter, if given, are fed the status of every employee, and finished at the end.
 
-        elif key not in pdf_files:
-            print(f"{key} not in pdf_files - skipping !!!")
+    Returns:
+        The results of the employees that failed.
+    """
 
-        else:
-            is_already_journalized = helper_functions.look_for_already_journalized_file(
-                document_handler=document_handler,
-                employees_salary_case_id=employees_salary_case_id,
-                filename_to_match=journalized_filename
-            )
+    def document_size(employee: tuple) -> int:
+        ssn, _ = employee
 
-            print(f"is_already_journalized: {is_already_journalized}")
+        if ssn not in pdf_files:
+            return 0
 
-            if is_already_journalized:
-                print(f"skipping {ssn} after check - already journalized")
+        _, file_size = pdf_files[ssn]
 
-            else:
-                print("Employee does not have existing journalized file - running upload and journalization process")
+        return file_size
 
-                # upload = False
-                upload = True
+    def load_document(employee: tuple) -> bytes:
+        ssn, _ = employee
 
-                if upload:
-                    salary_document_to_journalize_as_byte_stream = BytesIO(pdf_files.get(ssn))
+        if ssn not in pdf_files:
+            return None
 
-                    filename_with_extension = f"{journalized_filename}.pdf"
-                    filename_without_extension = journalized_filename
+        file_path, _ = pdf_files[ssn]
 
-                    print(f"filename_with_extension: {filename_with_extension}")
-                    print(f"filename_without_extension: {filename_without_extension}\n")
+        return Path(file_path).read_bytes()
 
-                    journalized_file_doc_id, status_message = jp.journalize_file(
-                        document_category=document_category,
-                        document_handler=document_handler,
-                        case_id=employees_salary_case_id,
-                        filename_with_extension=filename_with_extension,
-                        filename_without_extension=filename_without_extension,
-                        salary_document_to_journalize_as_byte_stream=salary_document_to_journalize_as_byte_stream,
-                        orchestrator_connection=orchestrator_connection
-                    )
+    def upload_document(employee: tuple, document_bytes: bytes):
+        ssn, employees_salary_case_id = employee
 
-                    if status_message != "Success":
-                        print("An error occurred")
+        return journalize_employee_document(
+            orchestrator_connection=orchestrator_connection,
+            document_handler=document_handler,
+            ssn=ssn,
+            employees_salary_case_id=employees_salary_case_id,
+            document_bytes=document_bytes,
+            journalized_filename=journalized_filename,
+            document_category=document_category,
+            journalized_documents=journalized_documents,
+        )
 
-                        break
+    pending_rows = []
 
-        print(f"\nFinal journalized file doc id: {journalized_file_doc_id}")
+    def write_result(result: upload_pipeline.PipelineResult) -> None:
+        ssn, employees_salary_case_id = result.item
 
-        if journalized_file_doc_id:
-            mapping_entry = {ssn: journalized_file_doc_id}
+        if result.error:
+            # The failure is stored with its error text - failed employees are picked up again on the next run
+            logger.warning("An error occurred for SSN %s: %s - continuing with the other employees", ssn, result.error)
+
+            status = run_state_store.DOC_FAILED
+
+            pending_rows.append((ssn, employees_salary_case_id, None, status, str(result.error)))
 
         else:
-            mapping_entry = {ssn: "CPR NOT PROPERLY HANDLED - Please investigate this SSN"}
+            journalized_file_doc_id, status = result.value
+
+            logger.debug("Final journalized file doc id for SSN %s: %s (%s)", ssn, journalized_file_doc_id, status)
+
+            pending_rows.append((ssn, employees_salary_case_id, journalized_file_doc_id, status, None))
+
+        if len(pending_rows) >= write_batch_size:
+            flush_results()
+
+        if summary:
+            summary.add(status)
+
+        if progress:
+            progress.add(status)
+
+    def flush_results() -> None:
+        run_state.record_uploaded_docs(pending_rows)
+
+        pending_rows.clear()
+
+    try:
+        failed_results = upload_pipeline.run_upload_pipeline(
+            items=employees,
+            item_size=document_size,
+            load_item=load_document,
+            upload_item=upload_document,
+            write_result=write_result,
+            max_workers=max_workers,
+            max_in_flight_bytes=max_in_flight_bytes,
+        )
+
+    finally:
+        # Whatever is uploaded so far is written, even if the run is interrupted
+        flush_results()
+
+        if summary:
+            summary.log_final()
+
+        if progress:
+            progress.finish()
+
+    if failed_results:
+        logger.error("%d employee(s) failed during journalization, and will be retried on the next run", len(failed_results))
+
+    return failed_results
+
 
-        file_handler.append_cpr_case_mapping_csv(mapping=[mapping_entry], output_filename="journalized_docs.csv")
+def finish_journalization(
+    file_handler: FileHandler,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    journalize_and_finalize: bool = False,
+    batch_chunk_size: int = 200,
+) -> str:
+    """
+    Runs the batch phase journalizing and finalizing the uploaded documents, if journalize_and_finalize is set, and exports the uploaded_docs table.
+
+    Returns:
+        The path of journalized_docs.csv.
+    """
 
-        print(LINE_BREAK)
+    logger.info("Journalization outcomes: %s", run_state.count_by_status("uploaded_docs"))
+
+    if journalize_and_finalize:
+        batch_steps.journalize_and_finalize_documents(
+            document_handler=document_handler,
+            run_state=run_state,
+            chunk_size=batch_chunk_size,
+        )
+
+    # The run state is exported for the business users, who work with the CSV file
+    journalized_docs = run_state.export_csv("uploaded_docs", os.path.join(file_handler.directory, "journalized_docs.csv"))
 
     return journalized_docs
+
+
+def journalize_employee_document(
+    orchestrator_connection: OrchestratorConnection,
+    document_handler: DocumentHandler,
+    ssn: str,
+    employees_salary_case_id: str,
+    document_bytes: bytes,
+    journalized_filename: str,
+    document_category: str,
+    journalized_documents: set = None,
+):
+    """
+    Uploads the document for a single employee, unless the employee should be skipped, or already has the document journalized.
+
+    journalized_documents is the index from helper_functions.build_journalized_documents_index - if it is None, the employee's case is searched instead.
+
+    Returns:
+        A tuple of the document ID of the uploaded document (None if nothing was uploaded), and the DOC_ status of the run state.
+
+    Raises:
+        RequestError: If the upload failed.
+    """
+
+    journalized_file_doc_id = None
+
+    status = run_state_store.DOC_SKIPPED
+
+    logger.debug("ssn: %s - case_id for employees salary_case_folder: %s", ssn, employees_salary_case_id)
+
+    is_already_journalized = False
+
+    if employees_salary_case_id == SPECIAL_CASE_ID:
+        logger.debug("SSN %s is a special case - skipping", ssn)
+
+    elif document_bytes is None:
+        logger.warning("SSN %s has no document in the files to journalize - skipping", ssn)
+
+    else:
+        is_already_journalized = helper_functions.look_for_already_journalized_file(
+            document_handler=document_handler,
+            employees_salary_case_id=employees_salary_case_id,
+            filename_to_match=journalized_filename,
+            journalized_documents=journalized_documents,
+        )
+
+        if is_already_journalized:
+            logger.debug("Skipping SSN %s after check - already journalized", ssn)
+
+            status = run_state_store.DOC_ALREADY_JOURNALIZED
+
+        else:
+            logger.debug("SSN %s does not have an existing journalized file - running upload and journalization process", ssn)
+
+            # upload = False
+            upload = True
+
+            if upload:
+                salary_document_to_journalize_as_byte_stream = BytesIO(document_bytes)
+
+                filename_with_extension = f"{journalized_filename}.pdf"
+                filename_without_extension = journalized_filename
+
+                journalized_file_doc_id, _ = jp.journalize_file(
+                    document_category=document_category,
+                    document_handler=document_handler,
+                    case_id=employees_salary_case_id,
+                    filename_with_extension=filename_with_extension,
+                    filename_without_extension=filename_without_extension,
+                    salary_document_to_journalize_as_byte_stream=salary_document_to_journalize_as_byte_stream,
+                    orchestrator_connection=orchestrator_connection
+                )
+
+                status = run_state_store.DOC_UPLOADED
+
+    return journalized_file_doc_id, status
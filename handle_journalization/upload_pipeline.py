@@ -0,0 +1,220 @@
+"""
+This module provides a producer/consumer pipeline for uploading documents to GetOrganized.
+
+The pipeline has three stages:
+- A single loader thread, which loads the document for each item and hands it to the upload workers.
+- A pool of upload workers, which upload the documents in parallel.
+- A single writer stage, running in the calling thread, which receives the results in the original item order.
+
+The loader is held back by a bounded queue and an in-flight byte budget, so only a limited number of documents are held in memory at once.
+"""
+import queue
+import threading
+
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, Optional
+
+
+@dataclass
+class PipelineResult:
+    """
+    The outcome of a single item in the pipeline.
+
+    Attributes:
+    - item (Any): The item, as given to the pipeline.
+    - value (Any): The value returned by the upload function - None if the upload raised.
+    - error (Exception): The exception raised while loading or uploading the item - None if it succeeded.
+    """
+    item: Any
+    value: Any = None
+    error: Optional[Exception] = None
+
+
+class ByteBudget:
+    """
+    A counter of the bytes currently held by the pipeline, blocking new documents until enough bytes are released.
+
+    A single document larger than the whole budget is still let through, once nothing else is in flight, so it can never block the pipeline forever.
+
+    Attributes:
+    - max_bytes (int): The maximum number of bytes in flight at once.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._in_flight = 0
+        self._condition = threading.Condition()
+
+    def acquire(self, size: int) -> None:
+        """Blocks until size bytes fit within the budget, and then reserves them."""
+
+        with self._condition:
+            while self._in_flight > 0 and self._in_flight + size > self.max_bytes:
+                self._condition.wait()
+
+            self._in_flight += size
+
+    def release(self, size: int) -> None:
+        """Releases size bytes, and wakes up the loader if it is waiting."""
+
+        with self._condition:
+            self._in_flight -= size
+
+            self._condition.notify_all()
+
+
+_STOP = object()
+
+
+def run_upload_pipeline(
+    items: Iterable[Any],
+    item_size: Callable[[Any], int],
+    load_item: Callable[[Any], Any],
+    upload_item: Callable[[Any, Any], Any],
+    write_result: Callable[[PipelineResult], None],
+    max_workers: int = 4,
+    max_in_flight_bytes: int = 200 * 1024 * 1024,
+    max_queued_items: int = None,
+) -> list[PipelineResult]:
+    """
+    Runs every item through the load, upload and write stages.
+
+    A failing item never stops the pipeline - its exception is caught and handed to write_result in a PipelineResult, and the other workers keep going.
+
+    Parameters:
+    - items (Iterable[Any]): The items to process, in the order their results should be written.
+    - item_size (Callable): Called by the loader for each item, returning the size of its payload in bytes, before the payload is loaded.
+    - load_item (Callable): Called by the loader for each item, once its size fits within the byte budget, returning the payload.
+    - upload_item (Callable): Called by an upload worker with (item, payload), returning the value of the upload.
+    - write_result (Callable): Called from the calling thread with the PipelineResult of each item, in the original item order.
+    - max_workers (int): The number of upload workers.
+    - max_in_flight_bytes (int): The maximum number of payload bytes loaded but not yet uploaded.
+    - max_queued_items (int): The maximum number of loaded items waiting for a worker - defaults to twice the number of workers.
+
+    Returns:
+    - list[PipelineResult]: The results of the items that failed.
+    """
+
+    max_workers = max(1, max_workers)
+
+    byte_budget = ByteBudget(max_bytes=max_in_flight_bytes)
+
+    # The bounded work queue provides the backpressure - the loader blocks on put() once the workers fall behind
+    work_queue = queue.Queue(maxsize=max_queued_items or max_workers * 2)
+
+    result_queue = queue.Queue()
+
+    stop_event = threading.Event()
+
+    loader_errors = []
+
+    def loader():
+        item_count = 0
+
+        try:
+            for sequence_number, item in enumerate(items):
+                if stop_event.is_set():
+                    break
+
+                item_count += 1
+
+                size = 0
+
+                try:
+                    size = item_size(item)
+
+                    # The bytes are reserved before the payload is loaded, so the loader never holds a payload outside the budget
+                    byte_budget.acquire(size)
+
+                    payload = load_item(item)
+
+                except Exception as e:
+                    byte_budget.release(size)
+
+                    result_queue.put((sequence_number, PipelineResult(item=item, error=e)))
+
+                    continue
+
+                work_queue.put((sequence_number, item, payload, size))
+
+        except Exception as e:
+            # The items themselves could not be iterated - this is not tied to a single item, so it is raised from the writer once the workers are done
+            loader_errors.append(e)
+
+        finally:
+            for _ in range(max_workers):
+                work_queue.put(_STOP)
+
+            # Tell the writer how many results to wait for
+            result_queue.put((_STOP, item_count))
+
+    def worker():
+        while True:
+            work = work_queue.get()
+
+            if work is _STOP:
+                return
+
+            sequence_number, item, payload, size = work
+
+            try:
+                # If the writer has stopped, the remaining items are drained without being uploaded
+                if stop_event.is_set():
+                    continue
+
+                result = PipelineResult(item=item, value=upload_item(item, payload))
+
+            except Exception as e:
+                result = PipelineResult(item=item, error=e)
+
+            finally:
+                # Drop the reference to the payload before releasing its bytes, so the memory can actually be reclaimed
+                del payload
+
+                byte_budget.release(size)
+
+            result_queue.put((sequence_number, result))
+
+    threads = [threading.Thread(target=loader, name="upload_loader", daemon=True)]
+    threads += [threading.Thread(target=worker, name=f"upload_worker_{i}", daemon=True) for i in range(max_workers)]
+
+    for thread in threads:
+        thread.start()
+
+    failed_results = []
+
+    # The writer stage - results arrive in completion order, and are buffered until every earlier item has been written
+    pending_results = {}
+    next_sequence_number = 0
+    total_items = None
+
+    try:
+        while total_items is None or next_sequence_number < total_items:
+            sequence_number, result = result_queue.get()
+
+            if sequence_number is _STOP:
+                total_items = result
+
+                continue
+
+            pending_results[sequence_number] = result
+
+            while next_sequence_number in pending_results:
+                result = pending_results.pop(next_sequence_number)
+
+                if result.error:
+                    failed_results.append(result)
+
+                write_result(result)
+
+                next_sequence_number += 1
+
+    finally:
+        stop_event.set()
+
+    for thread in threads:
+        thread.join()
+
+    if loader_errors:
+        raise loader_errors[0]
+
+    return failed_results
@@ -0,0 +1,145 @@
+"""
+This module provides the per-call timing of the GetOrganized client layer, aggregated per endpoint.
+
+Every request sent through GetOrganizedClient._request is recorded once, with its total latency including retries, the time spent waiting
+on the rate limiter and the circuit breaker, its payload sizes, its final status and its number of attempts. At the end of a run, the
+summary shows which endpoints - searches, metadata lookups or uploads - dominate the time of a mailing.
+"""
+import csv
+import json
+import math
+import re
+import threading
+
+from collections import defaultdict
+from dataclasses import dataclass
+
+from helper_scripts.rate_limiter import classify_endpoint
+
+# The columns of the summary, in the order they are written to the CSV file
+SUMMARY_COLUMNS = [
+    "endpoint", "endpoint_class", "calls", "errors", "retries", "total_seconds", "share_of_time",
+    "p50_ms", "p95_ms", "p99_ms", "max_ms", "waited_seconds", "request_bytes", "response_bytes",
+]
+
+
+@dataclass
+class CallRecord:
+    """
+    A single recorded call.
+
+    Attributes:
+    - latency (float): The number of seconds from the first attempt until the final response or error, including retries and waits.
+    - waited (float): The number of seconds of the latency spent waiting on the rate limiter and the circuit breaker.
+    - request_bytes (int): The size of the request body of the last attempt.
+    - response_bytes (int): The size of the response body, 0 if no response was received.
+    - status (int): The HTTP status of the final response, 0 if no response was received.
+    - attempts (int): The number of attempts sent.
+    """
+    latency: float
+    waited: float
+    request_bytes: int
+    response_bytes: int
+    status: int
+    attempts: int
+
+
+def normalize_endpoint(method: str, endpoint_path: str) -> str:
+    """
+    Returns the name a call is aggregated under - the method and the path, with every path segment containing a digit replaced by '{id}',
+    so e.g. all case metadata lookups are aggregated together.
+    """
+
+    segments = endpoint_path.split("?")[0].split("/")
+
+    normalized_path = "/".join("{id}" if re.search(r"\d", segment) else segment for segment in segments)
+
+    return f"{method.upper()} {normalized_path}"
+
+
+def _percentile(sorted_values: list[float], percentile: float) -> float:
+    """Returns the nearest-rank percentile of a sorted, non-empty list."""
+
+    return sorted_values[max(0, math.ceil(percentile / 100 * len(sorted_values)) - 1)]
+
+
+class CallMetrics:
+    """
+    A thread-safe recorder of the calls sent to GetOrganized, shared by all handlers and workers.
+    """
+    def __init__(self):
+        self._records: dict[str, list[CallRecord]] = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def record(self, method: str, endpoint_path: str, call_record: CallRecord) -> None:
+        """
+        Records a call.
+
+        Parameters:
+        - method (str): The HTTP method.
+        - endpoint_path (str): The path of the endpoint, as passed to the handler.
+        - call_record (CallRecord): The measurements of the call.
+        """
+
+        endpoint = normalize_endpoint(method, endpoint_path)
+
+        with self._lock:
+            self._records[endpoint].append(call_record)
+
+    def summary(self) -> list[dict]:
+        """Returns one row per endpoint with the columns in SUMMARY_COLUMNS, the endpoint with the most total time first."""
+
+        with self._lock:
+            records_per_endpoint = {endpoint: list(records) for endpoint, records in self._records.items()}
+
+        total_seconds_all = sum(record.latency for records in records_per_endpoint.values() for record in records) or 1.0
+
+        rows = []
+
+        for endpoint, records in records_per_endpoint.items():
+            latencies = sorted(record.latency for record in records)
+
+            total_seconds = sum(latencies)
+
+            rows.append({
+                "endpoint": endpoint,
+                "endpoint_class": classify_endpoint(endpoint.split(" ", 1)[1]),
+                "calls": len(records),
+                "errors": sum(1 for record in records if record.status == 0 or record.status >= 400),
+                "retries": sum(record.attempts - 1 for record in records),
+                "total_seconds": round(total_seconds, 3),
+                "share_of_time": round(total_seconds / total_seconds_all, 3),
+                "p50_ms": round(_percentile(latencies, 50) * 1000, 1),
+                "p95_ms": round(_percentile(latencies, 95) * 1000, 1),
+                "p99_ms": round(_percentile(latencies, 99) * 1000, 1),
+                "max_ms": round(latencies[-1] * 1000, 1),
+                "waited_seconds": round(sum(record.waited for record in records), 3),
+                "request_bytes": sum(record.request_bytes for record in records),
+                "response_bytes": sum(record.response_bytes for record in records),
+            })
+
+        return sorted(rows, key=lambda row: row["total_seconds"], reverse=True)
+
+    def save(self, json_path: str = None, csv_path: str = None) -> list[dict]:
+        """
+        Writes the summary to a JSON file and/or a CSV file, and returns it.
+
+        Parameters:
+        - json_path (str): Optional path of the JSON file to write.
+        - csv_path (str): Optional path of the CSV file to write.
+        """
+
+        rows = self.summary()
+
+        if json_path:
+            with open(json_path, mode="w", encoding="utf-8") as json_file:
+                json.dump(rows, json_file, indent=2)
+
+        if csv_path:
+            with open(csv_path, mode="w", newline="", encoding="utf-8") as csv_file:
+                writer = csv.DictWriter(csv_file, fieldnames=SUMMARY_COLUMNS)
+
+                writer.writeheader()
+                writer.writerows(rows)
+
+        return rows
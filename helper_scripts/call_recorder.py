@@ -0,0 +1,159 @@
+"""
+This module records the requests sent to GetOrganized and the responses received, so a run can be replayed offline against a local server.
+
+Every CPR number in a recorded request or response is replaced by a pseudonym - a fake, but stable, ten-digit number derived from an HMAC
+of the CPR number. The same CPR number always gets the same pseudonym, so the recording stays consistent: a replayed run sending the
+pseudonym in a contact lookup gets the recorded contact back. See benchmarks/replay_go_server.py for the replay side.
+
+The names of employees are replaced the same way - the full name of a contact lookup, and the name in the contact data of a case search
+or case metadata ('name;#id;#cpr'). Titles, e.g. of cases and documents, and any other free text are recorded as they are, so a recording
+may still hold personal data, and must be kept somewhere access-controlled, like the data of the run itself - never in the repository.
+"""
+import hashlib
+import hmac
+import json
+import re
+import threading
+
+from collections import Counter
+from urllib.parse import urlsplit
+
+import pandas as pd
+import requests
+
+from helper_scripts.logging_setup import CPR_PATTERN
+
+# Request bodies up to this size are stored in the recording as well - larger bodies, i.e. uploaded documents, are only stored as a hash
+MAX_STORED_REQUEST_BODY = 64 * 1024
+
+# The full name of a contact lookup, e.g. '"FullName": "Test Testperson"'
+FULL_NAME_PATTERN = re.compile(r'("FullName"\s*:\s*")((?:[^"\\]|\\.)*)(")')
+
+# The name in contact data, e.g. 'Test Testperson;#1234;#0101011234' - in a JSON value or an escaped XML attribute of one
+CONTACT_NAME_PATTERN = re.compile(r'(?<=")((?:[^"\\;#]|\\u[0-9a-fA-F]{4})+)(?=;#\d*;#\d{6}-?\d{4})')
+
+
+def pseudonymize_cpr(cpr: str, secret: str) -> str:
+    """Returns the pseudonym of a CPR number - the same CPR number and secret always give the same pseudonym."""
+
+    digest = hmac.new(secret.encode("utf-8"), cpr.replace("-", "").encode("utf-8"), hashlib.sha256).hexdigest()
+
+    return f"{int(digest, 16) % 10 ** 10:010d}"
+
+
+def pseudonymize_cprs(text: str, secret: str) -> str:
+    """Returns the text with every CPR number replaced by its pseudonym."""
+
+    return CPR_PATTERN.sub(lambda match: pseudonymize_cpr(match.group(1) + match.group(2), secret), text)
+
+
+def pseudonymize_name(name: str, secret: str) -> str:
+    """Returns the pseudonym of a name - the same name and secret always give the same pseudonym, whether the name was JSON escaped or not."""
+
+    # A name sent by the robot is JSON escaped with ASCII only, while a received name may not be - both give the pseudonym of the plain name
+    plain_name = json.loads(f'"{name}"') if "\\" in name else name
+
+    digest = hmac.new(secret.encode("utf-8"), f"name:{plain_name}".encode("utf-8"), hashlib.sha256).hexdigest()
+
+    return f"Person {digest[:12]}"
+
+
+def pseudonymize_text(text: str, secret: str) -> str:
+    """Returns the text with every CPR number and every contact name replaced by its pseudonym."""
+
+    text = pseudonymize_cprs(text, secret)
+    text = FULL_NAME_PATTERN.sub(lambda match: match.group(1) + pseudonymize_name(match.group(2), secret) + match.group(3), text)
+
+    return CONTACT_NAME_PATTERN.sub(lambda match: pseudonymize_name(match.group(1), secret), text)
+
+
+def hash_request_body(body: str) -> str:
+    """Returns the hash a request body is matched on when it is replayed."""
+
+    return hashlib.sha256(body.encode("utf-8")).hexdigest()
+
+
+class CallRecorder:
+    """
+    A thread-safe recorder of GetOrganized requests and responses, writing one JSON line per exchange.
+
+    The recorder is attached to the shared session as a response hook, so every request of every handler and worker is recorded,
+    including the attempts that were retried. The NTLM handshake is not recorded.
+
+    Attributes:
+    - recording_path (str): The path of the JSON lines file the exchanges are appended to.
+    - secret (str): The secret the pseudonyms are derived with.
+    - counters (Counter): The number of 'recorded' exchanges.
+    """
+    def __init__(self, recording_path: str, secret: str):
+        self.recording_path = recording_path
+        self.secret = secret
+        self.counters = Counter(recorded=0)
+        self._recording_file = open(recording_path, mode="a", encoding="utf-8")  # pylint: disable=consider-using-with
+        self._lock = threading.Lock()
+
+    def attach(self, session: requests.Session) -> None:
+        """Records every response received through the session from now on."""
+
+        session.hooks["response"].append(self._on_response)
+
+    def _on_response(self, response: requests.Response, *_args, **_kwargs) -> None:
+        # The 401 of an NTLM handshake is answered by the authentication itself - only the final response is of interest
+        if response.status_code == 401:
+            return
+
+        self.record(response)
+
+    def record(self, response: requests.Response) -> None:
+        """Appends a response, and the request it answers, to the recording, with every CPR number and contact name pseudonymized."""
+
+        request_body = response.request.body or ""
+
+        if isinstance(request_body, bytes):
+            request_body = request_body.decode("utf-8", errors="replace")
+
+        request_body = pseudonymize_text(request_body, self.secret)
+
+        url = urlsplit(response.request.url)
+
+        exchange = {
+            "method": response.request.method,
+            "path": pseudonymize_cprs(f"{url.path}?{url.query}" if url.query else url.path, self.secret),
+            "request_sha256": hash_request_body(request_body),
+            "request_body": request_body if len(request_body) <= MAX_STORED_REQUEST_BODY else None,
+            "status": response.status_code,
+            "content_type": response.headers.get("Content-Type", ""),
+            "retry_after": response.headers.get("Retry-After"),
+            "elapsed": response.elapsed.total_seconds(),
+            "body": pseudonymize_text(response.text, self.secret),
+        }
+
+        line = json.dumps(exchange, ensure_ascii=False)
+
+        with self._lock:
+            self._recording_file.write(line + "\n")
+
+            self.counters["recorded"] += 1
+
+    def save_employee_list(self, cpr_dicts: dict, excel_path: str, sheet_name: str = "Ansatte") -> None:
+        """
+        Writes the employee list of the run with pseudonymized CPR numbers and without names, so a replayed run looks up the same employees.
+
+        Parameters:
+        - cpr_dicts (dict): The CPR mapping from FileHandler.build_cpr_mapping.
+        - excel_path (str): The path of the Excel file to write.
+        - sheet_name (str): The name of the sheet.
+        """
+
+        pd.DataFrame({
+            "Tjenestenummer": [data.get("tjenestenummer", "") for data in cpr_dicts.values()],
+            "CPR": [pseudonymize_cpr(cpr, self.secret) for cpr in cpr_dicts],
+            "Navn": "",
+            "Stilling": [data.get("stilling", "") for data in cpr_dicts.values()],
+        }).to_excel(excel_path, sheet_name=sheet_name, index=False)
+
+    def close(self) -> None:
+        """Flushes and closes the recording."""
+
+        with self._lock:
+            self._recording_file.close()
@@ -1,45 +1,47 @@
 """Module to handle journalisering functionality in GetOrganized."""
 from mbu_dev_shared_components.getorganized import objects
-from mbu_dev_shared_components.getorganized import cases
-from mbu_dev_shared_components.getorganized import contacts
 
+from helper_scripts.contact_cache import ContactCache
+from helper_scripts.go_client import GetOrganizedClient
+from helper_scripts.metadata_cache import MetadataCache
 
-class CaseHandler:
+
+class CaseHandler(GetOrganizedClient):
     """
     A class to manage the creation of cases in the GetOrganized system.
 
+    The requests mirror the ones in mbu_dev_shared_components.getorganized.cases and .contacts, but are sent through the shared, pooled session.
+
     Attributes:
     - api_username (str): The username for GetOrganized API.
     - api_password (str): The password for GetOrganized API.
+    - client_options: The optional session, rate_limiter, retry_policy and circuit_breaker shared with the other handlers - see GetOrganizedClient.
+    - metadata_cache (MetadataCache): Optional cache of parsed case metadata, used by helper_functions.get_case_metadata_attributes.
+    - contact_cache (ContactCache): Optional cache of contact lookups, used by helper_functions.contact_lookup.
+    - case_index (CaseIndexStore): Optional local index of salary case IDs, looked up before the case searches - see helper_scripts.case_index.
     """
-    def __init__(self, api_endpoint: str, api_username: str, api_password: str):
-        self.api_username = api_username
-        self.api_password = api_password
-        self.api_endpoint = api_endpoint
+    def __init__(
+        self,
+        api_endpoint: str,
+        api_username: str,
+        api_password: str,
+        metadata_cache: MetadataCache = None,
+        contact_cache: ContactCache = None,
+        case_index=None,
+        **client_options,
+    ):
+        super().__init__(api_endpoint, api_username, api_password, **client_options)
+        self.metadata_cache = metadata_cache
+        self.contact_cache = contact_cache
+        self.case_index = case_index
         self.case_obj = objects.CaseDataJson()
 
-    def _get_full_endpoint(self, path: str):
-        """
-        Constructs the full endpoint URL.
-
-        Parameters:
-        - path (str): The specific path for the API endpoint.
-
-        Returns:
-        - str: The full endpoint URL.
-        """
-        if path:
-            return f"{self.api_endpoint}{path}"
-        return self.api_endpoint
-
-    def get_case_metadata(self, endpoint_path):
+    def get_case_metadata(self, endpoint_path, probe=False):
         """
-        Function to retrieve metadata for a specified case
+        Function to retrieve metadata for a specified case - with probe set, for a case that may not exist, see GetOrganizedClient._request
         """
 
-        endpoint = self._get_full_endpoint(endpoint_path)
-
-        return cases.get_case_metadata(endpoint, self.api_username, self.api_password)
+        return self._request("GET", endpoint_path, probe=probe, headers={"Content-Type": "application/json"})
 
     def create_case_folder_data(
         self,
@@ -124,13 +126,20 @@ class CaseHandler:
         Parameters:
         - case_folder_search_data (str): JSON string of search data.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
+        return self._request("POST", endpoint_path, idempotent=True, headers={"Content-Type": "application/json"}, json=case_folder_search_data)
+
+    def search_cases_using_modern_search(self, page_index, search_term, start_date, end_date, case_type_prefix, date_field, endpoint_path):
+        """
+        Search for all cases related to a specified search_term, whilst applying pagination and a filter on the creation or modification date.
 
-        return cases.find_case_by_case_properties(
-            case_folder_search_data,
-            endpoint,
-            self.api_username,
-            self.api_password)
+        Parameters:
+        - date_field (str): 'Created' or 'Modified' - the case date the start_date and end_date apply to.
+        """
+
+        return self._modern_search(
+            endpoint_path, page_index, search_term, "Case", "Sager",
+            start_date=start_date, end_date=end_date, case_type_prefix=case_type_prefix, date_field=date_field,
+        )
 
     def create_case_folder(self, case_folder_data: str, endpoint_path: str):
         """
@@ -139,9 +148,7 @@ class CaseHandler:
         Parameters:
         - case_data (str): JSON string of case data.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
-
-        return cases.create_case_folder(case_folder_data, endpoint, self.api_username, self.api_password)
+        return self._request("POST", endpoint_path, headers={"Content-Type": "application/json"}, json=case_folder_data)
 
     def create_case(self, case_data: str, endpoint_path: str):
         """
@@ -150,9 +157,7 @@ class CaseHandler:
         Parameters:
         - case_data (str): JSON string of case data.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
-
-        return cases.create_case(case_data, endpoint, self.api_username, self.api_password)
+        return self._request("POST", endpoint_path, headers={"Content-Type": "application/json"}, json=case_data)
 
     def contact_lookup(self, person_ssn: str, endpoint_path: str):
         """
@@ -165,10 +170,8 @@ class CaseHandler:
         Returns:
         - str: JSON string of the contact information.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
+        # The body is form encoded by hand, the same way as in mbu_dev_shared_components, so the SSN is sent exactly as given
+        body = {"Id": person_ssn, "ContactDataFieldName": "CCMContactData"}
+        encoded_body = '&'.join([f"{key}={value}" for key, value in body.items()])
 
-        return contacts.contact_lookup(
-            person_ssn=person_ssn,
-            api_endpoint=endpoint,
-            api_username=self.api_username,
-            api_password=self.api_password)
+        return self._request("POST", endpoint_path, idempotent=True, headers={"Content-Type": "application/x-www-form-urlencoded"}, data=encoded_body)
@@ -0,0 +1,323 @@
+"""
+This module provides a local index of the salary cases in GetOrganized, so the case resolution can look a CPR number up without any request.
+
+The index is built once from a bulk export of the employee folders: the search pages through every sub-case titled with the case title,
+window by window of creation dates, and the metadata of each employee folder gives its CPR number and employment code. The result is kept
+in a SQLite database keyed by CPR number, employment code and case title. A refresh only pulls the cases modified since the last build,
+so an unchanged entry is confirmed by every refresh. An entry is stale when neither the entry itself nor the last build or refresh of its case title
+is younger than the max age of the index - the case resolution then falls back to the searches in GetOrganized, as it does for a CPR number not in the index.
+"""
+import logging
+import re
+import sqlite3
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+from helper_scripts import helper_functions
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.logging_setup import CPR_PATTERN
+
+logger = logging.getLogger(__name__)
+
+# The metadata attribute of an employee folder holding its contact - the CPR number of the employee is read from it
+FOLDER_CONTACT_ATTRIBUTE = "ows_CCMContactData"
+
+# A sub-case ID is the ID of its employee folder followed by a three-digit number, e.g. PER-2025-000001-001 in the folder PER-2025-000001
+SUB_CASE_ID_PATTERN = re.compile(r"^(?P<folder_id>.+)-\d{3}$")
+
+# The case search is paged window by window of this many days - a single query over all the years would hit the result limit of the search
+DEFAULT_WINDOW_DAYS = 90
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS case_index (
+    cpr TEXT NOT NULL,
+    employment_code TEXT NOT NULL,
+    case_title TEXT NOT NULL,
+    case_id TEXT NOT NULL,
+    folder_id TEXT,
+    indexed_at REAL NOT NULL,
+    PRIMARY KEY (cpr, employment_code, case_title)
+);
+
+CREATE TABLE IF NOT EXISTS index_builds (
+    case_type TEXT NOT NULL,
+    case_title TEXT NOT NULL,
+    built_on TEXT NOT NULL,
+    PRIMARY KEY (case_type, case_title)
+);
+"""
+
+
+def normalize_employment_code(employment_code: str) -> str:
+    """Returns the employment code without the 'XA' prefix some employee folders have, so both forms find the same entry."""
+
+    employment_code = (employment_code or "").strip()
+
+    return employment_code[2:] if employment_code.upper().startswith("XA") else employment_code
+
+
+class CaseIndexStore:
+    """
+    A thread-safe index of salary case IDs in an embedded SQLite database.
+
+    A single connection is shared by all threads, guarded by a lock, as in RunStateStore.
+
+    Attributes:
+    - db_path (str): The path to the SQLite database file. It is created if it does not exist.
+    - max_age_seconds (float): How long an entry is trusted after it was stored, or after the last build or refresh of its case title -
+      a stale entry is not returned by lookup.
+    """
+    def __init__(self, db_path: str, max_age_seconds: float = 7 * 24 * 60 * 60):
+        self.db_path = db_path
+        self.max_age_seconds = max_age_seconds
+        self._lock = threading.Lock()
+
+        # The index is only written in whole batches, so the connection runs in autocommit mode, with an explicit transaction per batch
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.executescript(_SCHEMA)
+
+    def close(self) -> None:
+        """Closes the database connection."""
+
+        with self._lock:
+            self._connection.close()
+
+    def lookup(self, cpr: str, employment_code: str, case_title: str) -> str | None:
+        """Returns the salary case ID of an employee, or None if the employee is not in the index, or the entry is stale."""
+
+        oldest_trusted_at = time.time() - self.max_age_seconds
+
+        # The builds are stored by date, so a build is trusted from the start of its day
+        oldest_trusted_build = date.fromtimestamp(oldest_trusted_at).isoformat()
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT case_id FROM case_index WHERE cpr = ? AND employment_code = ? AND case_title = ? AND ("
+                "indexed_at >= ? OR EXISTS (SELECT 1 FROM index_builds WHERE index_builds.case_title = case_index.case_title AND built_on >= ?))",
+                (cpr, normalize_employment_code(employment_code), case_title, oldest_trusted_at, oldest_trusted_build)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def put_many(self, rows: list[tuple]) -> None:
+        """
+        Stores a batch of entries, in a single transaction, replacing the existing entries for the same employees.
+
+        An existing entry in the same employee folder keeps the lower numbered of the two sub-cases, since a refresh only sees the sub-cases
+        modified since the last build, and the case resolution would find the first one.
+
+        Parameters:
+        - rows (list[tuple]): One (cpr, employment_code, case_title, case_id, folder_id) tuple per entry - if folder_id is None, it is read from case_id.
+        """
+
+        if not rows:
+            return
+
+        indexed_at = time.time()
+
+        # The connection as a context manager commits the transaction, or rolls it back if the batch fails
+        with self._lock, self._connection:
+            self._connection.execute("BEGIN IMMEDIATE")
+
+            self._connection.executemany(
+                "INSERT INTO case_index (cpr, employment_code, case_title, case_id, folder_id, indexed_at) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (cpr, employment_code, case_title) DO UPDATE SET "
+                "case_id = CASE WHEN case_index.folder_id = excluded.folder_id THEN MIN(case_index.case_id, excluded.case_id) ELSE excluded.case_id END, "
+                "folder_id = excluded.folder_id, indexed_at = excluded.indexed_at",
+                [
+                    (cpr, normalize_employment_code(employment_code), case_title, case_id, folder_id or _folder_of(case_id), indexed_at)
+                    for cpr, employment_code, case_title, case_id, folder_id in rows
+                ]
+            )
+
+    def get_last_build(self, case_type: str, case_title: str) -> str | None:
+        """Returns the date, as YYYY-MM-DD, the index of the case type and title was last built or refreshed on, or None if it never was."""
+
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT built_on FROM index_builds WHERE case_type = ? AND case_title = ?", (case_type, case_title)
+            ).fetchone()
+
+        return row[0] if row else None
+
+    def set_last_build(self, case_type: str, case_title: str, built_on: str) -> None:
+        """Stores the date the index of the case type and title was built or refreshed on."""
+
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO index_builds (case_type, case_title, built_on) VALUES (?, ?, ?) "
+                "ON CONFLICT (case_type, case_title) DO UPDATE SET built_on = excluded.built_on",
+                (case_type, case_title, built_on)
+            )
+
+    def count(self) -> int:
+        """Returns the number of entries in the index, stale or not."""
+
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM case_index").fetchone()[0]
+
+
+def _folder_of(case_id: str) -> str | None:
+    """Returns the ID of the employee folder of a sub-case, or None if case_id is not a sub-case ID."""
+
+    sub_case_match = SUB_CASE_ID_PATTERN.match(case_id)
+
+    return sub_case_match.group("folder_id") if sub_case_match else None
+
+
+def _date_windows(start_date: str, end_date: str, window_days: int) -> list[tuple[str, str]]:
+    """Splits a date range into consecutive windows of at most window_days days, as (start, end) pairs of YYYY-MM-DD dates."""
+
+    windows = []
+
+    window_start, last_date = date.fromisoformat(start_date), date.fromisoformat(end_date)
+
+    while window_start < last_date:
+        window_end = min(window_start + timedelta(days=window_days), last_date)
+
+        windows.append((window_start.isoformat(), window_end.isoformat()))
+
+        window_start = window_end
+
+    return windows
+
+
+def _find_sub_cases(case_handler: CaseHandler, case_type: str, case_title: str, windows: list[tuple[str, str]], date_field: str, max_pages: int) -> dict:
+    """Pages through the case search, window by window, and returns the matching sub-case IDs of each employee folder."""
+
+    sub_cases_by_folder = {}
+
+    for window_start, window_end in windows:
+        for page_index in range(max_pages):
+            response = case_handler.search_cases_using_modern_search(
+                page_index=page_index,
+                search_term=case_title,
+                start_date=window_start,
+                end_date=window_end,
+                case_type_prefix=case_type,
+                date_field=date_field,
+                endpoint_path=helper_functions.MODERN_SEARCH_ENDPOINT,
+            )
+
+            response.raise_for_status()
+
+            res_rows = response.json().get("Rows", {})
+
+            rows = res_rows.get("Results", []) if isinstance(res_rows, dict) else res_rows
+
+            for row in rows:
+                case_id = helper_functions._get_row_value(row, "caseid") or ""  # pylint: disable=protected-access
+                row_title = helper_functions._get_row_value(row, "title") or ""  # pylint: disable=protected-access
+
+                sub_case_match = SUB_CASE_ID_PATTERN.match(case_id)
+
+                # The search is a full-text search, so only the sub-cases whose title contains the case title are kept, as when probing
+                if sub_case_match and case_title in row_title:
+                    sub_cases_by_folder.setdefault(sub_case_match.group("folder_id"), set()).add(case_id)
+
+            # A page that is not full is the last page of the window
+            if len(rows) < helper_functions.MODERN_SEARCH_PAGE_SIZE:
+                break
+
+    return sub_cases_by_folder
+
+
+def build_case_index(
+    case_handler: CaseHandler,
+    case_index: CaseIndexStore,
+    case_type: str,
+    case_title: str,
+    start_date: str = "2000-01-01",
+    incremental: bool = False,
+    window_days: int = DEFAULT_WINDOW_DAYS,
+    max_workers: int = 4,
+    max_pages: int = 1000,
+    write_batch_size: int = 500,
+) -> int:
+    """
+    Builds or refreshes the index of the salary cases of case_type titled case_title.
+
+    A full build searches the sub-cases created between start_date and today. An incremental refresh only searches the sub-cases modified
+    since the last build or refresh - a refresh of an index that was never built is a full build. The metadata of the employee folders
+    found is read by max_workers workers, and the CPR number of each read from its contact data. The lowest numbered matching sub-case of each folder,
+    of those found now and the one already stored, is kept, as the case resolution would find it.
+
+    Returns:
+        The number of entries stored.
+    """
+
+    last_build = case_index.get_last_build(case_type, case_title) if incremental else None
+
+    # The windows end tomorrow, so the cases of today are included
+    end_date = (date.today() + timedelta(days=1)).isoformat()
+
+    if last_build:
+        windows, date_field = _date_windows(last_build, end_date, window_days), "Modified"
+
+    else:
+        windows, date_field = _date_windows(start_date, end_date, window_days), "Created"
+
+    started_at = datetime.now()
+
+    sub_cases_by_folder = _find_sub_cases(case_handler, case_type, case_title, windows, date_field, max_pages)
+
+    logger.info("The case search found %d employee folder(s) with a matching sub-case, in %d date window(s)", len(sub_cases_by_folder), len(windows))
+
+    def index_folder(folder_id: str) -> tuple | None:
+        try:
+            # The contact data is not kept by the metadata cache, so the metadata of the folder is always fetched
+            folder_metadata = helper_functions.get_case_metadata_attributes(case_handler=case_handler, case_id=folder_id, use_cache=False)
+
+        except Exception as e:
+            # A folder that can not be read is left out of the index - its employees are resolved through the searches instead
+            logger.warning("Could not read the metadata of the employee folder %s: %s", folder_id, e)
+
+            return None
+
+        cpr_match = CPR_PATTERN.search(folder_metadata.get(FOLDER_CONTACT_ATTRIBUTE) or "")
+
+        employment_code = folder_metadata.get("ows_EmploymentCode")
+
+        if not cpr_match or not employment_code:
+            return None
+
+        return cpr_match.group(1) + cpr_match.group(2), employment_code, case_title, min(sub_cases_by_folder[folder_id]), folder_id
+
+    rows, skipped_folders, stored_count = [], 0, 0
+
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="case_index") as executor:
+        for row in executor.map(index_folder, sub_cases_by_folder):
+            if row is None:
+                skipped_folders += 1
+
+                continue
+
+            rows.append(row)
+
+            if len(rows) >= write_batch_size:
+                case_index.put_many(rows)
+
+                stored_count += len(rows)
+
+                rows.clear()
+
+    case_index.put_many(rows)
+
+    stored_count += len(rows)
+
+    # The refresh starts from the day the build started, so the cases modified while it ran are pulled again next time
+    case_index.set_last_build(case_type, case_title, started_at.date().isoformat())
+
+    logger.info(
+        "%s the case index: %d entries stored, %d folder(s) without a CPR number or employment code, %d entries in total",
+        "Refreshed" if last_build else "Built", stored_count, skipped_folders, case_index.count(),
+    )
+
+    return stored_count
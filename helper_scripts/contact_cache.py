@@ -0,0 +1,65 @@
+"""
+This module provides a persistent cache of GetOrganized contact lookups, keyed by a hash of the CPR number.
+"""
+import hashlib
+import hmac
+
+from helper_scripts.metadata_cache import MetadataCache
+
+
+class ContactCache:
+    """
+    A thread-safe cache of the full name and GetOrganized ID of each person, with a time-to-live.
+
+    A person's name and contact ID hardly ever change, so the cache is persisted and reused across runs. The CPR numbers are never stored -
+    each entry is keyed by an HMAC-SHA256 of the CPR number, with a secret that is not stored in the file either, so the keys cannot be
+    reversed by hashing every possible CPR number. The entries are held in a MetadataCache, which handles the expiry, the eviction and the persistence.
+
+    Attributes:
+    - secret (str): The secret the CPR numbers are hashed with. A cache file can only be read back with the same secret.
+    """
+    def __init__(self, secret: str, max_entries: int = 100000, ttl_seconds: float = 30 * 24 * 60 * 60, persist_path: str = None):
+        self.secret = secret
+        self._entries = MetadataCache(max_entries=max_entries, ttl_seconds=ttl_seconds, persist_path=persist_path)
+
+    def hash_cpr(self, cpr: str) -> str:
+        """Returns the key of a CPR number in the cache."""
+
+        return hmac.new(self.secret.encode("utf-8"), cpr.encode("utf-8"), hashlib.sha256).hexdigest()
+
+    def get(self, cpr: str) -> tuple[str, str] | None:
+        """
+        Returns the cached full name and GetOrganized ID of a person, or None if the person is not cached or the entry has expired.
+
+        Parameters:
+        - cpr (str): The CPR number of the person.
+        """
+
+        contact = self._entries.get(self.hash_cpr(cpr))
+
+        if contact is None:
+            return None
+
+        return contact["full_name"], contact["go_id"]
+
+    def put(self, cpr: str, full_name: str, go_id: str) -> None:
+        """
+        Stores the full name and GetOrganized ID of a person.
+
+        Parameters:
+        - cpr (str): The CPR number of the person.
+        - full_name (str): The full name of the person.
+        - go_id (str): The GetOrganized contact ID of the person.
+        """
+
+        self._entries.put(self.hash_cpr(cpr), {"full_name": full_name, "go_id": go_id})
+
+    def save(self) -> None:
+        """Writes the cache to its persist_path JSON file, if it has one."""
+
+        self._entries.save()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters, the hit rate and the current size of the cache."""
+
+        return self._entries.stats()
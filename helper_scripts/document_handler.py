@@ -1,41 +1,48 @@
 """Module to handle document journalisering functionality in GetOrganized."""
+import base64
+
 from mbu_dev_shared_components.getorganized import objects
-from mbu_dev_shared_components.getorganized import documents
+
+from helper_scripts.go_client import GetOrganizedClient
 
 
-class DocumentHandler:
+class DocumentHandler(GetOrganizedClient):
     """
     A class to manage the jouranlizing of documents in the GetOrganized system.
 
+    The requests mirror the ones in mbu_dev_shared_components.getorganized.documents, but are sent through the shared, pooled session.
+
     Attributes:
     - api_username (str): The username for GetOrganized API.
     - api_password (str): The password for GetOrganized API.
+    - client_options: The optional session, rate_limiter, retry_policy and circuit_breaker shared with the other handlers - see GetOrganizedClient.
     """
-    def __init__(self, api_endpoint: str, api_username: str, api_password: str):
-        self.api_username = api_username
-        self.api_password = api_password
-        self.api_endpoint = api_endpoint
+    def __init__(self, api_endpoint: str, api_username: str, api_password: str, **client_options):
+        super().__init__(api_endpoint, api_username, api_password, **client_options)
         self.document_obj = objects.DocumentJsonCreator()
 
-    def _get_full_endpoint(self, path: str):
+    @staticmethod
+    def encode_document_bytes(document_bytes: bytes) -> str:
         """
-        Constructs the full endpoint URL.
+        Encodes the content of a document for the 'Bytes' field of an upload.
+
+        GetOrganized deserializes the 'Bytes' field as a .NET byte array, which accepts a base64 string as well as a JSON array of integers.
+        The base64 string is about 1.3 bytes per document byte, both in memory and serialized, where a Python list of integers holds an 8 byte pointer
+        per document byte in memory, and takes roughly 4.5 bytes per document byte once serialized.
 
         Parameters:
-        - path (str): The specific path for the API endpoint.
+        - document_bytes (bytes): The raw content of the document.
 
         Returns:
-        - str: The full endpoint URL.
+        - str: The base64 encoded content.
         """
-        if path:
-            return f"{self.api_endpoint}{path}"
-        return self.api_endpoint
+        return base64.b64encode(document_bytes).decode("ascii")
 
     def create_document_metadata(
         self,
         case_id: int,
         filename: str,
-        data_in_bytes: bytes,
+        data_in_bytes: str,
         overwrite: bool,
         list_name: str = "Dokumenter",
         folder_path: str = "",
@@ -47,6 +54,8 @@ class DocumentHandler:
         """
         Creates JSON data for a document.
 
+        data_in_bytes is the content of the document, encoded with encode_document_bytes.
+
         Returns:
         - str: JSON string of document data.
         """
@@ -69,9 +78,7 @@ class DocumentHandler:
         Parameters:
         - document metadata (str): A JSON string containing file data of the document to be uploaded.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
-
-        return documents.upload_file_to_case(document_data, endpoint, self.api_username, self.api_password)
+        return self._request("POST", endpoint_path, headers={'Content-Type': 'application/json'}, json=document_data)
 
     def journalize_document(self, document_ids: list, endpoint_path: str):
         """
@@ -80,9 +87,12 @@ class DocumentHandler:
         Parameters:
         - document_ids (list): List of ids on the documents to journalize.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
+        payload = {"DocumentIds": document_ids}
+
+        response = self._request("POST", endpoint_path, idempotent=True, headers={'Content-Type': 'application/json'}, json=payload)
+        response.raise_for_status()
 
-        return documents.mark_file_as_case_record(document_ids, endpoint, self.api_username, self.api_password)
+        return response
 
     def finalize_document(self, document_ids: list, endpoint_path: str):
         """
@@ -91,24 +101,36 @@ class DocumentHandler:
         Parameters:
         - document_ids (list): List of ids on the documents to finalize.
         """
-        endpoint = self._get_full_endpoint(endpoint_path)
+        payload = {
+            "DocumentIds": document_ids,
+            "ShouldCloseOpenTasks": False
+        }
+
+        response = self._request("POST", endpoint_path, idempotent=True, headers={'Content-Type': 'application/json'}, json=payload)
+        response.raise_for_status()
 
-        return documents.finalize_file(document_ids, endpoint, self.api_username, self.api_password)
+        return response
 
     def search_documents_using_search_term(self, search_term, endpoint_path):
         """
         Search for all documents related to a specified search_term
         """
 
-        endpoint = self._get_full_endpoint(endpoint_path)
+        payload = {
+            "SearchPhrase": search_term,
+            "AdditionalColumns": [],
+            "ResultLimit": 500,
+            "StartRow": 0
+        }
 
-        return documents.search_documents(search_term, endpoint, self.api_username, self.api_password)
+        return self._request("POST", endpoint_path, idempotent=True, headers={'Content-Type': 'application/json'}, json=payload)
 
     def search_documents_using_modern_search(self, page_index, search_term, start_date, end_date, only_items, case_type_prefix, endpoint_path):
         """
         Search for all documents related to a specified search_term, whilst applying pagination and date filters.
         """
 
-        endpoint = self._get_full_endpoint(endpoint_path)
-
-        return documents.modern_search(page_index, search_term, start_date, end_date, only_items, case_type_prefix, endpoint, self.api_username, self.api_password)
+        return self._modern_search(
+            endpoint_path, page_index, search_term, "DocumentLibrary", "Dokumenter",
+            start_date=start_date, end_date=end_date, only_items=only_items, case_type_prefix=case_type_prefix,
+        )
@@ -1,10 +1,11 @@
 import os
-import csv
 
 from pathlib import Path
 
 import pandas as pd
 
+from helper_scripts import sheet_snapshot
+
 
 class FileHandler:
     """
@@ -50,30 +51,89 @@ class FileHandler:
         """
         return os.path.join(self.directory, filename)
 
-    def load_or_create_csv_with_headers(self, filename: str, headers: list[str]) -> Path:
+    def index_files_by_cpr(self, folder_path: str, extension: str = ".pdf") -> dict[str, tuple[str, int]]:
         """
-        Ensures a CSV file exists in the handler's directory with the specified headers.
-        If the file doesn't exist or is empty, it creates it with the given headers.
+        Scans a folder and returns an index of the files in it, without reading any of them.
+
+        The files are expected to be named after the CPR number they belong to, optionally followed by '_med_log', e.g. '0101011234_med_log.pdf'.
+        The returned dictionary has the form:
+
+            {
+                "some_cpr": ("full/path/to/file.pdf", size_in_bytes),
+                ...
+            }
 
         Parameters:
-            filename (str): The name of the CSV file (e.g., 'test.csv').
-            headers (list[str]): The list of headers to write if creating the file.
+            folder_path (str): The folder to scan.
+            extension (str): The file extension to include, matched case-insensitively.
 
         Returns:
-            Path: The full path to the CSV file.
+            dict: The index of CPR number to file path and file size.
         """
 
-        csv_path = Path(self.directory) / filename
+        file_index = {}
+
+        with os.scandir(folder_path) as entries:
+            for entry in entries:
+                if not entry.is_file() or not entry.name.lower().endswith(extension):
+                    continue
+
+                cpr = Path(entry.name).stem.split('_med_log')[0]
+
+                file_index[cpr] = (entry.path, entry.stat().st_size)
 
-        if not csv_path.exists() or csv_path.stat().st_size == 0:
-            with open(csv_path, mode="w", newline="", encoding="utf-8") as f:
-                writer = csv.writer(f)
+        return file_index
 
-                writer.writerow(headers)
+    @staticmethod
+    def _validate_cpr_column(df: pd.DataFrame, cpr_col: str) -> tuple[pd.DataFrame, list[dict]]:
+        """
+        Helper method to normalize and validate a column of CPR numbers, with column operations instead of a loop over the rows.
 
-        return csv_path
+        The CPR numbers are stripped of whitespace and of a single '-', and a 9-digit CPR number gets its leading zero back,
+        since Excel drops it when the cell is formatted as a number. Rows with a missing or malformed CPR number are rejected.
+        If a CPR number appears more than once, the last row is kept, and the earlier rows are rejected.
 
-    def build_cpr_mapping(self, filename: str, sheet_name: str) -> dict:
+        Parameters:
+        -----------
+        df : pd.DataFrame
+            The rows read from the file, with the default index, so the original row number can be reported.
+        cpr_col : str
+            The name of the CPR column.
+
+        Returns:
+        --------
+        tuple
+            The accepted rows, with the normalized CPR numbers and sorted by them, and a list of the rejected rows,
+            each as a dictionary with the 'row' number in the file, the raw 'cpr' value and the 'reason' for the rejection.
+        """
+        cpr = df[cpr_col].fillna("").astype(str).str.strip().str.replace("-", "", n=1, regex=False)
+
+        is_missing = cpr == ""
+        is_malformed = ~is_missing & ~cpr.str.fullmatch(r"\d{9,10}")
+
+        cpr = cpr.where(is_missing | is_malformed, cpr.str.zfill(10))
+
+        is_duplicate = ~is_missing & ~is_malformed & cpr.duplicated(keep="last")
+
+        reasons = pd.Series("", index=df.index)
+        reasons[is_missing] = "missing CPR"
+        reasons[is_malformed] = "malformed CPR"
+        reasons[is_duplicate] = "duplicate CPR - a later row is used"
+
+        is_rejected = reasons != ""
+
+        rejected_rows = pd.DataFrame({
+            "row": df.index[is_rejected],
+            "cpr": df.loc[is_rejected, cpr_col].fillna("").astype(str),
+            "reason": reasons[is_rejected],
+        }).to_dict("records")
+
+        # The CPR numbers are now all 10 digits, so sorting them as strings gives the same order as sorting them by their numeric value
+        accepted = df.loc[~is_rejected].assign(**{cpr_col: cpr[~is_rejected]}).sort_values(by=cpr_col)
+
+        return accepted, rejected_rows
+
+    def build_cpr_mapping(self, filename: str, sheet_name: str, use_snapshot: bool = True) -> tuple[dict, list[dict]]:
         """
         Reads each row in an Excel file (identified by 'filename' and 'sheet_name') and
         returns a dictionary of the form:
@@ -98,150 +158,39 @@ class FileHandler:
             - "Navn"
             - "Stilling"
 
-        and that "CPR" is used as the key in the returned dictionary.
-
-        The DataFrame is first sorted by the numeric value of the "CPR" column (smallest first).
-        """
-
-        file_path = self._get_file_path(filename)
-
-        # Read the Excel file with converters to ensure values are read as strings
-        df = pd.read_excel(
-            file_path,
-            sheet_name=sheet_name,
-            converters={
-                'CPR': str,
-                'Tjenestenummer': str,
-                'Navn': str,
-                'Stilling': str
-            }
-        )
-
-        # Ensure required columns exist
-        required_cols = ['CPR', 'Tjenestenummer', 'Navn', 'Stilling']
-        for col in required_cols:
-            if col not in df.columns:
-                raise ValueError(f"Missing required column '{col}' in the sheet.")
+        and that "CPR" is used as the key in the returned dictionary, ordered by the numeric value of the CPR number (smallest first).
 
-        # Sort the DataFrame, in ascending order, by the numeric value of the CPR column - this assumes that CPR values are numeric even if stored as strings.
-        df.sort_values(by='CPR', key=lambda col: col.astype(int), inplace=True)
+        Rows with a missing, malformed or duplicate CPR number do not stop the run - they are returned separately, as described in _validate_cpr_column.
 
-        # Build the dictionary, preserving the sorted order.
-        cpr_dict = {}
-        for _, row in df.iterrows():
-            cpr_value = row['CPR']
-
-            # Skip rows with missing CPR value
-            if pd.isna(cpr_value):
-                continue
-
-            # Remove any accidental whitespace
-            cpr_value = cpr_value.strip()
-
-            cpr_dict[cpr_value] = {
-                "tjenestenummer": row['Tjenestenummer'] if not pd.isna(row['Tjenestenummer']) else "",
-                "navn": row['Navn'] if not pd.isna(row['Navn']) else "",
-                "stilling": row['Stilling'] if not pd.isna(row['Stilling']) else ""
-            }
-
-        return cpr_dict
-
-    def cpr_exists_in_csv(self, output_filename: str, cpr: str) -> bool:
-        """
-        Checks if a given CPR number exists in the CSV file.
-
-        Parameters:
-            output_filename (str): The name of the CSV file (e.g., 'test.csv').
-            cpr (str): The CPR number to check.
+        Only the four columns are read, as strings, with a streaming reader. With use_snapshot, they are cached in a snapshot next to the file,
+        which is used as long as the file is unchanged, so a re-run does not parse the workbook again.
 
         Returns:
-            bool: True if the CPR number exists, False otherwise.
-        """
-
-        output_file_path = os.path.join(self.directory, output_filename)
-
-        if not os.path.exists(output_file_path) or os.path.getsize(output_file_path) == 0:
-            return False
-
-        # Ensure the "CPR Nummer" column is read as string
-        df = pd.read_csv(output_file_path, dtype={"cpr": str})
-
-        if "cpr" not in df.columns:
-            return False
-
-        return cpr in df["cpr"].values
-
-    def append_cpr_case_mapping_csv(self, mapping: list, output_filename: str) -> None:
-        """
-        Appends a list of dictionaries mapping CPR numbers to Salary Case IDs into a CSV file.
-        If the file does not exist or is empty, it writes the headers 'CPR Nummer' and 'Salary Case ID'
-        at the top of the file.
-
-        Parameters:
-            mapping (list of dict): A list where each dictionary contains one key-value pair {cpr_nummer: salary_case_id}.
-            output_filename (str): The name of the CSV file to append to (e.g., 'cpr_mapping.csv').
-        """
-
-        output_file_path = os.path.join(self.directory, output_filename)
-
-        # Check if the file doesn't exist or is empty to decide if we need to write headers.
-        write_header = not os.path.exists(output_file_path) or os.path.getsize(output_file_path) == 0
-
-        with open(output_file_path, mode='a', newline='', encoding='utf-8') as csv_file:
-            writer = csv.writer(csv_file)
-
-            if write_header:
-                writer.writerow(["CPR Nummer", "Salary Case ID"])
-
-            # Append each mapping entry as a new row.
-            for entry in mapping:
-                for cpr, case_id in entry.items():
-                    writer.writerow([cpr, case_id])
-
-    def get_cpr_csv_mapping(self, filename: str) -> dict:
-        """
-        Reads each row in a CSV file (identified by 'filename') and returns a dictionary mapping:
-            Key: CPR Nummer
-            Value: Salary Case ID
+            tuple: The dictionary above, and the list of rejected rows.
         """
 
         file_path = self._get_file_path(filename)
 
-        # Read the CSV file with converters to ensure values are read as strings
-        df = pd.read_csv(
+        # The required columns are read as strings, and a missing column raises a ValueError
+        df = sheet_snapshot.load_sheet_columns(
             file_path,
-            converters={
-                'CPR Nummer': str,
-                'Salary Case ID': str
-            }
+            sheet_name=sheet_name,
+            columns=['CPR', 'Tjenestenummer', 'Navn', 'Stilling'],
+            snapshot_path=self._get_file_path(f".{filename}.{sheet_name}.snapshot.json") if use_snapshot else None,
         )
 
-        # Ensure required columns exist
-        required_cols = ['CPR Nummer', 'Salary Case ID']
-        for col in required_cols:
-            if col not in df.columns:
-                raise ValueError(f"Missing required column '{col}' in the CSV file.")
-
-        # Optionally: sort the DataFrame by the numeric value of the CPR Nummer column
-        df.sort_values(by='CPR Nummer', key=lambda col: col.astype(int), inplace=True)
-
-        cpr_mapping = {}
+        # The row numbers reported for rejected rows should match the sheet, where the header is row 1
+        df.index = df.index + 2
 
-        for _, row in df.iterrows():
-            cpr_value = row['CPR Nummer']
+        df, rejected_rows = self._validate_cpr_column(df, 'CPR')
 
-            if pd.isna(cpr_value):
-                continue  # Skip rows with missing CPR Nummer
-
-            cpr_value = cpr_value.strip()  # Remove accidental whitespace
-
-            # Get Salary Case ID, using an empty string if it's missing
-            salary_case_id = row['Salary Case ID']
-            if pd.isna(salary_case_id):
-                salary_case_id = ""
-            else:
-                salary_case_id = salary_case_id.strip()
-
-            cpr_mapping[cpr_value] = salary_case_id
+        employee_data = (
+            df[['Tjenestenummer', 'Navn', 'Stilling']]
+            .fillna("")
+            .rename(columns={'Tjenestenummer': 'tjenestenummer', 'Navn': 'navn', 'Stilling': 'stilling'})
+            # Plain object columns are turned into dictionaries much faster than pandas' string columns
+            .astype(object)
+            .to_dict("records")
+        )
 
-        return cpr_mapping
+        return dict(zip(df['CPR'], employee_data)), rejected_rows
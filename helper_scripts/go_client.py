@@ -0,0 +1,258 @@
+"""
+This module provides the shared HTTP layer for the GetOrganized handlers.
+
+Every request from the CaseHandler and the DocumentHandler is sent through a single requests.Session, so the
+connections to GetOrganized are pooled and kept alive between requests, instead of a new connection, TLS handshake
+and NTLM handshake being set up for every single call.
+"""
+import time
+
+import requests
+
+from requests.adapters import HTTPAdapter
+from requests_ntlm import HttpNtlmAuth
+
+from helper_scripts.call_metrics import CallMetrics, CallRecord
+from helper_scripts.rate_limiter import EndpointRateLimiter, RateLimiter
+from helper_scripts.retry_policy import CircuitBreaker, RetryPolicy, REJECTED_STATUSES, parse_retry_after
+
+
+def create_go_session(api_username: str, api_password: str, pool_maxsize: int = 10, pool_block: bool = True) -> requests.Session:
+    """
+    Creates a session with NTLM authentication and a pool of keep-alive connections, to be shared by all GetOrganized handlers and threads.
+
+    Parameters:
+    - api_username (str): The username for GetOrganized API.
+    - api_password (str): The password for GetOrganized API.
+    - pool_maxsize (int): The maximum number of connections kept open to each host - should be at least the number of worker threads.
+    - pool_block (bool): Whether a thread should wait for a free connection when the pool is exhausted, instead of opening an extra, unpooled connection.
+
+    Returns:
+    - requests.Session: The configured session.
+    """
+
+    session = requests.Session()
+
+    session.auth = HttpNtlmAuth(api_username, api_password)
+
+    # Retries are not handled by urllib3 here, since a retried POST could create a duplicate document
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_maxsize, pool_block=pool_block, max_retries=0)
+
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+
+    return session
+
+
+class GetOrganizedClient:
+    """
+    A base class for the GetOrganized handlers, sending every request through a shared session.
+
+    Attributes:
+    - api_endpoint (str): The base url of the GetOrganized API.
+    - session (requests.Session): The session used for every request - a new pooled session is created from api_username and api_password if none is given,
+      so the credentials are only held by the session's NTLM authentication.
+    - rate_limiter (RateLimiter | EndpointRateLimiter): Optional rate limiter, shared between threads, capping the number of requests sent to the GetOrganized host.
+      Every response is reported back to it, so an EndpointRateLimiter in AIMD mode can slow down when GetOrganized does.
+    - timeout (int): The timeout in seconds for every request.
+    - retry_policy (RetryPolicy): Optional policy for sending failed requests again - without it, every request is sent once.
+    - circuit_breaker (CircuitBreaker): Optional circuit breaker, shared between threads, holding back all requests while GetOrganized is overloaded.
+    - metrics (CallMetrics): Optional recorder, shared between threads, timing every request.
+    """
+    def __init__(
+        self,
+        api_endpoint: str,
+        api_username: str,
+        api_password: str,
+        session: requests.Session = None,
+        rate_limiter: RateLimiter | EndpointRateLimiter = None,
+        timeout: int = 60,
+        retry_policy: RetryPolicy = None,
+        circuit_breaker: CircuitBreaker = None,
+        metrics: CallMetrics = None,
+    ):
+        self.api_endpoint = api_endpoint
+        self.session = session or create_go_session(api_username, api_password)
+        self.rate_limiter = rate_limiter
+        self.timeout = timeout
+        self.retry_policy = retry_policy
+        self.circuit_breaker = circuit_breaker
+        self.metrics = metrics
+
+    def _get_full_endpoint(self, path: str):
+        """
+        Constructs the full endpoint URL.
+
+        Parameters:
+        - path (str): The specific path for the API endpoint.
+
+        Returns:
+        - str: The full endpoint URL.
+        """
+        if path:
+            return f"{self.api_endpoint}{path}"
+        return self.api_endpoint
+
+    def _throttle(self, endpoint: str) -> float:
+        """
+        Blocks until the rate limiter allows another request to the host of the endpoint. Does nothing if no rate limiter is set.
+
+        Parameters:
+        - endpoint (str): The full endpoint URL about to be called.
+
+        Returns:
+        - float: The number of seconds the request was held back.
+        """
+        if self.rate_limiter:
+            return self.rate_limiter.acquire(endpoint)
+
+        return 0.0
+
+    def _request(self, method: str, endpoint_path: str, idempotent: bool = None, probe: bool = False, **kwargs) -> requests.Response:
+        """
+        Sends a request to GetOrganized through the shared session, sending it again on failure as allowed by the retry policy.
+        If the client has call metrics, the request is recorded once, covering all of its attempts.
+
+        Parameters:
+        - method (str): The HTTP method.
+        - endpoint_path (str): The specific path for the API endpoint.
+        - idempotent (bool): Whether the request can safely be sent more than once - defaults to True for GET requests only.
+        - probe (bool): Whether the request looks up something that may not exist, like a guessed sub-case ID. An error status other than 429
+          and 503 is then the answer that it does not exist - it is returned at once, without being sent again or counted by the circuit breaker.
+        - kwargs: Passed on to requests.Session.request, e.g. headers, json or data.
+
+        Returns:
+        - requests.Response: The response object from the API - the last one, if every attempt failed.
+
+        Raises:
+        - requests.RequestException: If no response was received on the last attempt.
+        """
+        endpoint = self._get_full_endpoint(endpoint_path)
+
+        if idempotent is None:
+            idempotent = method.upper() == "GET"
+
+        call_start = time.perf_counter()
+
+        attempt, waited, response = 0, 0.0, None
+
+        try:
+            while True:
+                if self.circuit_breaker:
+                    waited += self.circuit_breaker.wait_until_closed()
+
+                waited += self._throttle(endpoint)
+
+                attempt += 1
+
+                response, error = None, None
+
+                start = time.perf_counter()
+
+                try:
+                    response = self.session.request(method=method, url=endpoint, timeout=self.timeout, **kwargs)
+
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+
+                if self.rate_limiter:
+                    self.rate_limiter.record_response(endpoint, time.perf_counter() - start, 0 if error is not None else response.status_code)
+
+                if probe and error is None:
+                    is_overloaded = response.status_code in REJECTED_STATUSES
+
+                else:
+                    is_overloaded = error is not None or response.status_code == 429 or response.status_code >= 500
+
+                if self.circuit_breaker:
+                    if is_overloaded:
+                        self.circuit_breaker.record_failure(retry_after=parse_retry_after(response) if error is None and response.status_code in REJECTED_STATUSES else None)
+
+                    else:
+                        self.circuit_breaker.record_success()
+
+                if not is_overloaded:
+                    return response
+
+                if not self.retry_policy or not self.retry_policy.should_retry(attempt, idempotent, response=response, error=error):
+                    if error is not None:
+                        raise error
+
+                    return response
+
+                backoff_seconds = self.retry_policy.get_delay(attempt, response)
+
+                waited += backoff_seconds
+
+                time.sleep(backoff_seconds)
+
+        finally:
+            if self.metrics:
+                self._record_call(method, endpoint_path, time.perf_counter() - call_start, waited, attempt, response)
+
+    def _modern_search(self, endpoint_path: str, page_index: int, search_term: str, query_type: str, result_type_name: str, **search_options) -> requests.Response:
+        """
+        Sends a page of a modern search, for documents or cases, with a filter on the creation or modification date of the cases.
+
+        Parameters:
+        - query_type (str): 'DocumentLibrary' or 'Case'.
+        - result_type_name (str): 'Dokumenter' or 'Sager'.
+        - search_options: start_date and end_date as YYYY-MM-DD, case_type_prefix, and optionally only_items, and date_field - 'Created' or 'Modified'.
+        """
+
+        date_field = search_options.get("date_field", "Created")
+
+        payload = {
+            "QueryPageIndex": page_index,
+            "PageSize": 500,
+            "QueryPhrase": f"{search_term}",
+            "QueryType": query_type,
+            "TrimToOpenedCases": False,
+            "ResultTypeName": result_type_name,
+            "SearchContentDefinitionEntryType": 0,
+            "AdditionalSelectColumns": [],
+            "ResultTypeListNameOrType": None,
+            "ResultTypeSearchOnlyItems": search_options.get("only_items", False),
+            "ResultTypeQueryFilter": None,
+            "CaseQueryFieldCollection": [
+                {
+                    "DisplayName": "Sag oprettet" if date_field == "Created" else "Sag ændret",
+                    "Guid": None,
+                    "InternalName": date_field,
+                    "Type": "SPFieldType.DateTime",
+                    "Value": f"{search_options['start_date']}T22:00:00.000Z",
+                    "ToValue": f"{search_options['end_date']}T22:00:00.000Z",
+                    "IsTaxId": False,
+                    "DecodeCrawledName": False,
+                    "IsOrCondition": None,
+                    "MappedName": f"CCM{date_field}CASEPROP"
+                }
+            ],
+            "QueryFieldCollection": [],
+            "CaseTypePrefixes": [
+                f"{search_options['case_type_prefix']}"
+            ],
+            "SortDirection1": 1,
+            "ResultViewSortOrder1": 2,
+            "ResultViewSortOrder2": 2,
+            "QueryScope": 0
+        }
+
+        return self._request("POST", endpoint_path, idempotent=True, headers={'Content-Type': 'application/json'}, json=payload)
+
+    def _record_call(self, method: str, endpoint_path: str, latency: float, waited: float, attempts: int, response: requests.Response) -> None:
+        """Records a finished request in the call metrics - response is the final response, or None if none was received."""
+
+        request_body = response.request.body if response is not None else None
+
+        if isinstance(request_body, str):
+            request_body = request_body.encode("utf-8")
+
+        self.metrics.record(method, endpoint_path, CallRecord(
+            latency=latency,
+            waited=waited,
+            request_bytes=len(request_body or b""),
+            response_bytes=len(response.content) if response is not None else 0,
+            status=response.status_code if response is not None else 0,
+            attempts=attempts,
+        ))
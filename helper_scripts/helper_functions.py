@@ -2,8 +2,13 @@
 This module provides helper functions.
 """
 
+import logging
+import threading
 import xml.etree.ElementTree as ET
 
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
 from typing import Dict, Any, Optional, Tuple
 
 from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
@@ -12,6 +17,13 @@ from mbu_dev_shared_components.getorganized.objects import CaseDataJson
 
 from helper_scripts.case_handler import CaseHandler
 from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.retry_policy import REJECTED_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# The metadata attributes kept in the metadata cache - the ones the case resolution reads. The rest, e.g. the contact data of an employee folder
+# with the name and CPR number of the employee, are never cached, since the cache is persisted in plaintext next to the employee list
+CACHED_METADATA_ATTRIBUTES = ("ows_CaseID", "ows_Title", "ows_EmploymentCode")
 
 
 class DatabaseError(Exception):
@@ -47,11 +59,26 @@ def contact_lookup(case_handler: CaseHandler, ssn: str) -> Optional[Tuple[str, s
     """
     Perform contact lookup.
     Using the provided SSN, this function retrieves the person's full name and ID from the case handler.
+    If the case handler has a contact cache, the cache is checked first, and the looked up contact is stored in it.
 
     Returns:
         A tuple containing the person's full name and ID if successful, otherwise None.
     """
 
+    contact_cache = case_handler.contact_cache
+
+    if contact_cache:
+        cached_contact = contact_cache.get(ssn)
+
+        if cached_contact is not None:
+            return cached_contact
+
+    return _fetch_contact(case_handler, ssn)
+
+
+def _fetch_contact(case_handler: CaseHandler, ssn: str) -> Tuple[str, str]:
+    """Looks up a contact in GetOrganized, and stores it in the contact cache of the case handler, if it has one."""
+
     response = case_handler.contact_lookup(ssn, '/personalemapper/_goapi/contacts/readitem')
 
     if not response.ok:
@@ -62,9 +89,55 @@ def contact_lookup(case_handler: CaseHandler, ssn: str) -> Optional[Tuple[str, s
     person_full_name = person_data["FullName"]
     person_go_id = person_data["ID"]
 
+    if case_handler.contact_cache:
+        case_handler.contact_cache.put(ssn, person_full_name, person_go_id)
+
     return person_full_name, person_go_id
 
 
+def prefetch_contacts(case_handler: CaseHandler, ssns: list[str], max_workers: int = 4) -> Counter:
+    """
+    Looks up the contacts of all the given SSNs concurrently, and stores them in the contact cache of the case handler.
+
+    This is run before the case resolution, so the case searches never wait on a contact lookup. A failed lookup is only counted -
+    it is retried inline when the SSN is resolved, where the failure is stored in the run state as usual.
+
+    Parameters:
+        case_handler (CaseHandler): A handler with a contact cache.
+        ssns (list[str]): The SSNs to look up.
+        max_workers (int): The number of lookups sent at once.
+
+    Returns:
+        Counter: The number of contacts already 'cached', 'fetched' and 'failed'.
+    """
+
+    counts = Counter(cached=0, fetched=0, failed=0)
+
+    contact_cache = case_handler.contact_cache
+
+    if not contact_cache:
+        return counts
+
+    ssns_to_fetch = [ssn for ssn in ssns if contact_cache.get(ssn) is None]
+
+    counts["cached"] = len(ssns) - len(ssns_to_fetch)
+
+    def fetch_contact(ssn: str) -> bool:
+        try:
+            _fetch_contact(case_handler, ssn)
+
+        except Exception:
+            return False
+
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="contact_prefetch") as executor:
+        for fetched in executor.map(fetch_contact, ssns_to_fetch):
+            counts["fetched" if fetched else "failed"] += 1
+
+    return counts
+
+
 def check_case_folder(
     case_data_handler: CaseDataJson,
     case_handler: CaseHandler,
@@ -119,27 +192,152 @@ def check_case_folder(
     return cases_info
 
 
+def get_case_metadata_attributes(case_handler: CaseHandler, case_id: str, probe: bool = False, use_cache: bool = True) -> dict:
+    """
+    Retrieves the metadata for a case, and returns its parsed attributes.
+    If the case handler has a metadata cache, the cache is checked first, and the CACHED_METADATA_ATTRIBUTES of successfully parsed metadata
+    are stored in it - a cached answer only holds those attributes.
+
+    Parameters:
+        case_handler (CaseHandler): A handler to interact with the case management system.
+        case_id (str): The ID of the case, e.g. 'PER-2025-000001-001'.
+        probe (bool): Whether case_id is a guess, which may not exist - an error answer then means the case does not exist,
+            and is neither sent again nor counted by the circuit breaker.
+        use_cache (bool): Whether a cached answer may be returned - without it, the metadata is always fetched, with every attribute.
+
+    Returns:
+        dict: The metadata attributes of the case - empty if the metadata could not be parsed, or a probed case does not exist.
+
+    Raises:
+        requests.HTTPError: If a probed case could not be looked up, because GetOrganized kept rejecting the request.
+    """
+
+    metadata_cache = case_handler.metadata_cache
+
+    if metadata_cache and use_cache:
+        cached_attributes = metadata_cache.get(case_id)
+
+        if cached_attributes is not None:
+            return cached_attributes
+
+    response = case_handler.get_case_metadata(endpoint_path=f'/_goapi/Cases/Metadata/{case_id}', probe=probe)
+
+    if probe:
+        if not response.ok and response.status_code not in REJECTED_STATUSES:
+            return {}
+
+        response.raise_for_status()
+
+    attributes = dict(parse_metadata(metadata_str=response.json().get("Metadata")))
+
+    # Empty results are not cached, so a failed lookup is retried the next time the case is needed
+    if metadata_cache and attributes:
+        metadata_cache.put(case_id, {name: value for name, value in attributes.items() if name in CACHED_METADATA_ATTRIBUTES})
+
+    return attributes
+
+
+@dataclass
+class MetadataProbeStats:
+    """
+    Counters for the sub-case probing in get_case_id_through_metadata, shared by all worker threads.
+
+    Attributes:
+    - folders_probed (int): The number of employee folders whose sub-cases were probed.
+    - probes (int): The number of sub-case metadata lookups made.
+    - probe_rounds (int): The number of sequential rounds the lookups were made in - the lookups within a round run concurrently.
+    - serial_round_trips (int): The number of lookups the previous one-by-one probing would have made for the same folders.
+    """
+    folders_probed: int = 0
+    probes: int = 0
+    probe_rounds: int = 0
+    serial_round_trips: int = 0
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def record(self, probes: int, probe_rounds: int, serial_round_trips: int) -> None:
+        """Adds the counts for one employee folder."""
+
+        with self._lock:
+            self.folders_probed += 1
+            self.probes += probes
+            self.probe_rounds += probe_rounds
+            self.serial_round_trips += serial_round_trips
+
+    @property
+    def round_trips_saved(self) -> int:
+        """The number of sequential round-trips saved compared to the one-by-one probing."""
+
+        return self.serial_round_trips - self.probe_rounds
+
+
+# The probing counters for the whole run
+metadata_probe_stats = MetadataProbeStats()
+
+# There should be a maximum of 10 cases for each employee folder, we use 14 to be safe
+MAX_SUB_CASES_PER_FOLDER = 14
+
+# The number of sub-case IDs guessed and looked up at once, when the sub-cases of the folder are not known from the search
+METADATA_PROBE_WAVE_SIZE = 5
+
+
+def _get_case_title(case_handler: CaseHandler, case_id: str) -> str:
+    """
+    Returns the title of a case, or an empty string if the case does not exist.
+    Probing guesses case IDs that may not exist, so the lookup is sent as a probe - any other failure is raised, and fails the CPR number.
+    """
+
+    return get_case_metadata_attributes(case_handler=case_handler, case_id=case_id, probe=True).get("ows_Title") or ""
+
+
+def _find_first_title_match(case_handler: CaseHandler, executor: ThreadPoolExecutor, case_ids: list, case_title: str) -> tuple[Optional[str], int]:
+    """
+    Looks up the titles of the given cases concurrently, and returns the first case ID, in the given order, whose title contains case_title.
+    Lookups not yet started are cancelled once a match is found.
+
+    Returns:
+        A tuple of the matching case ID (or None), and the number of lookups made.
+    """
+
+    futures = [executor.submit(_get_case_title, case_handler, case_id) for case_id in case_ids]
+
+    matching_case_id = None
+
+    for case_id, future in zip(case_ids, futures):
+        if case_title in future.result():
+            matching_case_id = case_id
+
+            break
+
+    for future in futures:
+        future.cancel()
+
+    probes = sum(1 for future in futures if not future.cancelled())
+
+    return matching_case_id, probes
+
+
 def get_case_id_through_metadata(case_handler: CaseHandler, all_cases_info: list, case_title: str, employment_code: str) -> str:
     """
     Check if a case folder exists for the person and update the database.
 
+    The sub-cases of the employee folder are probed concurrently, instead of one by one:
+    1. The sub-cases of the folder already returned by the search in all_cases_info are looked up at once, in a single round.
+    2. The sub-case IDs 001 to 014 not returned by the search are guessed, METADATA_PROBE_WAVE_SIZE at a time - if step 1 found a match,
+       only the IDs numbered below that match are guessed.
+    The lowest numbered matching sub-case wins, so the result is the same as when probing one by one.
+
     Returns:
         The case folder ID if it exists, otherwise None.
     """
 
     employee_folder_id = ""
 
-    # We start by creating an empty string for the case_id, which will be used to store the case id for the salary case
-    case_id = ""
-
-    for case in all_cases_info:
-        employee_folder_id_placeholder = case.get('RelativeUrl', '').split("/")[-1]
+    # Several cases in the search result usually share the same employee folder, so each folder is only checked once
+    employee_folder_ids = list(dict.fromkeys(case.get('RelativeUrl', '').split("/")[-1] for case in all_cases_info))
 
-        # For each looped case, we use the case_handler to get the metadata for the case, using the case_id
-        employee_folder_metadata = case_handler.get_case_metadata(endpoint_path=f'/_goapi/Cases/Metadata/{employee_folder_id_placeholder}').json().get("Metadata")
-
-        # We parse the metadata string returned from the API, using the parse_metadata function
-        formatted_metadata = parse_metadata(metadata_str=employee_folder_metadata)
+    for employee_folder_id_placeholder in employee_folder_ids:
+        # For each looped case, we get the parsed metadata for the case, using the case_id - the metadata cache is used if the case handler has one
+        formatted_metadata = get_case_metadata_attributes(case_handler=case_handler, case_id=employee_folder_id_placeholder)
 
         if formatted_metadata.get("ows_EmploymentCode") in (employment_code, f"XA{employment_code}"):
             # If the employment code matches, we set the employee_folder_id to the RelativeUrl of the case
@@ -147,27 +345,50 @@ def get_case_id_through_metadata(case_handler: CaseHandler, all_cases_info: list
 
             break
 
-    # We then loop from 1 to 15, which is the maximum number of cases we want to check for the employee folder - there should be a maximum of 10 cases for each employee folder, we use 15 to be safe
-    for case_number in range(1, 15):
-        # We check if the case_number is greater than or equal to 10, and if so, we create the case_id with a leading zero
-        if case_number >= 10:
-            case_id = f"{employee_folder_id}-0{case_number}"
+    # The sub-case IDs follow the pattern {employee_folder_id}-001, {employee_folder_id}-002 and so on
+    candidate_case_ids = [f"{employee_folder_id}-{case_number:03d}" for case_number in range(1, MAX_SUB_CASES_PER_FOLDER + 1)]
 
-        # If the case_number is less than 10, we create the case_id with 2 leading zeros
-        else:
-            case_id = f"{employee_folder_id}-00{case_number}"
+    # The sub-cases of the folder which the search already returned - these exist for sure, so they are checked first
+    known_case_ids = sorted({
+        case.get('CaseID') for case in all_cases_info
+        if case.get('RelativeUrl', '').split("/")[-1] == employee_folder_id and case.get('CaseID') in candidate_case_ids
+    })
 
-        # For each looped case, we use the case_handler to get the metadata for the case, using the case_id
-        response = case_handler.get_case_metadata(endpoint_path=f'/_goapi/Cases/Metadata/{case_id}')
+    unknown_case_ids = [case_id for case_id in candidate_case_ids if case_id not in known_case_ids]
 
-        # We parse the metadata string returned from the API, using the parse_metadata function
-        formatted_res = parse_metadata(metadata_str=response.json().get("Metadata"))
+    salary_case_id = None
+    probes = 0
+    rounds_used = 0
 
-        # One of the metadata keys is "ows_Title", which refers to the case_title, related to the case - we check if this key matches the case_title we are looking for
-        if case_title in formatted_res.get("ows_Title"):
-            salary_case_id = case_id
+    with ThreadPoolExecutor(max_workers=max(METADATA_PROBE_WAVE_SIZE, len(known_case_ids))) as executor:
+        if known_case_ids:
+            # One of the metadata keys is "ows_Title", which refers to the case_title, related to the case - we check if this key matches the case_title we are looking for
+            salary_case_id, round_probes = _find_first_title_match(case_handler, executor, known_case_ids, case_title)
 
-            break
+            probes += round_probes
+            rounds_used += 1
+
+        if salary_case_id:
+            # A lower numbered sub-case, which the search did not return, would have been found first when probing one by one - so those are checked as well
+            unknown_case_ids = [case_id for case_id in unknown_case_ids if case_id < salary_case_id]
+
+        for i in range(0, len(unknown_case_ids), METADATA_PROBE_WAVE_SIZE):
+            lower_case_id, round_probes = _find_first_title_match(case_handler, executor, unknown_case_ids[i:i + METADATA_PROBE_WAVE_SIZE], case_title)
+
+            probes += round_probes
+            rounds_used += 1
+
+            if lower_case_id:
+                salary_case_id = lower_case_id
+
+                break
+
+    # The one-by-one probing would have stopped at the matching sub-case number, or tried them all
+    serial_round_trips = candidate_case_ids.index(salary_case_id) + 1 if salary_case_id else len(candidate_case_ids)
+
+    metadata_probe_stats.record(probes=probes, probe_rounds=rounds_used, serial_round_trips=serial_round_trips)
+
+    logger.debug("Sub-case probing: %d lookups in %d round(s), %d sequential round-trip(s) saved", probes, rounds_used, serial_round_trips - rounds_used)
 
     if salary_case_id:
         return salary_case_id
@@ -196,30 +417,117 @@ def parse_metadata(metadata_str: str) -> dict:
         return root.attrib
 
     except ET.ParseError as e:
-        print("Error parsing metadata:", e)
+        logger.warning("Error parsing metadata: %s", e)
 
         return {}
 
 
-def look_for_already_journalized_file(document_handler: DocumentHandler, employees_salary_case_id: str = "", filename_to_match: str = ""):
+# The modern search endpoint used for the pre-scan of already journalized documents, and the page size set in DocumentHandler.search_documents_using_modern_search
+MODERN_SEARCH_ENDPOINT = '/_goapi/Search/ModernSearch'
+MODERN_SEARCH_PAGE_SIZE = 500
+
+
+def _get_row_value(row: dict, key: str):
+    """Returns the value of a search result column, whatever the casing of its name, or None if the column is missing."""
+
+    for row_key, value in row.items():
+        if row_key.lower() == key:
+            return value
+
+    return None
+
+
+def build_journalized_documents_index(
+    document_handler: DocumentHandler,
+    title: str,
+    start_date: str,
+    end_date: str,
+    case_type_prefix: str,
+    endpoint_path: str = MODERN_SEARCH_ENDPOINT,
+    max_pages: int = 1000,
+) -> set[tuple[str, str]]:
+    """
+    Pages through the modern search for documents with the given title, and returns the (case ID, title) pair of every document found.
+
+    This is run once before the uploads, so look_for_already_journalized_file can check each employee with a set lookup, instead of a search per employee.
+
+    Parameters:
+    - document_handler (DocumentHandler): The handler sending the search requests.
+    - title (str): The title of the journalized document, the same as the FINAL_JOURNALIZED_FILENAME.
+    - start_date (str): The start of the date range, as YYYY-MM-DD.
+    - end_date (str): The end of the date range, as YYYY-MM-DD.
+    - case_type_prefix (str): The case type to search within, e.g. 'PER'.
+    - endpoint_path (str): The path of the modern search endpoint.
+    - max_pages (int): A safety limit on the number of pages fetched.
+
+    Returns:
+    - set: The (case ID, title) pairs of the documents found.
+
+    Raises:
+    - ValueError: If the last page allowed by max_pages is still full - the index would be incomplete, and the employees past it uploaded again.
+    """
+
+    journalized_documents = set()
+
+    for page_index in range(max_pages):
+        response = document_handler.search_documents_using_modern_search(
+            page_index=page_index,
+            search_term=title,
+            start_date=start_date,
+            end_date=end_date,
+            only_items=True,
+            case_type_prefix=case_type_prefix,
+            endpoint_path=endpoint_path,
+        )
+
+        response.raise_for_status()
+
+        res_rows = response.json().get("Rows", {})
+
+        rows = res_rows.get("Results", []) if isinstance(res_rows, dict) else res_rows
+
+        for row in rows:
+            case_id = _get_row_value(row, "caseid")
+            row_title = _get_row_value(row, "title")
+
+            if case_id and row_title:
+                journalized_documents.add((case_id, row_title))
+
+        # A page that is not full is the last page
+        if len(rows) < MODERN_SEARCH_PAGE_SIZE:
+            break
+
+    else:
+        raise ValueError(f"The pre-scan for documents titled '{title}' reached the limit of {max_pages} pages before the last page")
+
+    logger.info("Pre-scan found %d journalized document(s) titled '%s', in %d page(s)", len(journalized_documents), title, page_index + 1)
+
+    return journalized_documents
+
+
+def look_for_already_journalized_file(
+    document_handler: DocumentHandler,
+    employees_salary_case_id: str = "",
+    filename_to_match: str = "",
+    journalized_documents: set[tuple[str, str]] = None,
+):
     """
     Method to look for an already journalized file with the desired filename, for the given employee
+
+    If the index from build_journalized_documents_index is given, the check is a lookup in it, without any request.
+    Otherwise, the case is searched for the filename.
     """
 
-    print("inside function to identify employees where document is already journalized")
+    if journalized_documents is not None:
+        return (employees_salary_case_id, filename_to_match) in journalized_documents
 
-    keyword = f"{employees_salary_case_id} Meddelelse om løn 2025.07.01"
+    keyword = f"{employees_salary_case_id} {filename_to_match}"
 
     response = document_handler.search_documents_using_search_term(keyword, '/_goapi/Search/Results')
 
     res_rows = response.json()["Rows"]
 
-    if "Results" in res_rows:
-        for i, row in enumerate(res_rows["Results"]):
-            if "caseid" in row:
-                if row["caseid"] == employees_salary_case_id:
-                    if "title" in row:
-                        if row["title"] == filename_to_match:
-                            return True
-
-    return False
+    return any(
+        row.get("caseid") == employees_salary_case_id and row.get("title") == filename_to_match
+        for row in res_rows.get("Results", [])
+    )
@@ -0,0 +1,208 @@
+"""
+This module sets up the logging of a run.
+
+The hot loops log through the standard logging module, where a QueueHandler hands every record to a background QueueListener,
+so a slow console or a slow Orchestrator database never holds back the workers. Every record has its CPR numbers redacted before
+it is queued, and only warnings and errors are sent on to Orchestrator by default.
+"""
+import hashlib
+import hmac
+import logging
+import queue
+import re
+import sys
+import threading
+
+from collections import Counter
+from logging.handlers import QueueHandler, QueueListener
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+# A CPR number - six digits for the date of birth and four more, optionally separated by a dash - not part of a longer number
+CPR_PATTERN = re.compile(r"(?<!\d)(\d{6})-?(\d{4})(?!\d)")
+
+LOG_FORMAT = "%(asctime)s %(levelname)-7s %(threadName)s %(name)s: %(message)s"
+
+# Set as an extra attribute on a record that was already sent to Orchestrator directly, so OrchestratorLogHandler does not send it again
+SENT_TO_ORCHESTRATOR = "sent_to_orchestrator"
+
+
+class CprRedactingFilter(logging.Filter):
+    """
+    Replaces every CPR number in a log record with a short token, e.g. 'cpr#3f9a1c2e'.
+
+    The token is an HMAC of the CPR number, so the lines about the same person can still be found together, without the CPR number being logged.
+
+    Attributes:
+    - secret (str): The secret the CPR numbers are hashed with.
+    """
+    def __init__(self, secret: str = ""):
+        super().__init__()
+        self.secret = secret
+
+    def redact(self, text: str) -> str:
+        """Returns the text with every CPR number replaced by its token."""
+
+        return CPR_PATTERN.sub(self._token, text)
+
+    def _token(self, match: re.Match) -> str:
+        cpr = match.group(1) + match.group(2)
+
+        return f"cpr#{hmac.new(self.secret.encode('utf-8'), cpr.encode('utf-8'), hashlib.sha256).hexdigest()[:8]}"
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        # The message is formatted here, so CPR numbers passed as arguments are redacted as well
+        record.msg = self.redact(record.getMessage())
+        record.args = None
+
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.redact(logging.Formatter().formatException(record.exc_info))
+
+        record.exc_info = None
+
+        return True
+
+
+class OrchestratorLogHandler(logging.Handler):
+    """
+    Sends log records to the Orchestrator log.
+
+    OrchestratorConnection has no warning level, so errors go to log_error, warnings and info to log_info, and anything lower to log_trace.
+    A record with the SENT_TO_ORCHESTRATOR attribute set is skipped, since it is already in the Orchestrator log.
+
+    Attributes:
+    - orchestrator_connection (OrchestratorConnection): The connection the records are sent to.
+    """
+    def __init__(self, orchestrator_connection: OrchestratorConnection, level: int | str = logging.WARNING):
+        super().__init__(level=level)
+        self.orchestrator_connection = orchestrator_connection
+
+    def emit(self, record: logging.LogRecord) -> None:
+        if getattr(record, SENT_TO_ORCHESTRATOR, False):
+            return
+
+        try:
+            message = self.format(record)
+
+            if record.levelno >= logging.ERROR:
+                self.orchestrator_connection.log_error(message)
+
+            elif record.levelno >= logging.INFO:
+                self.orchestrator_connection.log_info(message)
+
+            else:
+                self.orchestrator_connection.log_trace(message)
+
+        except Exception:
+            self.handleError(record)
+
+
+def setup_logging(
+    orchestrator_connection: OrchestratorConnection = None,
+    console_level: int | str = logging.INFO,
+    orchestrator_level: int | str = logging.WARNING,
+    log_file: str = None,
+    redaction_secret: str = "",
+) -> QueueListener:
+    """
+    Routes all logging through a queue to the console, an optional log file and Orchestrator, with the CPR numbers redacted.
+
+    Parameters:
+    - orchestrator_connection (OrchestratorConnection): Optional connection the records at orchestrator_level and above are sent to.
+    - console_level (int | str): The lowest level written to the console, e.g. logging.INFO or "INFO".
+    - orchestrator_level (int | str): The lowest level sent to Orchestrator.
+    - log_file (str): Optional path of a file every record, at DEBUG and above, is appended to.
+    - redaction_secret (str): The secret the CPR tokens are made with.
+
+    Returns:
+    - QueueListener: The running listener - pass it to stop_logging() at the end of the run, so every queued record is written.
+    """
+
+    formatter = logging.Formatter(LOG_FORMAT)
+
+    handlers = []
+
+    console_handler = logging.StreamHandler(sys.stdout)
+    console_handler.setLevel(console_level)
+    handlers.append(console_handler)
+
+    if log_file:
+        file_handler = logging.FileHandler(log_file, encoding="utf-8")
+        file_handler.setLevel(logging.DEBUG)
+        handlers.append(file_handler)
+
+    if orchestrator_connection:
+        handlers.append(OrchestratorLogHandler(orchestrator_connection, level=orchestrator_level))
+
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(CprRedactingFilter(secret=redaction_secret))
+
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(min(handler.level for handler in handlers))
+
+    # The requests and urllib3 loggers would log every connection at DEBUG
+    for noisy_logger in ("urllib3", "requests_ntlm"):
+        logging.getLogger(noisy_logger).setLevel(logging.WARNING)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+
+    return listener
+
+
+def stop_logging(listener: QueueListener) -> None:
+    """Writes every queued record, and stops the listener."""
+
+    listener.stop()
+
+    for handler in listener.handlers:
+        handler.flush()
+
+
+class PeriodicSummary:
+    """
+    Counts the outcome of every CPR, and logs a single summary line every N CPRs, instead of a line per CPR.
+
+    Attributes:
+    - logger (logging.Logger): The logger the summary lines are written to, at INFO.
+    - label (str): What is being counted, e.g. 'Case resolution'.
+    - every (int): The number of CPRs between summary lines.
+    - total (int): The total number of CPRs, for the progress in the summary.
+    - counts (Counter): The number of CPRs per outcome so far.
+    """
+    def __init__(self, logger: logging.Logger, label: str, every: int = 100, total: int = 0):
+        self.logger = logger
+        self.label = label
+        self.every = max(1, every)
+        self.total = total
+        self.counts = Counter()
+        self._lock = threading.Lock()
+
+    def add(self, outcome: str) -> None:
+        """Counts the outcome of a CPR, and logs the summary if it is the Nth one."""
+
+        with self._lock:
+            self.counts[outcome] += 1
+
+            done = sum(self.counts.values())
+
+            if done % self.every == 0:
+                self._log(done)
+
+    def log_final(self) -> None:
+        """Logs the summary of the last CPRs, if they were not a multiple of N."""
+
+        with self._lock:
+            done = sum(self.counts.values())
+
+            if done % self.every:
+                self._log(done)
+
+    def _log(self, done: int) -> None:
+        self.logger.info("%s: %d/%d CPRs done - %s", self.label, done, self.total, dict(self.counts))
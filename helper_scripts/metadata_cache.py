@@ -0,0 +1,141 @@
+"""
+This module provides a bounded cache of parsed GetOrganized case metadata, keyed by case ID.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import Counter, OrderedDict
+
+logger = logging.getLogger(__name__)
+
+
+class MetadataCache:
+    """
+    A thread-safe LRU cache with a time-to-live, holding the parsed metadata attributes of GetOrganized cases.
+
+    When the cache is full, the least recently used case is evicted. Entries older than ttl_seconds are treated as missing.
+    If a persist_path is given, the cache is loaded from that JSON file when created, and written back with save(),
+    so the metadata survives between runs - the timestamps are stored as well, so the TTL still applies after a restart.
+
+    Attributes:
+    - max_entries (int): The maximum number of cases held in the cache.
+    - ttl_seconds (float): The number of seconds an entry stays valid.
+    - persist_path (str): Optional path to the JSON file the cache is loaded from and saved to.
+    - counters (Counter): The number of 'hits' answered by the cache, 'misses' not in the cache or expired, and 'evictions' because the cache was full.
+    """
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 24 * 60 * 60, persist_path: str = None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.persist_path = persist_path
+        self.counters = Counter(hits=0, misses=0, evictions=0)
+        self._entries: OrderedDict[str, tuple[float, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+        if persist_path:
+            self._load()
+
+    def _load(self) -> None:
+        """Loads the non-expired entries from the persisted JSON file, if it exists."""
+
+        if not os.path.exists(self.persist_path):
+            return
+
+        try:
+            with open(self.persist_path, mode="r", encoding="utf-8") as cache_file:
+                persisted_entries = json.load(cache_file)
+
+        except (OSError, json.JSONDecodeError) as e:
+            # A broken cache file is not worth failing the run over - we simply start with an empty cache
+            logger.warning("Could not load the metadata cache from %s: %s", self.persist_path, e)
+
+            return
+
+        now = time.time()
+
+        for case_id, (stored_at, attributes) in persisted_entries.items():
+            if now - stored_at < self.ttl_seconds:
+                self._entries[case_id] = (stored_at, attributes)
+
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def save(self) -> None:
+        """Writes the cache to the persist_path JSON file. The file is replaced atomically, so a crash never leaves a half-written cache."""
+
+        if not self.persist_path:
+            return
+
+        with self._lock:
+            entries = dict(self._entries)
+
+        temp_path = f"{self.persist_path}.tmp"
+
+        with open(temp_path, mode="w", encoding="utf-8") as cache_file:
+            json.dump(entries, cache_file)
+
+        os.replace(temp_path, self.persist_path)
+
+    def get(self, case_id: str) -> dict | None:
+        """
+        Returns the cached metadata attributes for a case, or None if the case is not cached or the entry has expired.
+
+        Parameters:
+        - case_id (str): The ID of the case.
+        """
+
+        with self._lock:
+            entry = self._entries.get(case_id)
+
+            if entry is None:
+                self.counters["misses"] += 1
+
+                return None
+
+            stored_at, attributes = entry
+
+            if time.time() - stored_at >= self.ttl_seconds:
+                del self._entries[case_id]
+
+                self.counters["misses"] += 1
+
+                return None
+
+            self._entries.move_to_end(case_id)
+
+            self.counters["hits"] += 1
+
+            return attributes
+
+    def put(self, case_id: str, attributes: dict) -> None:
+        """
+        Stores the metadata attributes for a case, evicting the least recently used case if the cache is full.
+
+        Parameters:
+        - case_id (str): The ID of the case.
+        - attributes (dict): The parsed metadata attributes of the case.
+        """
+
+        with self._lock:
+            self._entries[case_id] = (time.time(), dict(attributes))
+
+            self._entries.move_to_end(case_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+                self.counters["evictions"] += 1
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters, the hit rate and the current size of the cache, for tuning max_entries and ttl_seconds."""
+
+        with self._lock:
+            lookups = self.counters["hits"] + self.counters["misses"]
+
+            return {
+                **self.counters,
+                "hit_rate": self.counters["hits"] / lookups if lookups else 0.0,
+                "size": len(self._entries),
+            }
@@ -0,0 +1,213 @@
+"""
+This module reports the progress of a phase of a run - the number of items done, failed and skipped, the rolling throughput and the ETA.
+
+A mailing to thousands of employees runs for hours, so each phase reports its progress to the Orchestrator log every report_every_seconds,
+and writes it to a JSON file, which a dashboard can poll without reading the logs.
+"""
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import Counter, deque
+from dataclasses import dataclass
+from datetime import datetime
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from helper_scripts.logging_setup import SENT_TO_ORCHESTRATOR
+
+logger = logging.getLogger(__name__)
+
+# The classes a status can be counted in, besides done - a status that is in neither counts as succeeded
+FAILED = "failed"
+SKIPPED = "skipped"
+
+
+@dataclass
+class ProgressSettings:
+    """
+    How often a phase reports its progress.
+
+    Attributes:
+    - report_every_seconds (float): The minimum number of seconds between two reports.
+    - window_seconds (float): The number of seconds the rolling throughput is measured over.
+    """
+    report_every_seconds: float = 60
+    window_seconds: float = 300
+
+
+class ProgressReporter:
+    """
+    Tracks and reports the progress of one phase of a run.
+
+    The phase calls start() once the number of items is known, add() with the status of every finished item, and finish() at the end.
+    The throughput is measured over the last window_seconds, so the ETA follows the current speed rather than the average of the whole run.
+
+    Attributes:
+    - phase (str): The name of the phase, e.g. 'case_resolution'.
+    - orchestrator_connection (OrchestratorConnection): Optional connection the progress is reported to with log_info.
+    - progress_path (str): Optional path of the JSON file the progress is written to.
+    - settings (ProgressSettings): How often the progress is reported.
+    - status_classes (dict): The class of each status that is not simply succeeded - FAILED or SKIPPED, e.g. {"failed": FAILED}.
+    """
+    def __init__(
+        self,
+        phase: str,
+        orchestrator_connection: OrchestratorConnection = None,
+        progress_path: str = None,
+        settings: ProgressSettings = None,
+        status_classes: dict = None,
+    ):
+        self.phase = phase
+        self.orchestrator_connection = orchestrator_connection
+        self.progress_path = progress_path
+        self.settings = settings or ProgressSettings()
+        self.status_classes = status_classes or {}
+        self._state = {
+            "total": 0,
+            "already_done": 0,
+            "started_at": None,
+            "started": 0.0,
+            "last_report": 0.0,
+            "finished": False,
+            "statuses": Counter(),
+            "finish_times": deque(),
+        }
+        self._lock = threading.Lock()
+
+    def start(self, total: int, already_done: int = 0) -> None:
+        """
+        Starts the clock of the phase.
+
+        Parameters:
+        - total (int): The number of items the phase will process in this run.
+        - already_done (int): The number of items skipped up front, because they were done in an earlier run.
+        """
+
+        with self._lock:
+            now = time.monotonic()
+
+            self._state.update(
+                total=total,
+                already_done=already_done,
+                started_at=datetime.now().isoformat(timespec="seconds"),
+                started=now,
+                last_report=now,
+                finished=False,
+                statuses=Counter(),
+                finish_times=deque(),
+            )
+
+        self.report()
+
+    def add(self, status: str) -> None:
+        """Counts a finished item with its status, and reports the progress if report_every_seconds have passed since the last report."""
+
+        with self._lock:
+            now = time.monotonic()
+
+            self._state["statuses"][status] += 1
+            self._state["finish_times"].append(now)
+
+            due = now - self._state["last_report"] >= self.settings.report_every_seconds
+
+        if due:
+            self.report()
+
+    def finish(self) -> dict:
+        """Reports the final progress of the phase, and returns it."""
+
+        with self._lock:
+            self._state["finished"] = True
+
+        return self.report()
+
+    def snapshot(self) -> dict:
+        """Returns the current progress, in the format of the progress file."""
+
+        with self._lock:
+            now = time.monotonic()
+
+            statuses, finish_times = self._state["statuses"], self._state["finish_times"]
+
+            # Only the items finished within the window count towards the rolling throughput
+            while finish_times and now - finish_times[0] > self.settings.window_seconds:
+                finish_times.popleft()
+
+            done = sum(statuses.values())
+
+            elapsed = now - self._state["started"] if self._state["started"] else 0.0
+
+            window = min(self.settings.window_seconds, elapsed)
+
+            items_per_second = len(finish_times) / window if window > 0 else 0.0
+
+            remaining = max(0, self._state["total"] - done)
+
+            return {
+                "phase": self.phase,
+                "started_at": self._state["started_at"],
+                "updated_at": datetime.now().isoformat(timespec="seconds"),
+                "finished": self._state["finished"],
+                "total": self._state["total"],
+                "done": done,
+                "failed": sum(count for status, count in statuses.items() if self.status_classes.get(status) == FAILED),
+                "skipped": sum(count for status, count in statuses.items() if self.status_classes.get(status) == SKIPPED),
+                "already_done": self._state["already_done"],
+                "statuses": dict(statuses),
+                "elapsed_seconds": round(elapsed, 1),
+                "items_per_second": round(items_per_second, 3),
+                "eta_seconds": round(remaining / items_per_second) if items_per_second > 0 else None,
+            }
+
+    def report(self) -> dict:
+        """Logs the current progress, sends it to Orchestrator and writes the progress file, and returns it."""
+
+        progress = self.snapshot()
+
+        with self._lock:
+            self._state["last_report"] = time.monotonic()
+
+        eta = "unknown" if progress["eta_seconds"] is None else _format_seconds(progress["eta_seconds"])
+
+        message = (
+            f"{self.phase}: {progress['done']}/{progress['total']} done, {progress['failed']} failed, {progress['skipped']} skipped "
+            f"({progress['already_done']} done in earlier runs), {progress['items_per_second']:.2f} items/s, ETA {eta}"
+        )
+
+        # The report is sent to Orchestrator directly, whatever the Orchestrator log level, so the log handler is told to leave it out
+        logger.info(message, extra={SENT_TO_ORCHESTRATOR: self.orchestrator_connection is not None})
+
+        if self.orchestrator_connection:
+            self.orchestrator_connection.log_info(message)
+
+        if self.progress_path:
+            self._write_progress_file(progress)
+
+        return progress
+
+    def _write_progress_file(self, progress: dict) -> None:
+        # The file is replaced in one step, so a dashboard never reads a half-written file
+        temporary_path = f"{self.progress_path}.tmp"
+
+        try:
+            with open(temporary_path, mode="w", encoding="utf-8") as progress_file:
+                json.dump(progress, progress_file, indent=2)
+
+            os.replace(temporary_path, self.progress_path)
+
+        except OSError as e:
+            # The progress file is only for monitoring - not worth failing the run over
+            logger.warning("Could not write the progress file %s: %s", self.progress_path, e)
+
+
+def _format_seconds(seconds: float) -> str:
+    """Formats a number of seconds as h:mm:ss."""
+
+    minutes, seconds = divmod(int(seconds), 60)
+
+    hours, minutes = divmod(minutes, 60)
+
+    return f"{hours}:{minutes:02d}:{seconds:02d}"
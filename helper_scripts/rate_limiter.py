@@ -0,0 +1,227 @@
+"""
+This module provides thread-safe rate limiters, used to cap the number of requests sent to each GetOrganized host.
+
+RateLimiter applies one rate to every request. EndpointRateLimiter keeps a RateLimiter per class of endpoint - searches, metadata lookups
+and uploads - so each class can be given its own share of the tenant, and can lower its rate by itself when GetOrganized slows down.
+"""
+import threading
+import time
+
+from collections import Counter
+from dataclasses import dataclass
+from urllib.parse import urlparse
+
+
+class RateLimiter:
+    """
+    A token bucket rate limiter, keeping one bucket per host.
+
+    Every call to acquire() takes one token from the bucket of the given host, and blocks until a token is available.
+    The buckets are refilled continuously at requests_per_second, and can hold at most burst tokens.
+
+    Attributes:
+    - requests_per_second (float): The sustained number of requests allowed per host per second. 0 or less disables the limiter.
+    - burst (int): The maximum number of requests that can be sent back-to-back after an idle period.
+    - counters (Counter): The number of 'calls', the number of 'throttled_calls' that had to wait, and the total 'throttled_seconds'.
+    """
+    def __init__(self, requests_per_second: float, burst: int = 1):
+        self.requests_per_second = requests_per_second
+        self.burst = max(1, burst)
+        self.counters = Counter(calls=0, throttled_calls=0, throttled_seconds=0.0)
+        self._buckets: dict[str, tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, requests_per_second: float) -> None:
+        """
+        Changes the rate while the limiter is in use. The tokens already in the buckets are kept.
+
+        Parameters:
+        - requests_per_second (float): The new number of requests allowed per host per second. 0 or less disables the limiter.
+        """
+
+        with self._lock:
+            self.requests_per_second = requests_per_second
+
+    def acquire(self, url: str) -> float:
+        """
+        Takes one token from the bucket of the host in the given url, sleeping until a token is available.
+
+        Parameters:
+        - url (str): The url of the request about to be sent - only the host part is used.
+
+        Returns:
+        - float: The number of seconds the call was throttled.
+        """
+
+        host = urlparse(url).netloc or url
+
+        with self._lock:
+            self.counters["calls"] += 1
+
+            if self.requests_per_second <= 0:
+                return 0.0
+
+            now = time.monotonic()
+
+            tokens, last_refill = self._buckets.get(host, (float(self.burst), now))
+
+            tokens = min(float(self.burst), tokens + (now - last_refill) * self.requests_per_second)
+
+            # The token is taken right away, even if the bucket goes negative - the caller then sleeps until its token would have been refilled.
+            # This reserves the caller's slot while the lock is held, so concurrent callers are spaced out evenly instead of waking up all at once.
+            tokens -= 1
+
+            self._buckets[host] = (tokens, now)
+
+            wait_seconds = -tokens / self.requests_per_second if tokens < 0 else 0.0
+
+            if wait_seconds > 0:
+                self.counters["throttled_calls"] += 1
+                self.counters["throttled_seconds"] += wait_seconds
+
+        if wait_seconds > 0:
+            time.sleep(wait_seconds)
+
+        return wait_seconds
+
+    def record_response(self, url: str, latency: float, status_code: int) -> None:
+        """Does nothing - the rate of a RateLimiter only changes with set_rate(). See EndpointRateLimiter for a limiter that adapts."""
+
+
+# The classes of GetOrganized endpoints, each matched by a part of the lowercased endpoint path. Anything else is in the 'other' class.
+ENDPOINT_CLASSES = {
+    "search": ("/search/", "/findbycaseproperties"),
+    "metadata": ("/cases/metadata/", "/contacts/readitem"),
+    "upload": ("/documents/addtocase", "/documents/markmultipleascaserecord", "/documents/finalizemultiple"),
+}
+
+
+def classify_endpoint(url: str) -> str:
+    """Returns the class of the GetOrganized endpoint in the url - 'search', 'metadata', 'upload' or 'other'."""
+
+    path = urlparse(url).path.lower() or url.lower()
+
+    for endpoint_class, path_parts in ENDPOINT_CLASSES.items():
+        if any(path_part in path for path_part in path_parts):
+            return endpoint_class
+
+    return "other"
+
+
+@dataclass
+class AimdSettings:
+    """
+    The settings of the AIMD mode of an EndpointRateLimiter - additive increase, multiplicative decrease.
+
+    Attributes:
+    - min_rate (float): The lowest rate a class can be lowered to.
+    - decrease_factor (float): The factor the rate is multiplied with on a decrease.
+    - increase_per_second (float): The rate added per second of successful traffic.
+    - latency_spike_factor (float): How many times slower than average a response must be to count as a spike.
+    """
+    min_rate: float = 0.5
+    decrease_factor: float = 0.5
+    increase_per_second: float = 0.5
+    latency_spike_factor: float = 3.0
+
+
+class EndpointRateLimiter:
+    """
+    A rate limiter keeping a token bucket per class of GetOrganized endpoint, with an optional AIMD mode.
+
+    In AIMD mode, the rate of a class is cut by the decrease_factor when GetOrganized answers with 429 or 503, or when a response is more than
+    latency_spike_factor times slower than the class' moving average. Every other response raises the rate a little, by about increase_per_second
+    requests per second for every second of traffic, back up to the configured rate. A class without a rate is not limited, and does not adapt.
+
+    Attributes:
+    - limiters (dict[str, RateLimiter]): The rate limiter of each endpoint class - 'search', 'metadata', 'upload' and 'other'.
+    - max_rates (dict[str, float]): The configured rate of each class, from rates or else default_rate - the ceiling of the AIMD mode.
+    - aimd (AimdSettings): The settings of the AIMD mode, or None to keep the rates fixed.
+    - counters (Counter): The number of rate decreases per class, keyed by '<class>_decreases'.
+    """
+    def __init__(self, rates: dict[str, float], default_rate: float = 0, aimd: AimdSettings = None):
+        self.max_rates = {endpoint_class: rates.get(endpoint_class, default_rate) for endpoint_class in [*ENDPOINT_CLASSES, "other"]}
+        self.limiters = {endpoint_class: RateLimiter(requests_per_second=rate) for endpoint_class, rate in self.max_rates.items()}
+        self.aimd = aimd
+        self.counters = Counter()
+        self._average_latencies: dict[str, tuple[float, int]] = {}
+        self._last_decrease: dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def set_rate(self, endpoint_class: str, requests_per_second: float) -> None:
+        """
+        Changes the rate of an endpoint class while the limiter is in use. The new rate is also the new ceiling of the AIMD mode.
+
+        Parameters:
+        - endpoint_class (str): 'search', 'metadata', 'upload' or 'other'.
+        - requests_per_second (float): The new rate. 0 or less removes the limit for the class.
+        """
+
+        with self._lock:
+            self.max_rates[endpoint_class] = requests_per_second
+
+        self.limiters[endpoint_class].set_rate(requests_per_second)
+
+    def acquire(self, url: str) -> float:
+        """
+        Takes one token from the bucket of the endpoint class and host of the url, sleeping until a token is available.
+
+        Returns:
+        - float: The number of seconds the call was throttled.
+        """
+
+        return self.limiters[classify_endpoint(url)].acquire(url)
+
+    def record_response(self, url: str, latency: float, status_code: int) -> None:
+        """
+        Adjusts the rate of the endpoint class after a response, in AIMD mode.
+
+        Parameters:
+        - url (str): The url of the request.
+        - latency (float): The number of seconds the request took.
+        - status_code (int): The HTTP status of the response, or 0 if no response was received.
+        """
+
+        endpoint_class = classify_endpoint(url)
+
+        limiter = self.limiters[endpoint_class]
+
+        if not self.aimd or self.max_rates[endpoint_class] <= 0:
+            return
+
+        with self._lock:
+            average_latency, sample_count = self._average_latencies.get(endpoint_class, (latency, 0))
+
+            # The average only counts a spike once it has seen enough responses to be meaningful
+            is_latency_spike = sample_count >= 10 and latency > average_latency * self.aimd.latency_spike_factor
+
+            # An exponential moving average, so the average follows the server when it slows down for good
+            self._average_latencies[endpoint_class] = (average_latency * 0.9 + latency * 0.1, sample_count + 1)
+
+            rate = limiter.requests_per_second
+
+            now = time.monotonic()
+
+            if status_code in (429, 503) or is_latency_spike:
+                # A burst of failures from requests sent at the old rate should only lower the rate once, so we wait about one average round-trip between decreases
+                if now - self._last_decrease.get(endpoint_class, 0.0) < max(average_latency, 1.0):
+                    return
+
+                self._last_decrease[endpoint_class] = now
+
+                self.counters[f"{endpoint_class}_decreases"] += 1
+
+                new_rate = max(self.aimd.min_rate, rate * self.aimd.decrease_factor)
+
+            else:
+                new_rate = min(self.max_rates[endpoint_class], rate + self.aimd.increase_per_second / max(rate, self.aimd.min_rate))
+
+        limiter.set_rate(new_rate)
+
+    def stats(self) -> dict:
+        """Returns the current rate and the throttling counters of each endpoint class, for the log."""
+
+        return {
+            endpoint_class: {"rate": round(limiter.requests_per_second, 2), **limiter.counters}
+            for endpoint_class, limiter in self.limiters.items()
+        }
@@ -0,0 +1,184 @@
+"""
+This module provides the retry policy and the circuit breaker shared by the GetOrganized handlers.
+
+Every request goes through GetOrganizedClient._request, which asks the RetryPolicy whether a failed attempt may be sent again,
+and how long to wait first, and asks the CircuitBreaker to hold the request back while GetOrganized is overloaded.
+"""
+import random
+import threading
+import time
+
+from collections import Counter
+from email.utils import parsedate_to_datetime
+
+import requests
+
+# The statuses where GetOrganized turned the request away without handling it, so any request - also a non-idempotent one - can be sent again
+REJECTED_STATUSES = frozenset({429, 503})
+
+# The statuses where the request may or may not have been handled, so only an idempotent request can be sent again
+TRANSIENT_STATUSES = frozenset({500, 502, 504})
+
+
+def parse_retry_after(response: requests.Response) -> float | None:
+    """
+    Returns the number of seconds asked for by the Retry-After header of a response, or None if there is no valid header.
+
+    The header is either a number of seconds or an HTTP date.
+    """
+
+    if response is None:
+        return None
+
+    retry_after = response.headers.get("Retry-After")
+
+    if not retry_after:
+        return None
+
+    try:
+        return max(0.0, float(retry_after))
+
+    except ValueError:
+        pass
+
+    try:
+        return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+
+    except (TypeError, ValueError):
+        return None
+
+
+class RetryPolicy:
+    """
+    Decides which failed requests are sent again, and how long to wait before each new attempt.
+
+    The wait is an exponential backoff with full jitter - a random time between 0 and base_delay * 2^attempt, capped at max_delay -
+    so workers that failed at the same time do not retry at the same time. If the response has a Retry-After header, that is waited instead.
+
+    A request is idempotent if sending it twice has the same effect as sending it once, e.g. a lookup or a search. Only idempotent requests are sent again
+    after a timeout or a 5xx error, since a non-idempotent request, like an upload, may already have been handled. Any request is sent again if the connection
+    could not be set up, or GetOrganized turned it away with 429 or 503.
+
+    Attributes:
+    - max_attempts (int): The maximum number of attempts per request, including the first one.
+    - base_delay (float): The number of seconds of the first backoff.
+    - max_delay (float): The maximum number of seconds waited before an attempt, also for a Retry-After header.
+    """
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 30.0):
+        self.max_attempts = max(1, max_attempts)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def should_retry(self, attempt: int, idempotent: bool, response: requests.Response = None, error: Exception = None) -> bool:
+        """
+        Returns True if a failed attempt should be sent again.
+
+        Parameters:
+        - attempt (int): The number of attempts sent so far.
+        - idempotent (bool): Whether the request can safely be sent more than once.
+        - response (requests.Response): The response of the attempt, if one was received.
+        - error (Exception): The exception raised by the attempt, if no response was received.
+        """
+
+        if attempt >= self.max_attempts:
+            return False
+
+        if error is not None:
+            if isinstance(error, requests.exceptions.ConnectTimeout):
+                return True
+
+            # A refused or reset connection may have dropped after the request was sent, so it is only safe to repeat for idempotent requests
+            return idempotent and isinstance(error, (requests.ConnectionError, requests.Timeout))
+
+        if response.status_code in REJECTED_STATUSES:
+            return True
+
+        return idempotent and response.status_code in TRANSIENT_STATUSES
+
+    def get_delay(self, attempt: int, response: requests.Response = None) -> float:
+        """
+        Returns the number of seconds to wait before the next attempt.
+
+        Parameters:
+        - attempt (int): The number of attempts sent so far.
+        - response (requests.Response): The response of the failed attempt, if one was received.
+        """
+
+        retry_after = parse_retry_after(response)
+
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class CircuitBreaker:
+    """
+    Holds back every request from every worker while GetOrganized is overloaded.
+
+    The circuit opens after failure_threshold overload failures in a row - 429 and 5xx responses, timeouts and connection errors - or right away
+    when GetOrganized answers with a Retry-After header. While it is open, wait_until_closed() blocks every worker, so the server gets a break
+    instead of a wave of retries. A single successful request resets the count.
+
+    Attributes:
+    - failure_threshold (int): The number of overload failures in a row that opens the circuit.
+    - cooldown_seconds (float): The number of seconds the circuit stays open, unless a Retry-After header asks for longer.
+    - counters (Counter): The number of times the circuit was 'opened', and the total 'paused_seconds' of the workers.
+    """
+    def __init__(self, failure_threshold: int = 5, cooldown_seconds: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.cooldown_seconds = cooldown_seconds
+        self.counters = Counter(opened=0, paused_seconds=0.0)
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+        self._lock = threading.Lock()
+
+    def wait_until_closed(self) -> float:
+        """Blocks while the circuit is open, and returns the number of seconds waited."""
+
+        waited = 0.0
+
+        while True:
+            with self._lock:
+                remaining = self._open_until - time.monotonic()
+
+                if remaining <= 0:
+                    self.counters["paused_seconds"] += waited
+
+                    return waited
+
+            time.sleep(remaining)
+
+            waited += remaining
+
+    def record_success(self) -> None:
+        """Resets the count of overload failures in a row."""
+
+        with self._lock:
+            self._consecutive_failures = 0
+
+    def record_failure(self, retry_after: float = None) -> None:
+        """
+        Counts an overload failure, and opens the circuit if the threshold is reached or the server asked for a pause.
+
+        Parameters:
+        - retry_after (float): The number of seconds asked for by a Retry-After header, if any.
+        """
+
+        with self._lock:
+            self._consecutive_failures += 1
+
+            if retry_after is None and self._consecutive_failures < self.failure_threshold:
+                return
+
+            pause_seconds = self.cooldown_seconds if retry_after is None else retry_after
+
+            open_until = time.monotonic() + pause_seconds
+
+            if open_until > self._open_until:
+                if self._open_until <= time.monotonic():
+                    self.counters["opened"] += 1
+
+                self._open_until = open_until
+
+            self._consecutive_failures = 0
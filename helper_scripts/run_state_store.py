@@ -0,0 +1,368 @@
+"""
+This module provides the durable run state of a mailing, shared by the identification and journalization phases.
+
+The state lives in a single SQLite database in WAL mode, with one table for the employees from the sheet, one for the resolved salary cases
+and one for the uploaded documents. Every table is keyed by CPR number, so resume checks are indexed lookups, and every row carries a status
+and the error text of its last failure. The tables can be exported to CSV files for the business users.
+"""
+import csv
+import os
+import sqlite3
+import threading
+
+from datetime import datetime
+
+# The statuses of the resolved_cases table
+CASE_RESOLVED = "resolved"
+CASE_NOT_FOUND = "not_found"
+CASE_FAILED = "failed"
+
+# The statuses of the uploaded_docs table
+DOC_UPLOADED = "uploaded"
+DOC_ALREADY_JOURNALIZED = "already_journalized"
+DOC_SKIPPED = "skipped"
+DOC_FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS employees (
+    cpr TEXT PRIMARY KEY,
+    tjenestenummer TEXT,
+    navn TEXT,
+    stilling TEXT
+);
+
+CREATE TABLE IF NOT EXISTS resolved_cases (
+    cpr TEXT PRIMARY KEY,
+    case_id TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_resolved_cases_status ON resolved_cases (status);
+
+CREATE TABLE IF NOT EXISTS uploaded_docs (
+    cpr TEXT PRIMARY KEY,
+    case_id TEXT,
+    doc_id TEXT,
+    status TEXT NOT NULL,
+    error TEXT,
+    updated_at TEXT NOT NULL
+);
+
+CREATE INDEX IF NOT EXISTS ix_uploaded_docs_status ON uploaded_docs (status);
+"""
+
+# Columns added after the first release of the schema - they are added to existing databases when opened, so a run can resume across versions
+_ADDED_COLUMNS = [
+    ("uploaded_docs", "journalized_at", "TEXT"),
+    ("uploaded_docs", "finalized_at", "TEXT"),
+    ("uploaded_docs", "batch_error", "TEXT"),
+]
+
+# The headers of the CSV checkpoint files written before the run state - the files are overwritten with exports of the tables, with other headers,
+# at the end of the first run with the run state, so only a mailing started by an earlier version is imported
+LEGACY_CSV_HEADERS = (["cpr", "case_id"], ["cpr", "doc_id"], ["CPR Nummer", "Salary Case ID"])
+
+# The value the earlier versions wrote, instead of an ID, for an employee without a salary case or an uploaded document
+LEGACY_NOT_HANDLED = "CPR NOT PROPERLY HANDLED - Please investigate this SSN"
+
+# The value the earlier versions could write, instead of a document ID, for an upload that failed
+LEGACY_UPLOAD_FAILED = "Journalization process was unsuccessfull"
+
+# The batch steps run on the uploaded documents, in order - each maps to the column holding its completion time,
+# and to the column that must be set before the step can run
+BATCH_STEPS = {
+    "journalize": ("journalized_at", None),
+    "finalize": ("finalized_at", "journalized_at"),
+}
+
+
+class RunStateStore:
+    """
+    A class to read and write the run state of a mailing in an embedded SQLite database.
+
+    A single connection is shared by all threads, guarded by a lock. Writes are made in batches, each batch in its own transaction,
+    so a crash never leaves a half-written batch behind.
+
+    Attributes:
+    - db_path (str): The path to the SQLite database file. It is created if it does not exist.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+
+        # Transactions are handled explicitly in _write, so the connection runs in autocommit mode
+        self._connection = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+
+        with self._lock:
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(_SCHEMA)
+            self._add_missing_columns()
+
+    def _add_missing_columns(self) -> None:
+        """Adds the columns from _ADDED_COLUMNS that are missing in a database created by an earlier version."""
+
+        for table, column, column_type in _ADDED_COLUMNS:
+            existing_columns = {row[1] for row in self._connection.execute(f"PRAGMA table_info({table})")}
+
+            if column not in existing_columns:
+                self._connection.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+    def close(self) -> None:
+        """Closes the database connection."""
+
+        with self._lock:
+            self._connection.close()
+
+    def _write(self, statement: str, rows: list[tuple]) -> None:
+        """Runs a statement for every row, in a single transaction."""
+
+        if not rows:
+            return
+
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+
+            try:
+                self._connection.executemany(statement, rows)
+
+            except Exception:
+                self._connection.execute("ROLLBACK")
+
+                raise
+
+            self._connection.execute("COMMIT")
+
+    def _read(self, statement: str, parameters: tuple = ()) -> list[tuple]:
+        """Runs a query and returns all rows."""
+
+        with self._lock:
+            return self._connection.execute(statement, parameters).fetchall()
+
+    def upsert_employees(self, cpr_dicts: dict) -> None:
+        """
+        Stores the employees from the sheet, as returned by FileHandler.build_cpr_mapping.
+
+        Parameters:
+        - cpr_dicts (dict): The employee data, keyed by CPR number.
+        """
+
+        self._write(
+            "INSERT INTO employees (cpr, tjenestenummer, navn, stilling) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT (cpr) DO UPDATE SET tjenestenummer = excluded.tjenestenummer, navn = excluded.navn, stilling = excluded.stilling",
+            [(cpr, data.get("tjenestenummer"), data.get("navn"), data.get("stilling")) for cpr, data in cpr_dicts.items()]
+        )
+
+    def record_resolved_cases(self, rows: list[tuple]) -> None:
+        """
+        Stores the outcome of the case resolution for a batch of employees.
+
+        Parameters:
+        - rows (list[tuple]): One (cpr, case_id, status, error) tuple per employee - status is one of the CASE_ constants.
+        """
+
+        updated_at = datetime.now().isoformat(timespec="seconds")
+
+        self._write(
+            "INSERT INTO resolved_cases (cpr, case_id, status, error, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT (cpr) DO UPDATE SET case_id = excluded.case_id, status = excluded.status, error = excluded.error, updated_at = excluded.updated_at",
+            [(cpr, case_id, status, error, updated_at) for cpr, case_id, status, error in rows]
+        )
+
+    def record_uploaded_docs(self, rows: list[tuple]) -> None:
+        """
+        Stores the outcome of the upload for a batch of employees.
+
+        Parameters:
+        - rows (list[tuple]): One (cpr, case_id, doc_id, status, error) tuple per employee - status is one of the DOC_ constants.
+        """
+
+        updated_at = datetime.now().isoformat(timespec="seconds")
+
+        self._write(
+            "INSERT INTO uploaded_docs (cpr, case_id, doc_id, status, error, updated_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT (cpr) DO UPDATE SET case_id = excluded.case_id, doc_id = excluded.doc_id, status = excluded.status, "
+            "error = excluded.error, updated_at = excluded.updated_at",
+            [(cpr, case_id, doc_id, status, error, updated_at) for cpr, case_id, doc_id, status, error in rows]
+        )
+
+    def is_case_resolved(self, cpr: str) -> bool:
+        """Returns True if the case resolution for the CPR number is done - failed resolutions are retried, so they do not count."""
+
+        return bool(self._read("SELECT 1 FROM resolved_cases WHERE cpr = ? AND status IN (?, ?)", (cpr, CASE_RESOLVED, CASE_NOT_FOUND)))
+
+    def is_document_uploaded(self, cpr: str) -> bool:
+        """Returns True if the upload for the CPR number is done, or was skipped - failed uploads are retried, so they do not count."""
+
+        return bool(self._read(
+            "SELECT 1 FROM uploaded_docs WHERE cpr = ? AND status IN (?, ?, ?)",
+            (cpr, DOC_UPLOADED, DOC_ALREADY_JOURNALIZED, DOC_SKIPPED)
+        ))
+
+    def get_resolved_cases(self) -> dict:
+        """Returns a dictionary of CPR number to salary case ID, for every employee whose case was resolved, ordered by CPR number."""
+
+        return dict(self._read("SELECT cpr, case_id FROM resolved_cases WHERE status = ? ORDER BY cpr", (CASE_RESOLVED,)))
+
+    def get_outcome(self, table: str, cpr: str) -> dict | None:
+        """Returns the row of a CPR number in the resolved_cases or uploaded_docs table as a dictionary, or None if there is none."""
+
+        if table not in ("resolved_cases", "uploaded_docs"):
+            raise ValueError(f"Unknown table '{table}'")
+
+        with self._lock:
+            cursor = self._connection.execute(f"SELECT * FROM {table} WHERE cpr = ?", (cpr,))
+
+            row = cursor.fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip((column[0] for column in cursor.description), row))
+
+    def get_documents_for_batch_step(self, step: str) -> list[tuple]:
+        """
+        Returns the uploaded documents that still need a batch step, ordered by CPR number.
+
+        Parameters:
+        - step (str): One of the BATCH_STEPS - 'journalize' or 'finalize'.
+
+        Returns:
+        - list[tuple]: One (cpr, doc_id) tuple per document.
+        """
+
+        done_column, required_column = BATCH_STEPS[step]
+
+        required_condition = f"AND {required_column} IS NOT NULL" if required_column else ""
+
+        return self._read(
+            f"SELECT cpr, doc_id FROM uploaded_docs WHERE status = ? AND doc_id IS NOT NULL AND {done_column} IS NULL {required_condition} ORDER BY cpr",
+            (DOC_UPLOADED,)
+        )
+
+    def record_batch_step(self, step: str, cprs: list[str], error: str = None) -> None:
+        """
+        Stores the outcome of a batch step for a chunk of documents.
+
+        Parameters:
+        - step (str): One of the BATCH_STEPS - 'journalize' or 'finalize'.
+        - cprs (list[str]): The CPR numbers of the documents in the chunk.
+        - error (str): The error text if the step failed for the chunk, or None if it succeeded.
+        """
+
+        done_column, _ = BATCH_STEPS[step]
+
+        if error is None:
+            updated_at = datetime.now().isoformat(timespec="seconds")
+
+            self._write(f"UPDATE uploaded_docs SET {done_column} = ?, batch_error = NULL WHERE cpr = ?", [(updated_at, cpr) for cpr in cprs])
+
+        else:
+            self._write("UPDATE uploaded_docs SET batch_error = ? WHERE cpr = ?", [(error, cpr) for cpr in cprs])
+
+    def import_legacy_checkpoints(self, folder_path: str) -> dict:
+        """
+        Imports the CSV checkpoint files of a mailing started by an earlier version, employee_case_ids.csv and journalized_docs.csv in folder_path,
+        so the mailing resumes where it stopped instead of starting over.
+
+        A file is only imported if it has one of the LEGACY_CSV_HEADERS, and its table is still empty - so the import happens once.
+        A case ID of LEGACY_NOT_HANDLED is imported as not found. A document ID of LEGACY_NOT_HANDLED is imported as skipped,
+        as the earlier versions did not retry those either, and LEGACY_UPLOAD_FAILED as failed, so the upload is retried.
+
+        Returns:
+        - dict: The number of rows imported into resolved_cases and uploaded_docs.
+        """
+
+        imported_counts = {"resolved_cases": 0, "uploaded_docs": 0}
+
+        legacy_rows = {
+            table: _read_legacy_csv(os.path.join(folder_path, filename))
+            for table, filename in (("resolved_cases", "employee_case_ids.csv"), ("uploaded_docs", "journalized_docs.csv"))
+        }
+
+        if legacy_rows["resolved_cases"] and not self.count_by_status("resolved_cases"):
+            self.record_resolved_cases([
+                (cpr, None, CASE_NOT_FOUND, LEGACY_NOT_HANDLED) if case_id == LEGACY_NOT_HANDLED else (cpr, case_id, CASE_RESOLVED, None)
+                for cpr, case_id in legacy_rows["resolved_cases"]
+            ])
+
+            imported_counts["resolved_cases"] = len(legacy_rows["resolved_cases"])
+
+        if legacy_rows["uploaded_docs"] and not self.count_by_status("uploaded_docs"):
+            case_ids = self.get_resolved_cases()
+
+            upload_rows = []
+
+            for cpr, doc_id in legacy_rows["uploaded_docs"]:
+                if doc_id == LEGACY_NOT_HANDLED:
+                    upload_rows.append((cpr, case_ids.get(cpr), None, DOC_SKIPPED, None))
+
+                elif doc_id == LEGACY_UPLOAD_FAILED:
+                    upload_rows.append((cpr, case_ids.get(cpr), None, DOC_FAILED, doc_id))
+
+                else:
+                    upload_rows.append((cpr, case_ids.get(cpr), doc_id, DOC_UPLOADED, None))
+
+            self.record_uploaded_docs(upload_rows)
+
+            imported_counts["uploaded_docs"] = len(upload_rows)
+
+        return imported_counts
+
+    def count_by_status(self, table: str) -> dict:
+        """Returns the number of rows per status in the resolved_cases or uploaded_docs table."""
+
+        if table not in ("resolved_cases", "uploaded_docs"):
+            raise ValueError(f"Unknown table '{table}'")
+
+        return dict(self._read(f"SELECT status, COUNT(*) FROM {table} GROUP BY status"))
+
+    def export_csv(self, table: str, file_path: str) -> str:
+        """
+        Exports a table to a CSV file, with a header row, overwriting the file if it exists.
+
+        Parameters:
+        - table (str): One of 'employees', 'resolved_cases' or 'uploaded_docs'.
+        - file_path (str): The path of the CSV file to write.
+
+        Returns:
+        - str: The path of the written CSV file.
+        """
+
+        if table not in ("employees", "resolved_cases", "uploaded_docs"):
+            raise ValueError(f"Unknown table '{table}'")
+
+        with self._lock:
+            cursor = self._connection.execute(f"SELECT * FROM {table} ORDER BY cpr")
+
+            header = [column[0] for column in cursor.description]
+
+            rows = cursor.fetchall()
+
+        with open(file_path, mode="w", newline="", encoding="utf-8") as csv_file:
+            writer = csv.writer(csv_file)
+
+            writer.writerow(header)
+            writer.writerows(rows)
+
+        return file_path
+
+
+def _read_legacy_csv(file_path: str) -> list[tuple]:
+    """Returns the (cpr, value) rows of a CSV checkpoint file written by an earlier version, or an empty list if the file is missing or not one."""
+
+    if not os.path.exists(file_path):
+        return []
+
+    with open(file_path, mode="r", newline="", encoding="utf-8") as csv_file:
+        reader = csv.reader(csv_file)
+
+        if next(reader, None) not in LEGACY_CSV_HEADERS:
+            return []
+
+        # The last row with a CPR number wins, as the earlier versions appended a row per attempt
+        rows = {row[0].strip(): row[1].strip() for row in reader if len(row) >= 2 and row[0].strip()}
+
+    return list(rows.items())
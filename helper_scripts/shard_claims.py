@@ -0,0 +1,355 @@
+"""
+This module splits a mailing into shards, so several robots can work on the same employee list at once, and merges their results again.
+
+The planner splits the CPR numbers of the employee list into a fixed number of shards - by a hash of the CPR number, or by ranges of the sorted
+CPR numbers - and the split only depends on the employee list and the number of shards, so every robot computes the same plan.
+The robots share a claim table, a JSON file next to the employee list guarded by a portalocker lock file. A robot claims a shard by taking a lease
+on it, and renews the lease while it works. If a robot dies, its lease runs out and the shard is claimed by another robot, which resumes from
+the run state the first robot left behind in the shard's folder.
+"""
+import csv
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+import portalocker
+
+logger = logging.getLogger(__name__)
+
+# The strategies the CPR numbers can be split by
+SHARD_BY_HASH = "hash"
+SHARD_BY_RANGE = "range"
+
+# The statuses of a shard in the claim table
+SHARD_OPEN = "open"
+SHARD_CLAIMED = "claimed"
+SHARD_DONE = "done"
+
+CLAIMS_FILENAME = "shard_claims.json"
+
+
+def shard_of_cpr(cpr: str, shard_count: int) -> int:
+    """Returns the shard of a CPR number when split by hash - a stable hash, so it is the same in every process and on every machine."""
+
+    return int(hashlib.sha256(cpr.encode("utf-8")).hexdigest(), 16) % shard_count
+
+
+def plan_shards(cprs: list[str], shard_count: int, strategy: str = SHARD_BY_HASH) -> list[list[str]]:
+    """
+    Splits the CPR numbers into shards.
+
+    Parameters:
+    - cprs (list[str]): The CPR numbers of the employee list.
+    - shard_count (int): The number of shards.
+    - strategy (str): SHARD_BY_HASH spreads the CPR numbers evenly, whatever their order. SHARD_BY_RANGE gives each shard a contiguous
+      range of the sorted CPR numbers, so the shards can be told apart by their first and last CPR number.
+
+    Returns:
+    - list[list[str]]: The sorted CPR numbers of each shard.
+    """
+
+    if shard_count < 1:
+        raise ValueError(f"The number of shards must be at least 1, not {shard_count}")
+
+    sorted_cprs = sorted(cprs)
+
+    if strategy == SHARD_BY_HASH:
+        shards = [[] for _ in range(shard_count)]
+
+        for cpr in sorted_cprs:
+            shards[shard_of_cpr(cpr, shard_count)].append(cpr)
+
+        return shards
+
+    if strategy == SHARD_BY_RANGE:
+        return [sorted_cprs[len(sorted_cprs) * shard // shard_count:len(sorted_cprs) * (shard + 1) // shard_count] for shard in range(shard_count)]
+
+    raise ValueError(f"Unknown shard strategy '{strategy}'")
+
+
+def write_shard_employee_lists(cpr_dicts: dict, shard_folders: list[str], shards: list[list[str]], filename: str, sheet_name: str) -> None:
+    """
+    Writes the employee list of every shard into its folder, with the columns of the original list, so each shard runs as a mailing of its own.
+
+    Parameters:
+    - cpr_dicts (dict): The CPR mapping from FileHandler.build_cpr_mapping.
+    - shard_folders (list[str]): The folder of each shard - created if missing.
+    - shards (list[list[str]]): The CPR numbers of each shard, from plan_shards.
+    - filename (str): The filename of the employee list.
+    - sheet_name (str): The name of the sheet.
+    """
+
+    for shard_folder, shard_cprs in zip(shard_folders, shards):
+        os.makedirs(shard_folder, exist_ok=True)
+
+        pd.DataFrame({
+            "Tjenestenummer": [cpr_dicts[cpr]["tjenestenummer"] for cpr in shard_cprs],
+            "CPR": shard_cprs,
+            "Navn": [cpr_dicts[cpr]["navn"] for cpr in shard_cprs],
+            "Stilling": [cpr_dicts[cpr]["stilling"] for cpr in shard_cprs],
+        }).to_excel(os.path.join(shard_folder, filename), sheet_name=sheet_name, index=False)
+
+
+def fingerprint_file(file_path: str) -> str:
+    """Returns a SHA-256 hash of the content of a file, telling whether the employee list changed since the shards were planned."""
+
+    file_hash = hashlib.sha256()
+
+    with open(file_path, mode="rb") as plan_file:
+        for block in iter(lambda: plan_file.read(1024 * 1024), b""):
+            file_hash.update(block)
+
+    return file_hash.hexdigest()
+
+
+class ShardClaimTable:
+    """
+    The claim table shared by the robots working on one sharded mailing.
+
+    Every read and write of the table holds an exclusive portalocker lock on the lock file next to it, and the table is written to a temporary
+    file first and then moved into place, so a robot never reads a half-written table, even on a network share.
+
+    Attributes:
+    - folder_path (str): The folder holding the claim table and the lock file.
+    - lease_seconds (float): How long a claim lasts without being renewed.
+    - lock_timeout (float): How long to wait for the lock before giving up.
+    """
+    def __init__(self, folder_path: str, lease_seconds: float = 15 * 60, lock_timeout: float = 60):
+        self.folder_path = folder_path
+        self.lease_seconds = lease_seconds
+        self.lock_timeout = lock_timeout
+        self._table_path = os.path.join(folder_path, CLAIMS_FILENAME)
+
+    @contextmanager
+    def locked(self):
+        """Holds the lock of the claim table, e.g. while the shards are merged."""
+
+        with portalocker.Lock(f"{self._table_path}.lock", mode="a", timeout=self.lock_timeout):
+            yield
+
+    def _read(self) -> dict | None:
+        if not os.path.exists(self._table_path):
+            return None
+
+        with open(self._table_path, mode="r", encoding="utf-8") as table_file:
+            return json.load(table_file)
+
+    def _write(self, table: dict) -> None:
+        temporary_path = f"{self._table_path}.tmp"
+
+        with open(temporary_path, mode="w", encoding="utf-8") as table_file:
+            json.dump(table, table_file, indent=2)
+
+        os.replace(temporary_path, self._table_path)
+
+    def ensure_plan(self, shard_count: int, strategy: str, fingerprint: str, write_shards) -> None:
+        """
+        Creates the claim table, if no robot has created it yet.
+
+        Parameters:
+        - shard_count (int): The number of shards.
+        - strategy (str): The strategy the CPR numbers are split by.
+        - fingerprint (str): The fingerprint of the employee list the shards are planned from.
+        - write_shards (callable): Called, while the lock is held, to write the employee list of every shard, before the table is created.
+
+        Raises:
+        - ValueError: If the table was created for another employee list, number of shards or strategy - the shards of a mailing can not change
+          once robots have started on them, as the CPR numbers already handled would be handled again.
+        """
+
+        with self.locked():
+            table = self._read()
+
+            if table is None:
+                write_shards()
+
+                self._write({
+                    "shard_count": shard_count,
+                    "strategy": strategy,
+                    "fingerprint": fingerprint,
+                    "shards": [{"status": SHARD_OPEN, "owner": None, "lease_expires": 0, "claims": 0, "error": None} for _ in range(shard_count)],
+                })
+
+                logger.info("Planned %d shard(s) by %s", shard_count, strategy)
+
+                return
+
+            if (table["shard_count"], table["strategy"], table["fingerprint"]) != (shard_count, strategy, fingerprint):
+                raise ValueError(
+                    f"The shards in {self._table_path} were planned with {table['shard_count']} shard(s) by {table['strategy']} from another employee list - "
+                    "finish that mailing, or remove the shard folder to start over"
+                )
+
+    def claim(self, owner: str) -> int | None:
+        """Claims the first shard that is open, or whose lease has run out, and returns it - or None if every shard is done or claimed."""
+
+        with self.locked():
+            table = self._read()
+
+            now = time.time()
+
+            for shard, claim in enumerate(table["shards"]):
+                if claim["status"] == SHARD_DONE or (claim["status"] == SHARD_CLAIMED and claim["lease_expires"] > now):
+                    continue
+
+                if claim["status"] == SHARD_CLAIMED:
+                    logger.warning("The lease of %s on shard %d ran out - the shard is claimed again", claim["owner"], shard)
+
+                claim.update(status=SHARD_CLAIMED, owner=owner, lease_expires=now + self.lease_seconds, claims=claim["claims"] + 1)
+
+                self._write(table)
+
+                return shard
+
+        return None
+
+    def renew(self, shard: int, owner: str) -> bool:
+        """Renews the lease on a shard, and returns False if the lease was lost to another robot in the meantime."""
+
+        with self.locked():
+            table = self._read()
+
+            claim = table["shards"][shard]
+
+            if claim["status"] != SHARD_CLAIMED or claim["owner"] != owner:
+                return False
+
+            claim["lease_expires"] = time.time() + self.lease_seconds
+
+            self._write(table)
+
+        return True
+
+    def complete(self, shard: int, owner: str) -> None:
+        """Marks a shard as done."""
+
+        self._finish(shard, owner, SHARD_DONE, error=None)
+
+    def release(self, shard: int, owner: str, error: str) -> None:
+        """Gives a shard back after a failure, so another robot - or this one, on its next run - can claim it straight away."""
+
+        self._finish(shard, owner, SHARD_OPEN, error=error)
+
+    def _finish(self, shard: int, owner: str, status: str, error: str | None) -> None:
+        with self.locked():
+            table = self._read()
+
+            claim = table["shards"][shard]
+
+            if claim["owner"] != owner:
+                logger.warning("Shard %d was claimed by %s while %s worked on it", shard, claim["owner"], owner)
+
+            claim.update(status=status, owner=None, lease_expires=0, error=error, finished_at=datetime.now().isoformat(timespec="seconds"))
+
+            self._write(table)
+
+    def all_done(self) -> bool:
+        """Returns True if every shard is done."""
+
+        with self.locked():
+            table = self._read()
+
+        return all(claim["status"] == SHARD_DONE for claim in table["shards"])
+
+
+class LeaseRenewer:
+    """
+    Renews the lease on a shard in a background thread, for as long as the robot works on it.
+
+    Used as a context manager around the work on the shard. The lease is renewed three times per lease period, so a single slow renewal
+    does not lose it.
+
+    Attributes:
+    - lost (bool): True if the lease was lost to another robot - the work on the shard should then stop.
+    """
+    def __init__(self, claim_table: ShardClaimTable, shard: int, owner: str):
+        self.lost = False
+        self._renew = lambda: claim_table.renew(shard, owner)
+        self._interval = claim_table.lease_seconds / 3
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"shard_{shard}_lease", daemon=True)
+
+    def _run(self) -> None:
+        while not self._stopped.wait(self._interval):
+            try:
+                if not self._renew():
+                    self.lost = True
+
+                    logger.error("The lease on the shard was lost to another robot")
+
+                    return
+
+            except (OSError, portalocker.LockException):
+                # The next renewal is tried before the lease runs out
+                logger.warning("The lease on the shard could not be renewed", exc_info=True)
+
+    def __enter__(self):
+        self._thread.start()
+
+        return self
+
+    def __exit__(self, *_exc_info):
+        self._stopped.set()
+
+        self._thread.join()
+
+
+def merge_shard_results(shard_folders: list[str], result_folder: str, filenames: list[str]) -> list[str]:
+    """
+    Combines the result files of the shards into one file each, ordered by CPR number, as a single robot would have written them.
+
+    Parameters:
+    - shard_folders (list[str]): The folder of each shard.
+    - result_folder (str): The folder to write the combined files to.
+    - filenames (list[str]): The CSV files to combine, e.g. employee_case_ids.csv and journalized_docs.csv - a shard without the file is skipped.
+
+    Returns:
+    - list[str]: The paths of the combined files.
+    """
+
+    merged_paths = []
+
+    for filename in filenames:
+        header, rows = None, []
+
+        for shard_folder in shard_folders:
+            shard_path = os.path.join(shard_folder, filename)
+
+            if not os.path.exists(shard_path):
+                logger.warning("%s has no %s - it is left out of the merge", shard_folder, filename)
+
+                continue
+
+            with open(shard_path, mode="r", newline="", encoding="utf-8") as shard_file:
+                reader = csv.reader(shard_file)
+
+                header = next(reader, header)
+
+                rows.extend(reader)
+
+        if header is None:
+            continue
+
+        # Every result file of the run state is keyed by CPR number, in its first column
+        rows.sort(key=lambda row: row[0])
+
+        merged_path = os.path.join(result_folder, filename)
+
+        with open(merged_path, mode="w", newline="", encoding="utf-8") as merged_file:
+            writer = csv.writer(merged_file)
+
+            writer.writerow(header)
+            writer.writerows(rows)
+
+        logger.info("Merged %d row(s) from %d shard(s) into %s", len(rows), len(shard_folders), merged_path)
+
+        merged_paths.append(merged_path)
+
+    return merged_paths
@@ -0,0 +1,162 @@
+"""
+This module reads selected columns of an Excel sheet with a streaming reader, and caches the result as a snapshot next to the workbook.
+
+pd.read_excel loads every cell of the workbook into memory before the columns are picked. Here the rows are streamed with openpyxl in read-only
+mode, and only the cells of the requested columns are kept, as strings, the same way pd.read_excel with a str converter reads them.
+The columns read are stored in a JSON snapshot, keyed on the size, modification time and SHA-256 hash of the workbook, so a re-run after a crash
+loads the sheet from the snapshot instead of parsing the workbook again - and a changed workbook is always parsed again. The snapshot only holds
+strings, so loading it runs no code, whoever wrote the file.
+"""
+import hashlib
+import json
+import logging
+import os
+
+import openpyxl
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the way the columns are read changes, so snapshots made by an earlier version are not used
+SNAPSHOT_VERSION = 2
+
+
+def _cell_to_str(value) -> str | None:
+    """Converts a cell value to a string, as pd.read_excel with a str converter does - an integral number is read without its '.0'."""
+
+    if value is None:
+        return None
+
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+def read_sheet_columns(file_path: str, sheet_name: str, columns: list[str]) -> pd.DataFrame:
+    """
+    Reads the given columns of a sheet with openpyxl's streaming reader, with the first row as the header.
+
+    The rows are numbered from 0, as by pd.read_excel - empty rows within the sheet are kept, and empty rows at the end of the sheet are dropped.
+
+    Raises:
+        ValueError: If the sheet does not exist, or one of the columns is missing from its header.
+    """
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+
+    try:
+        if sheet_name not in workbook.sheetnames:
+            raise ValueError(f"Worksheet named '{sheet_name}' not found")
+
+        rows = workbook[sheet_name].iter_rows(values_only=True)
+
+        header = [None if cell is None else str(cell) for cell in next(rows, ())]
+
+        for column in columns:
+            if column not in header:
+                raise ValueError(f"Missing required column '{column}' in the sheet.")
+
+        column_positions = [header.index(column) for column in columns]
+
+        values = {column: [] for column in columns}
+
+        row_count = last_filled_row_count = 0
+
+        for row in rows:
+            row_values = [_cell_to_str(row[position]) if position < len(row) else None for position in column_positions]
+
+            for column, value in zip(columns, row_values):
+                values[column].append(value)
+
+            row_count += 1
+
+            # A row with any cell filled, in any column, counts - pd.read_excel only drops the rows at the end that are empty in every column
+            if any(cell is not None for cell in row):
+                last_filled_row_count = row_count
+
+    finally:
+        workbook.close()
+
+    return pd.DataFrame({column: column_values[:last_filled_row_count] for column, column_values in values.items()}, dtype=object)
+
+
+def _workbook_key(file_path: str) -> dict:
+    """Returns the key a snapshot of the workbook is valid for."""
+
+    file_hash = hashlib.sha256()
+
+    with open(file_path, mode="rb") as workbook_file:
+        for block in iter(lambda: workbook_file.read(1024 * 1024), b""):
+            file_hash.update(block)
+
+    file_stat = os.stat(file_path)
+
+    return {"version": SNAPSHOT_VERSION, "size": file_stat.st_size, "mtime_ns": file_stat.st_mtime_ns, "sha256": file_hash.hexdigest()}
+
+
+def _snapshot_to_df(snapshot: dict, columns: list[str]) -> pd.DataFrame:
+    """
+    Returns the columns of a snapshot as a DataFrame, as read_sheet_columns returns them.
+
+    Raises:
+        ValueError: If the snapshot does not hold a list of strings or None for each of the columns, all of the same length.
+    """
+
+    values = snapshot["columns"]
+
+    if not isinstance(values, dict) or list(values) != list(columns):
+        raise ValueError("The snapshot does not hold the requested columns")
+
+    for column_values in values.values():
+        if not isinstance(column_values, list) or not all(value is None or isinstance(value, str) for value in column_values):
+            raise ValueError("The snapshot holds a column that is not a list of strings")
+
+    if len({len(column_values) for column_values in values.values()}) > 1:
+        raise ValueError("The columns of the snapshot differ in length")
+
+    return pd.DataFrame(values, dtype=object)
+
+
+def load_sheet_columns(file_path: str, sheet_name: str, columns: list[str], snapshot_path: str = None) -> pd.DataFrame:
+    """
+    Returns the given columns of a sheet, from the snapshot at snapshot_path if it matches the workbook, and otherwise read with read_sheet_columns.
+
+    A fresh read is written to snapshot_path, to a temporary file first and then moved into place. Without a snapshot_path, the sheet is always read.
+    """
+
+    if not snapshot_path:
+        return read_sheet_columns(file_path, sheet_name, columns)
+
+    workbook_key = {**_workbook_key(file_path), "sheet_name": sheet_name, "columns": list(columns)}
+
+    if os.path.exists(snapshot_path):
+        try:
+            with open(snapshot_path, mode="r", encoding="utf-8") as snapshot_file:
+                snapshot = json.load(snapshot_file)
+
+            if snapshot["key"] == workbook_key:
+                df = _snapshot_to_df(snapshot, columns)
+
+                logger.debug("Loaded %s from the snapshot %s", sheet_name, snapshot_path)
+
+                return df
+
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            # A broken snapshot is only a cache miss
+            logger.warning("The snapshot %s could not be read: %s - reading the workbook instead", snapshot_path, e)
+
+    df = read_sheet_columns(file_path, sheet_name, columns)
+
+    temporary_path = f"{snapshot_path}.tmp"
+
+    try:
+        with open(temporary_path, mode="w", encoding="utf-8") as snapshot_file:
+            json.dump({"key": workbook_key, "columns": {column: df[column].tolist() for column in columns}}, snapshot_file, ensure_ascii=False)
+
+        os.replace(temporary_path, snapshot_path)
+
+    except OSError as e:
+        logger.warning("The snapshot %s could not be written: %s", snapshot_path, e)
+
+    return df
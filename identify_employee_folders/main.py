@@ -2,6 +2,15 @@
 THIS IS A TEST SCRIPT
 """
 
+import logging
+import os
+
+from collections import deque
+
+from concurrent.futures import ThreadPoolExecutor
+
+from typing import Iterable, Iterator
+
 from mbu_dev_shared_components.getorganized.objects import CaseDataJson
 
 from helper_scripts.case_handler import CaseHandler
@@ -10,8 +19,16 @@ from helper_scripts.file_handler import FileHandler
 
 from helper_scripts import helper_functions
 
+from helper_scripts import run_state_store
+
+from helper_scripts.logging_setup import PeriodicSummary
+
+from helper_scripts.progress_reporter import ProgressReporter
+
+from helper_scripts.run_state_store import RunStateStore
+
 
-LINE_BREAK = "\n\n\n------------------------------------------------------------------------------------------------------------------\n\n\n"
+logger = logging.getLogger(__name__)
 
 
 class DatabaseError(Exception):
@@ -26,19 +43,87 @@ def identify_employee_folders(
     file_handler: FileHandler,
     case_handler: CaseHandler,
     case_data_handler: CaseDataJson,
+    run_state: RunStateStore,
     employee_list_filename: str,
     employee_list_sheet_name: str,
     case_type: str,
     case_title: str,
+    max_workers: int = 1,
+    write_batch_size: int = 50,
+    summary_every: int = 100,
+    progress: ProgressReporter = None,
 ):
     """
     main func
+
+    The outcome for every CPR number is stored in the resolved_cases table of the run state, and exported to employee_case_ids.csv at the end.
+    max_workers sets the number of CPR numbers resolved at once. With 1, the CPR numbers are resolved one at a time.
+    write_batch_size sets the number of outcomes written to the run state in each transaction.
+    The outcome of each CPR number is logged at DEBUG, with a summary line at INFO every summary_every CPR numbers.
+    If a progress reporter is given, it is fed the status of every CPR number, and reports the throughput and ETA of the phase.
     """
 
-    employee_case_ids_csv_file = file_handler.load_or_create_csv_with_headers(filename="employee_case_ids.csv", headers=["cpr", "case_id"])
+    cpr_dicts, cprs_to_resolve, indexed_case_ids = prepare_cprs_to_resolve(
+        file_handler=file_handler,
+        case_handler=case_handler,
+        run_state=run_state,
+        employee_list_filename=employee_list_filename,
+        employee_list_sheet_name=employee_list_sheet_name,
+        max_workers=max_workers,
+        case_title=case_title,
+    )
+
+    if progress:
+        progress.start(total=len(cprs_to_resolve), already_done=len(cpr_dicts) - len(cprs_to_resolve))
+
+    outcomes = resolve_cases(
+        case_handler=case_handler,
+        case_data_handler=case_data_handler,
+        cprs_to_resolve=cprs_to_resolve,
+        case_type=case_type,
+        case_title=case_title,
+        max_workers=max_workers,
+        indexed_case_ids=indexed_case_ids,
+    )
+
+    # Every outcome is written to the run state as it arrives - there is nothing more to do with it here
+    for _ in record_outcomes(outcomes, run_state, total=len(cprs_to_resolve), write_batch_size=write_batch_size, summary_every=summary_every, progress=progress):
+        pass
+
+    logger.info("Case resolution outcomes: %s", run_state.count_by_status("resolved_cases"))
+
+    # The run state is exported for the business users, who work with the CSV file
+    employee_case_ids_csv_file = run_state.export_csv("resolved_cases", os.path.join(file_handler.directory, "employee_case_ids.csv"))
+
+    return employee_case_ids_csv_file
+
+
+def prepare_cprs_to_resolve(
+    file_handler: FileHandler,
+    case_handler: CaseHandler,
+    run_state: RunStateStore,
+    employee_list_filename: str,
+    employee_list_sheet_name: str,
+    max_workers: int = 1,
+    case_title: str = "",
+) -> tuple[dict, list[tuple], dict]:
+    """
+    Reads the employee list into the run state, and prefetches the contacts of the CPR numbers that are not resolved yet.
+    If the case handler has a case index, the CPR numbers found in it for case_title need no contact, and are not prefetched.
+
+    Returns:
+        A tuple of the CPR mapping of the whole list, a list of (index, cpr, data) for each CPR number still to be resolved, in list order,
+        and the salary case IDs found in the case index, keyed by CPR number - to be passed on to resolve_cases.
+    """
 
     # Build a mapping of CPR numbers to employee data from the Excel file
-    cpr_dicts = file_handler.build_cpr_mapping(filename=employee_list_filename, sheet_name=employee_list_sheet_name)
+    cpr_dicts, rejected_rows = file_handler.build_cpr_mapping(filename=employee_list_filename, sheet_name=employee_list_sheet_name)
+
+    # Rows with a missing or malformed CPR number are left out of the run, and listed here so they can be corrected in the sheet
+    for rejected_row in rejected_rows:
+        logger.warning("Skipping row %s in the employee list, with CPR '%s': %s", rejected_row["row"], rejected_row["cpr"], rejected_row["reason"])
+
+    run_state.upsert_employees(cpr_dicts)
 
     # The cpr dictionary should look like this:
     """
@@ -59,123 +144,286 @@ def identify_employee_folders(
     If the intended use is not to upload an Excel file, but instead to run it on a 1-by-1/case-by-case basis, you can just manually create the dictionary as above, and pass it to the cpr_dicts variable
     """
 
-    print(f"Total CPR count:{len(cpr_dicts)}\n")
+    logger.info("Total CPR count: %d", len(cpr_dicts))
+
+    # CPR numbers already resolved in the run state are skipped up front, so only the remaining CPRs are handed to the workers
+    cprs_to_resolve = []
 
-    # Iterate through each CPR number and its associated data in the dictionary
     for i, (cpr, data) in enumerate(cpr_dicts.items()):
-        # Initialize the salary_case_id variable to None for each iteration, so we can freely manipulate it later
-        salary_case_id = None
+        if run_state.is_case_resolved(cpr):
+            logger.debug("CPR %s already exists. Skipping...", cpr)
+
+            continue
 
-        employment_code = data.get("tjenestenummer")
+        cprs_to_resolve.append((i, cpr, data))
 
-        if file_handler.cpr_exists_in_csv(output_filename="employee_case_ids.csv", cpr=cpr):
-            print(f"CPR {cpr} already exists. Skipping...\n")
+    indexed_case_ids = find_indexed_cases(case_handler, cprs_to_resolve, case_title)
 
-            print(LINE_BREAK)
+    ssns_to_prefetch = [cpr for _, cpr, _ in cprs_to_resolve if cpr not in indexed_case_ids]
 
-            continue
+    # The contacts are looked up all at once, before the case resolution starts - this does nothing if the case handler has no contact cache
+    contact_counts = helper_functions.prefetch_contacts(case_handler=case_handler, ssns=ssns_to_prefetch, max_workers=max_workers)
+
+    logger.info(
+        "Skipping %d already resolved CPR(s), %d found in the case index. Contact prefetch: %s",
+        len(cpr_dicts) - len(cprs_to_resolve), len(indexed_case_ids), dict(contact_counts),
+    )
+
+    return cpr_dicts, cprs_to_resolve, indexed_case_ids
+
+
+def find_indexed_cases(case_handler: CaseHandler, cprs_to_resolve: list[tuple], case_title: str) -> dict:
+    """
+    Looks the CPR numbers to resolve up in the case index of the case handler, once each.
+
+    Returns:
+        The salary case IDs found, keyed by CPR number - empty if the case handler has no case index.
+    """
+
+    if not case_handler.case_index:
+        return {}
+
+    indexed_case_ids = {}
+
+    for _, cpr, data in cprs_to_resolve:
+        salary_case_id = case_handler.case_index.lookup(cpr, data.get("tjenestenummer"), case_title)
+
+        if salary_case_id:
+            indexed_case_ids[cpr] = salary_case_id
+
+    return indexed_case_ids
+
+
+def resolve_cases(
+    case_handler: CaseHandler,
+    case_data_handler: CaseDataJson,
+    cprs_to_resolve: list[tuple],
+    case_type: str,
+    case_title: str,
+    max_workers: int = 1,
+    indexed_case_ids: dict = None,
+) -> Iterator[tuple]:
+    """
+    Resolves the salary case of each CPR number, and yields the outcome rows for the resolved_cases table - (cpr, case_id, status, error) -
+    in the order of cprs_to_resolve, as soon as each one is known.
+
+    max_workers sets the number of CPR numbers resolved at once. With 1, the CPR numbers are resolved one at a time.
+    In both paths, a CPR number whose resolution raises does not stop the run - it is yielded in its place as a CASE_FAILED row, with the error text.
+    indexed_case_ids holds the salary case IDs already found in the case index, from find_indexed_cases - those CPR numbers need no search.
+    """
+
+    indexed_case_ids = indexed_case_ids or {}
+
+    def resolve_cpr(i: int, cpr: str, data: dict) -> tuple:
+        if cpr in indexed_case_ids:
+            logger.debug("iterative_number: %s, CPR %s found in the case index: %s", i + 1, cpr, indexed_case_ids[cpr])
+
+            return cpr, indexed_case_ids[cpr], run_state_store.CASE_RESOLVED, None
+
+        # A failing CPR is stored with its error text, and retried on the next run, instead of stopping the whole run
+        try:
+            salary_case_id = resolve_salary_case_id(
+                case_handler=case_handler,
+                case_data_handler=case_data_handler,
+                iterative_number=i + 1,
+                cpr=cpr,
+                employment_code=data.get("tjenestenummer"),
+                case_type=case_type,
+                case_title=case_title,
+            )
+
+        except Exception as e:
+            logger.warning("Case resolution failed for CPR %s: %s", cpr, e)
 
-        # Retrieve the employee's name and ID from the case handler using the CPR number
-        person_full_name, person_go_id = helper_functions.contact_lookup(case_handler=case_handler, ssn=cpr)
-        print(f"iterative_number: {i + 1}\nname: {person_full_name}\nperson_go_id: {person_go_id}\ncpr: {cpr}\nemployment code: {data.get('tjenestenummer')}\n")
+            return cpr, None, run_state_store.CASE_FAILED, str(e)
 
-        # This dictionary contains the properties we want to use, when searching for the case folder
-        properties_for_case_search = {
-            "ows_Title": case_title
-        }
+        if salary_case_id:
+            return cpr, salary_case_id, run_state_store.CASE_RESOLVED, None
+
+        return cpr, None, run_state_store.CASE_NOT_FOUND, "CPR NOT PROPERLY HANDLED - Please investigate this SSN"
+
+    if max_workers <= 1:
+        # The serial path - each CPR is resolved and yielded before the next one is started
+        for i, cpr, data in cprs_to_resolve:
+            yield resolve_cpr(i, cpr, data)
+
+        return
+
+    # The concurrent path - the CPRs are resolved by a pool of workers, but the results are yielded in the same order as the serial path.
+    # We only ever yield the oldest submitted CPR, once it is finished, so the run state always holds an unbroken prefix of the CPR list.
+    in_flight = deque()
+
+    executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="case_resolution")
+
+    try:
+        for i, cpr, data in cprs_to_resolve:
+            in_flight.append(executor.submit(resolve_cpr, i, cpr, data))
+
+            # Bound the number of submitted CPRs, so a large sheet is not queued all at once
+            if len(in_flight) >= max_workers * 2:
+                yield in_flight.popleft().result()
+
+        while in_flight:
+            yield in_flight.popleft().result()
+
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
+
+
+def record_outcomes(
+    outcomes: Iterable[tuple],
+    run_state: RunStateStore,
+    total: int,
+    write_batch_size: int = 50,
+    summary_every: int = 100,
+    progress: ProgressReporter = None,
+) -> Iterator[tuple]:
+    """
+    Writes the outcome rows from resolve_cases to the run state, write_batch_size rows per transaction, and yields each row on, once it is counted.
+    The rows written so far are flushed when the outcomes end, or when the run is interrupted.
+    """
+
+    summary = PeriodicSummary(logger, "Case resolution", every=summary_every, total=total)
 
-        # Attempt 1: Check case folder with initial parameters
-        # In the 1st attempt, we include the name in the search, as we want to find the case folder for this specific person, and we also include the case_title as a field property to narrow down the search
-        print("Attempt 1")
-        salary_case_info = helper_functions.check_case_folder(
+    pending_rows = []
+
+    try:
+        for row in outcomes:
+            pending_rows.append(row)
+
+            if len(pending_rows) >= write_batch_size:
+                run_state.record_resolved_cases(pending_rows)
+
+                pending_rows.clear()
+
+            logger.debug("Final Salary CPR to Case ID outcome: %s", row)
+
+            summary.add(row[2])
+
+            if progress:
+                progress.add(row[2])
+
+            yield row
+
+    finally:
+        # Whatever is resolved so far is written, even if the run is interrupted
+        run_state.record_resolved_cases(pending_rows)
+
+        summary.log_final()
+
+        if progress:
+            progress.finish()
+
+
+def resolve_salary_case_id(
+    case_handler: CaseHandler,
+    case_data_handler: CaseDataJson,
+    iterative_number: int,
+    cpr: str,
+    employment_code: str,
+    case_type: str,
+    case_title: str,
+) -> str | None:
+    """
+    Resolves the salary case ID for a single CPR number, and returns it - or None if no salary case could be found.
+    The function only reads from GetOrganized, so it is safe to run for several CPR numbers at once.
+    """
+
+    # Initialize the salary_case_id variable to None, so we can freely manipulate it later
+    salary_case_id = None
+
+    # Retrieve the employee's name and ID from the case handler using the CPR number
+    person_full_name, person_go_id = helper_functions.contact_lookup(case_handler=case_handler, ssn=cpr)
+    logger.debug("iterative_number: %s, person_go_id: %s, cpr: %s, employment code: %s", iterative_number, person_go_id, cpr, employment_code)
+
+    # This dictionary contains the properties we want to use, when searching for the case folder
+    properties_for_case_search = {
+        "ows_Title": case_title
+    }
+
+    # Attempt 1: Check case folder with initial parameters
+    # In the 1st attempt, we include the name in the search, as we want to find the case folder for this specific person, and we also include the case_title as a field property to narrow down the search
+    logger.debug("Attempt 1 for CPR %s", cpr)
+    salary_case_info = helper_functions.check_case_folder(
+        case_data_handler=case_data_handler,
+        case_handler=case_handler,
+        case_type=case_type,
+        person_full_name=person_full_name,
+        person_go_id=person_go_id,
+        ssn=cpr,
+        include_name=True,
+        returned_cases_number="25",
+        field_properties=properties_for_case_search
+    )
+
+    logger.debug("Attempt 1 found %d case(s)", len(salary_case_info or []))
+
+    if salary_case_info:
+        salary_case_id = get_correct_case_id(
+            case_handler=case_handler,
+            salary_case_info=salary_case_info,
+            employment_code=employment_code
+        )
+
+    if not salary_case_id:
+        # In some cases, the search might return no case folder at all - therefore we expand the search by removing the name from the search, whils keeping the ssn, the go_id, and with with the case_title as a field property
+        logger.debug("Attempt 2 for CPR %s", cpr)
+
+        salary_case_info_without_name = helper_functions.check_case_folder(
             case_data_handler=case_data_handler,
             case_handler=case_handler,
             case_type=case_type,
             person_full_name=person_full_name,
             person_go_id=person_go_id,
             ssn=cpr,
-            include_name=True,
+            include_name=False,
             returned_cases_number="25",
             field_properties=properties_for_case_search
         )
+        logger.debug("Attempt 2 found %d case(s)", len(salary_case_info_without_name or []))
 
-        print(f"salary_case_info:\n{salary_case_info}")
-
-        if salary_case_info:
+        if salary_case_info_without_name:
             salary_case_id = get_correct_case_id(
                 case_handler=case_handler,
-                salary_case_info=salary_case_info,
+                salary_case_info=salary_case_info_without_name,
                 employment_code=employment_code
             )
 
+        # Worst case scenario, the search returns no case folder at all - therefore we expand the search by removing the case_title from the search, and only keeping the name, go_id and ssn in the search
+        # This will now return all active employee cases for the person, regardless of the case_title
         if not salary_case_id:
-            # In some cases, the search might return no case folder at all - therefore we expand the search by removing the name from the search, whils keeping the ssn, the go_id, and with with the case_title as a field property
-            print("\nAttempt 2")
+            logger.debug("Attempt 3 for CPR %s", cpr)
 
-            salary_case_info_without_name = helper_functions.check_case_folder(
+            all_cases_info = helper_functions.check_case_folder(
                 case_data_handler=case_data_handler,
                 case_handler=case_handler,
                 case_type=case_type,
                 person_full_name=person_full_name,
                 person_go_id=person_go_id,
                 ssn=cpr,
-                include_name=False,
+                include_name=True,
                 returned_cases_number="25",
-                field_properties=properties_for_case_search
+                field_properties=None
             )
-            print(f"salary_case_info_without_name:\n{salary_case_info_without_name}")
 
-            if salary_case_info_without_name:
-                salary_case_id = get_correct_case_id(
-                    case_handler=case_handler,
-                    salary_case_info=salary_case_info_without_name,
-                    employment_code=employment_code
-                )
-
-            # Worst case scenario, the search returns no case folder at all - therefore we expand the search by removing the case_title from the search, and only keeping the name, go_id and ssn in the search
-            # This will now return all active employee cases for the person, regardless of the case_title
-            if not salary_case_id:
-                print("\nAttempt 3")
+            if all_cases_info:
+                logger.debug("Attempt 3 found %d case(s)", len(all_cases_info))
 
-                all_cases_info = helper_functions.check_case_folder(
-                    case_data_handler=case_data_handler,
+                salary_case_id = helper_functions.get_case_id_through_metadata(
                     case_handler=case_handler,
-                    case_type=case_type,
-                    person_full_name=person_full_name,
-                    person_go_id=person_go_id,
-                    ssn=cpr,
-                    include_name=True,
-                    returned_cases_number="25",
-                    field_properties=None
+                    all_cases_info=all_cases_info,
+                    case_title=case_title,
+                    employment_code=employment_code
                 )
 
-                if all_cases_info:
-                    print(f"\nall_cases_info:\n{all_cases_info}\n")
-
-                    salary_case_id = helper_functions.get_case_id_through_metadata(
-                        case_handler=case_handler,
-                        all_cases_info=all_cases_info,
-                        case_title=case_title,
-                        employment_code=employment_code
-                    )
-
-                else:
-                    salary_case_id = None
+            else:
+                salary_case_id = None
 
-        if salary_case_id:
-            mapping_entry = {cpr: salary_case_id}
-
-        else:
-            mapping_entry = {cpr: "CPR NOT PROPERLY HANDLED - Please investigate this SSN"}
+    # A salary case found through the searches is added to the case index, so the next mailing finds it locally
+    if salary_case_id and case_handler.case_index:
+        case_handler.case_index.put_many([(cpr, employment_code, case_title, salary_case_id, None)])
 
-        file_handler.append_cpr_case_mapping_csv(mapping=[mapping_entry], output_filename="employee_case_ids.csv")
-
-        print(f"\nFinal Salary CPR to Case ID mapping: {mapping_entry}\n")
-
-        print(LINE_BREAK)
-
-    # return employee_ssn_to_case_id_mapping
-    return employee_case_ids_csv_file
+    return salary_case_id
 
 
 def get_correct_case_id(case_handler: CaseHandler, salary_case_info: list, employment_code: str) -> str:
@@ -193,10 +441,8 @@ def get_correct_case_id(case_handler: CaseHandler, salary_case_info: list, emplo
         if case_id == employee_folder_id:
             continue
 
-        response = case_handler.get_case_metadata(endpoint_path=f'/_goapi/Cases/Metadata/{employee_folder_id}')
-
-        # We parse the metadata string returned from the API, using the parse_metadata function
-        formatted_case_metadata = helper_functions.parse_metadata(metadata_str=response.json().get("Metadata"))
+        # We get the parsed metadata for the employee folder - the metadata cache is used if the case handler has one
+        formatted_case_metadata = helper_functions.get_case_metadata_attributes(case_handler=case_handler, case_id=employee_folder_id)
 
         if formatted_case_metadata.get("ows_EmploymentCode") in (employment_code, employment_code_with_xa):
             salary_case_id = case_id
@@ -1,5 +1,7 @@
 """ the main function to run both the fetch and journalization processes """
+import logging
 import os
+import socket
 import sys
 import json
 
@@ -11,15 +13,49 @@ from helper_scripts import helper_functions
 
 from helper_scripts.file_handler import FileHandler
 
+from helper_scripts.call_metrics import CallMetrics
+
+from helper_scripts.call_recorder import CallRecorder
+
 from helper_scripts.case_handler import CaseHandler
 
+from helper_scripts.case_index import CaseIndexStore, build_case_index
+
+from helper_scripts.contact_cache import ContactCache
+
 from helper_scripts.document_handler import DocumentHandler
 
+from helper_scripts.go_client import create_go_session
+
+from helper_scripts.logging_setup import CprRedactingFilter, setup_logging, stop_logging
+
+from helper_scripts.metadata_cache import MetadataCache
+
+from helper_scripts import progress_reporter
+
+from helper_scripts.progress_reporter import ProgressReporter, ProgressSettings
+
+from helper_scripts.rate_limiter import AimdSettings, EndpointRateLimiter
+
+from helper_scripts.retry_policy import CircuitBreaker, RetryPolicy
+
+from helper_scripts import run_state_store
+
+from helper_scripts.run_state_store import RunStateStore
+
+from helper_scripts import shard_claims
+
+from helper_scripts.shard_claims import LeaseRenewer, ShardClaimTable
+
 from identify_employee_folders.main import identify_employee_folders
 
 from handle_journalization.main import handle_journalization
 
-LINE_BREAK = "\n\n\n------------------------------------------------------------------------------------------------------------------\n\n\n"
+from stream_mailing.main import stream_mailing
+
+from queue_mailing.main import QUEUE_REFERENCE_CREDENTIAL, enqueue_employees, work_queue
+
+logger = logging.getLogger(__name__)
 
 REQUIRED_VARIABLES = {
     "MASSEFORSENDELSE_FOLDER_PATH": "",  # This is the folder where you would have the Excel sheet of affected employees, and a subfolder with the files to be journalized
@@ -43,19 +79,144 @@ def main(
     document_category: str = "",
     case_type: str = "",
     case_title: str = "",
+    resolution_workers: int = 1,
+    go_requests_per_second: float = 0,
+    go_endpoint_class_rates: dict = None,
+    go_adaptive_rate: bool = True,
+    upload_workers: int = 1,
+    upload_max_in_flight_bytes: int = 200 * 1024 * 1024,
+    go_connection_pool_size: int = 10,
+    metadata_cache_ttl_hours: float = 24,
+    contact_cache_ttl_days: float = 30,
+    journalize_and_finalize: bool = False,
+    batch_chunk_size: int = 200,
+    go_max_attempts: int = 4,
+    go_circuit_cooldown_seconds: float = 30,
+    log_level: str = "INFO",
+    orchestrator_log_level: str = "WARNING",
+    log_filename: str = "masseforsendelse.log",
+    summary_every: int = 100,
+    progress_report_seconds: float = 60,
+    go_recording_path: str = "",
+    stream_phases: bool = False,
+    queue_name: str = "",
+    queue_batch_size: int = 50,
+    case_index_path: str = "",
+    case_index_refresh: str = "",
+    case_index_max_age_days: float = 7,
+    case_index_start_date: str = "2000-01-01",
 ):
     """
     the main function to run everything
+
+    resolution_workers sets the number of CPR numbers resolved at once, when identifying the employee folders.
+    go_requests_per_second caps the number of requests per second sent to the GetOrganized host, per class of endpoint - 0 means no cap.
+    go_endpoint_class_rates overrides the cap of single endpoint classes, e.g. {"search": 2, "metadata": 10, "upload": 4}.
+    go_adaptive_rate lowers the cap of an endpoint class when GetOrganized answers with 429/503 or slows down, and raises it again when it recovers.
+    upload_workers sets the number of documents uploaded at once, and upload_max_in_flight_bytes caps the total size of the documents waiting to be uploaded.
+    go_connection_pool_size sets the number of keep-alive connections to GetOrganized, shared by all handlers and workers.
+    metadata_cache_ttl_hours sets how long parsed case metadata is reused, both within a run and across re-runs.
+    contact_cache_ttl_days sets how long a looked up contact is reused across re-runs.
+    go_max_attempts sets the number of attempts per GetOrganized request - only requests that are safe to repeat are sent again after a timeout or 5xx error.
+    go_circuit_cooldown_seconds sets how long all workers pause when GetOrganized keeps failing with overload errors.
+    journalize_and_finalize turns on the batch phase journalizing and finalizing the uploaded documents, batch_chunk_size documents per call.
+    log_level sets the lowest level written to the console, and orchestrator_log_level the lowest level sent to the Orchestrator log.
+    log_filename is the log file written next to the employee list, with every level - an empty string turns it off.
+    CPR numbers are redacted in all logs. summary_every sets the number of CPR numbers between the progress summaries of both phases.
+    progress_report_seconds sets how often the items done, the throughput and the ETA of each phase are sent to the Orchestrator log,
+    and written to progress_<phase>.json next to the employee list.
+    go_recording_path turns on the record mode - every GetOrganized request and response is appended to this JSON lines file, with the CPR numbers
+    pseudonymized, and the employee list is written next to it with the same pseudonyms, so the run can be replayed with benchmarks/run_offline.py.
+    stream_phases fuses the two phases into one stream - each employee is uploaded as soon as their salary case is resolved, with the resolution_workers
+    and the upload_workers running at the same time. By default the phases run one after the other, as before. Both modes share the run state,
+    so a run started in one mode can be resumed in the other.
+    queue_name turns on the queue-driven mode - if employee_list_filename is given, an element is created in this OpenOrchestrator queue for every
+    employee not queued yet, and the robot then works the queue, queue_batch_size elements at a time, until no new elements are left.
+    Any number of robots can work the same queue - started with an empty employee_list_filename, a robot only works the queue. Every element carries
+    the case type, case title, final_journalized_filename and document_category of its mailing, so one queue can hold several mailings.
+    The references of the elements are derived with the password of the Orchestrator credential masseforsendelse_queue_reference, which must not change
+    while a mailing is queued.
+    case_index_path turns on the local case index - a SQLite file, which can be shared by the mailings. The salary case of a CPR number found in it
+    is used without any search, and the cases found through the searches are added to it. An entry older than case_index_max_age_days is not trusted.
+    case_index_refresh builds the index before the run - 'full' pages through every case created since case_index_start_date,
+    and 'incremental' only through the cases modified since the last build. By default the index is used as it is.
     """
 
     credentials = helper_functions.get_credentials_and_constants(orchestrator_connection)
 
+    # All output goes through a queue to a background thread, so the workers never wait on the console, the log file or Orchestrator
+    log_listener = setup_logging(
+        orchestrator_connection=orchestrator_connection,
+        console_level=log_level,
+        orchestrator_level=orchestrator_log_level,
+        log_file=os.path.join(masseforsendelse_folder_path, log_filename) if log_filename else None,
+        redaction_secret=credentials['go_api_password'],
+    )
+
     file_handler = FileHandler(directory=masseforsendelse_folder_path)
 
+    # Both handlers share one session and one rate limiter, so every worker thread draws from the same pool of keep-alive connections
+    go_session = create_go_session(
+        api_username=credentials['go_api_username'],
+        api_password=credentials['go_api_password'],
+        # When the phases are streamed, the resolution and upload workers hold a connection each at the same time
+        pool_maxsize=max(go_connection_pool_size, resolution_workers + upload_workers if stream_phases else max(resolution_workers, upload_workers)),
+    )
+
+    go_recorder = None
+
+    if go_recording_path:
+        go_recorder = CallRecorder(go_recording_path, secret=credentials['go_api_password'])
+
+        go_recorder.attach(go_session)
+
+        # A robot only working a queue has no employee list of its own to save
+        if employee_list_filename:
+            cpr_dicts, _ = file_handler.build_cpr_mapping(filename=employee_list_filename, sheet_name=employee_list_sheet_name)
+
+            go_recorder.save_employee_list(cpr_dicts, f"{os.path.splitext(go_recording_path)[0]}_employees.xlsx", sheet_name=employee_list_sheet_name)
+
+    go_rate_limiter = EndpointRateLimiter(
+        rates=go_endpoint_class_rates or {},
+        default_rate=go_requests_per_second,
+        aimd=AimdSettings() if go_adaptive_rate else None,
+    )
+
+    go_retry_policy = RetryPolicy(max_attempts=go_max_attempts)
+
+    go_circuit_breaker = CircuitBreaker(cooldown_seconds=go_circuit_cooldown_seconds)
+
+    # Every GetOrganized call is timed, and the summary per endpoint is written next to the employee list at the end of the run
+    go_call_metrics = CallMetrics()
+
+    # The case ID, title and employment code of each case read are persisted next to the employee list, so a re-run after a crash does not fetch
+    # the same folders again - the contact data of the folders, holding the CPR numbers, is left out
+    metadata_cache = MetadataCache(
+        ttl_seconds=metadata_cache_ttl_hours * 60 * 60,
+        persist_path=os.path.join(masseforsendelse_folder_path, "case_metadata_cache.json"),
+    )
+
+    # The contacts are persisted as well - keyed by a hash of the CPR number, with the API password as the secret, so the file holds no CPR numbers
+    contact_cache = ContactCache(
+        secret=credentials['go_api_password'],
+        ttl_seconds=contact_cache_ttl_days * 24 * 60 * 60,
+        persist_path=os.path.join(masseforsendelse_folder_path, "contact_cache.json"),
+    )
+
+    case_index = CaseIndexStore(case_index_path, max_age_seconds=case_index_max_age_days * 24 * 60 * 60) if case_index_path else None
+
     case_handler = CaseHandler(
         api_endpoint=credentials['go_api_endpoint'],
         api_username=credentials['go_api_username'],
         api_password=credentials['go_api_password'],
+        session=go_session,
+        rate_limiter=go_rate_limiter,
+        metadata_cache=metadata_cache,
+        contact_cache=contact_cache,
+        case_index=case_index,
+        retry_policy=go_retry_policy,
+        circuit_breaker=go_circuit_breaker,
+        metrics=go_call_metrics,
     )
 
     case_data_handler = CaseDataJson()
@@ -63,33 +224,334 @@ def main(
     document_handler = DocumentHandler(
         credentials['go_api_endpoint'],
         credentials['go_api_username'],
-        credentials['go_api_password'])
-
-    case_ids_csv_file = identify_employee_folders(
-        file_handler=file_handler,
-        case_handler=case_handler,
-        case_data_handler=case_data_handler,
-        employee_list_filename=employee_list_filename,
-        employee_list_sheet_name=employee_list_sheet_name,
-        case_type=case_type,
-        case_title=case_title,
+        credentials['go_api_password'],
+        session=go_session,
+        rate_limiter=go_rate_limiter,
+        retry_policy=go_retry_policy,
+        circuit_breaker=go_circuit_breaker,
+        metrics=go_call_metrics,
+    )
+
+    # The progress of both phases is kept in one SQLite database next to the employee list, so a re-run resumes where the last one stopped
+    run_state = RunStateStore(os.path.join(masseforsendelse_folder_path, "masseforsendelse_state.db"))
+
+    # A mailing started by an earlier version has its progress in the CSV checkpoint files - it is carried over, the first time only
+    legacy_counts = run_state.import_legacy_checkpoints(masseforsendelse_folder_path)
+
+    if any(legacy_counts.values()):
+        logger.info("Imported the CSV checkpoints of an earlier version into the run state: %s", legacy_counts)
+
+    # Both phases report their progress the same way - to the Orchestrator log, and to a JSON file a dashboard can poll
+    progress_settings = ProgressSettings(report_every_seconds=progress_report_seconds)
+
+    resolution_progress = ProgressReporter(
+        "case_resolution",
+        orchestrator_connection=orchestrator_connection,
+        progress_path=os.path.join(masseforsendelse_folder_path, "progress_case_resolution.json"),
+        settings=progress_settings,
+        status_classes={
+            run_state_store.CASE_FAILED: progress_reporter.FAILED,
+            run_state_store.CASE_NOT_FOUND: progress_reporter.FAILED,
+        },
     )
 
-    journalized_docs = handle_journalization(
+    upload_progress = ProgressReporter(
+        "journalization",
         orchestrator_connection=orchestrator_connection,
-        file_handler=file_handler,
-        document_handler=document_handler,
-        csv_file=case_ids_csv_file,
-        files_to_journalize_path=files_to_journalize_path,
-        journalized_filename=final_journalized_filename,
-        document_category=document_category,
+        progress_path=os.path.join(masseforsendelse_folder_path, "progress_journalization.json"),
+        settings=progress_settings,
+        status_classes={
+            run_state_store.DOC_FAILED: progress_reporter.FAILED,
+            run_state_store.DOC_SKIPPED: progress_reporter.SKIPPED,
+            run_state_store.DOC_ALREADY_JOURNALIZED: progress_reporter.SKIPPED,
+        },
     )
 
-    print(f"Length of journalized_docs: {len(journalized_docs)}")
+    journalized_docs_csv_file = None
+
+    try:
+        try:
+            if case_index_refresh not in ("", "full", "incremental"):
+                raise ValueError(f"case_index_refresh must be 'full', 'incremental' or empty, not '{case_index_refresh}'")
+
+            if case_index and case_index_refresh:
+                build_case_index(
+                    case_handler=case_handler,
+                    case_index=case_index,
+                    case_type=case_type,
+                    case_title=case_title,
+                    start_date=case_index_start_date,
+                    incremental=case_index_refresh == "incremental",
+                    max_workers=resolution_workers,
+                )
+
+            if queue_name:
+                cpr_redactor = CprRedactingFilter(secret=credentials['go_api_password'])
+
+                if employee_list_filename:
+                    enqueue_employees(
+                        orchestrator_connection=orchestrator_connection,
+                        file_handler=file_handler,
+                        queue_name=queue_name,
+                        employee_list_filename=employee_list_filename,
+                        employee_list_sheet_name=employee_list_sheet_name,
+                        case_type=case_type,
+                        case_title=case_title,
+                        journalized_filename=final_journalized_filename,
+                        document_category=document_category,
+                        reference_secret=orchestrator_connection.get_credential(QUEUE_REFERENCE_CREDENTIAL).password,
+                    )
+
+                journalized_docs_csv_file = work_queue(
+                    orchestrator_connection=orchestrator_connection,
+                    file_handler=file_handler,
+                    case_handler=case_handler,
+                    case_data_handler=case_data_handler,
+                    document_handler=document_handler,
+                    run_state=run_state,
+                    queue_name=queue_name,
+                    files_to_journalize_path=files_to_journalize_path,
+                    journalized_filename=final_journalized_filename,
+                    document_category=document_category,
+                    cpr_redactor=cpr_redactor,
+                    case_type=case_type,
+                    case_title=case_title,
+                    batch_size=queue_batch_size,
+                    resolution_workers=resolution_workers,
+                    upload_workers=upload_workers,
+                    max_in_flight_bytes=upload_max_in_flight_bytes,
+                    summary_every=summary_every,
+                    journalize_and_finalize=journalize_and_finalize,
+                    batch_chunk_size=batch_chunk_size,
+                )
+
+            elif stream_phases:
+                _, journalized_docs_csv_file = stream_mailing(
+                    orchestrator_connection=orchestrator_connection,
+                    file_handler=file_handler,
+                    case_handler=case_handler,
+                    case_data_handler=case_data_handler,
+                    document_handler=document_handler,
+                    run_state=run_state,
+                    employee_list_filename=employee_list_filename,
+                    employee_list_sheet_name=employee_list_sheet_name,
+                    files_to_journalize_path=files_to_journalize_path,
+                    journalized_filename=final_journalized_filename,
+                    document_category=document_category,
+                    case_type=case_type,
+                    case_title=case_title,
+                    resolution_workers=resolution_workers,
+                    upload_workers=upload_workers,
+                    max_in_flight_bytes=upload_max_in_flight_bytes,
+                    summary_every=summary_every,
+                    journalize_and_finalize=journalize_and_finalize,
+                    batch_chunk_size=batch_chunk_size,
+                    resolution_progress=resolution_progress,
+                    upload_progress=upload_progress,
+                )
+
+            else:
+                identify_employee_folders(
+                    file_handler=file_handler,
+                    case_handler=case_handler,
+                    case_data_handler=case_data_handler,
+                    run_state=run_state,
+                    employee_list_filename=employee_list_filename,
+                    employee_list_sheet_name=employee_list_sheet_name,
+                    case_type=case_type,
+                    case_title=case_title,
+                    max_workers=resolution_workers,
+                    summary_every=summary_every,
+                    progress=resolution_progress,
+                )
+
+        finally:
+            metadata_cache.save()
+
+            contact_cache.save()
+
+            logger.info("Case metadata cache: %s", metadata_cache.stats())
+
+            logger.info("Contact cache: %s", contact_cache.stats())
+
+            logger.info("Sub-case probing: %s, round-trips saved: %d", helper_functions.metadata_probe_stats, helper_functions.metadata_probe_stats.round_trips_saved)
+
+        if not stream_phases and not queue_name:
+            journalized_docs_csv_file = handle_journalization(
+                orchestrator_connection=orchestrator_connection,
+                file_handler=file_handler,
+                document_handler=document_handler,
+                run_state=run_state,
+                files_to_journalize_path=files_to_journalize_path,
+                journalized_filename=final_journalized_filename,
+                document_category=document_category,
+                case_type=case_type,
+                max_workers=upload_workers,
+                max_in_flight_bytes=upload_max_in_flight_bytes,
+                journalize_and_finalize=journalize_and_finalize,
+                batch_chunk_size=batch_chunk_size,
+                summary_every=summary_every,
+                progress=upload_progress,
+            )
+
+        logger.info("Journalized documents exported to %s", journalized_docs_csv_file)
+
+        logger.info("Upload statuses: %s", run_state.count_by_status("uploaded_docs"))
+
+        logger.info("GetOrganized circuit breaker: %s", go_circuit_breaker.counters)
+
+        logger.info("GetOrganized rate limits and throttling: %s, rate decreases: %s", go_rate_limiter.stats(), go_rate_limiter.counters)
+
+    finally:
+        run_state.close()
+
+        if case_index:
+            case_index.close()
+
+        if go_recorder:
+            go_recorder.close()
+
+            logger.info("Recorded %d GetOrganized exchange(s) to %s", go_recorder.counters["recorded"], go_recording_path)
+
+        call_summary = go_call_metrics.save(
+            json_path=os.path.join(masseforsendelse_folder_path, "go_call_metrics.json"),
+            csv_path=os.path.join(masseforsendelse_folder_path, "go_call_metrics.csv"),
+        )
+
+        for row in call_summary:
+            logger.info(
+                "%s: %d calls, %.0f%% of the time, p50 %s ms, p95 %s ms, p99 %s ms",
+                row["endpoint"], row["calls"], row["share_of_time"] * 100, row["p50_ms"], row["p95_ms"], row["p99_ms"],
+            )
+
+        # Every queued record is written before the run ends
+        stop_logging(log_listener)
 
     return "Successfully ran masseforsendelse script"
 
 
+def main_sharded(
+    orchestrator_connection: OrchestratorConnection,
+    masseforsendelse_folder_path: str = "",
+    employee_list_filename: str = "",
+    employee_list_sheet_name: str = "",
+    shard_count: int = 1,
+    shard_strategy: str = shard_claims.SHARD_BY_HASH,
+    shard_lease_seconds: float = 15 * 60,
+    log_level: str = "INFO",
+    orchestrator_log_level: str = "WARNING",
+    **main_options,
+):
+    """
+    Runs the mailing as one of several robots, each working on its own shards of the employee list.
+
+    Every robot is started with the same arguments. The first one splits the CPR numbers of the employee list into shard_count shards,
+    by shard_strategy - 'hash' or 'range' - and writes the employee list of each shard to its own folder under shards/ next to the employee list.
+    Each robot then claims a shard at a time, and runs main() on it, with the shard folder as masseforsendelse_folder_path, so the run state,
+    the caches and the result files of each shard are kept apart. The claim is a lease of shard_lease_seconds, renewed while the robot works,
+    so the shard of a robot that dies is claimed by another one when the lease runs out. When every shard is done, the result files
+    of the shards are merged into employee_case_ids.csv and journalized_docs.csv next to the employee list.
+    The other arguments are passed on to main().
+    """
+
+    credentials = helper_functions.get_credentials_and_constants(orchestrator_connection)
+
+    def start_logging():
+        return setup_logging(
+            orchestrator_connection=orchestrator_connection,
+            console_level=log_level,
+            orchestrator_level=orchestrator_log_level,
+            redaction_secret=credentials['go_api_password'],
+        )
+
+    log_listener = start_logging()
+
+    shards_folder_path = os.path.join(masseforsendelse_folder_path, "shards")
+
+    os.makedirs(shards_folder_path, exist_ok=True)
+
+    shard_folders = [os.path.join(shards_folder_path, f"shard_{shard:03d}") for shard in range(shard_count)]
+
+    claim_table = ShardClaimTable(shards_folder_path, lease_seconds=shard_lease_seconds)
+
+    def write_shards():
+        cpr_dicts, rejected_rows = FileHandler(directory=masseforsendelse_folder_path).build_cpr_mapping(
+            filename=employee_list_filename, sheet_name=employee_list_sheet_name
+        )
+
+        # The shard lists only hold the valid rows, so the rejected rows are listed here, once
+        for rejected_row in rejected_rows:
+            logger.warning("Skipping row %s in the employee list, with CPR '%s': %s", rejected_row["row"], rejected_row["cpr"], rejected_row["reason"])
+
+        shards = shard_claims.plan_shards(list(cpr_dicts), shard_count, strategy=shard_strategy)
+
+        shard_claims.write_shard_employee_lists(cpr_dicts, shard_folders, shards, employee_list_filename, employee_list_sheet_name)
+
+        logger.info("Shard sizes: %s", [len(shard_cprs) for shard_cprs in shards])
+
+    try:
+        claim_table.ensure_plan(
+            shard_count,
+            shard_strategy,
+            shard_claims.fingerprint_file(os.path.join(masseforsendelse_folder_path, employee_list_filename)),
+            write_shards,
+        )
+
+        owner = f"{socket.gethostname()}-{os.getpid()}"
+
+        while (shard := claim_table.claim(owner)) is not None:
+            logger.info("%s claimed shard %d of %d", owner, shard, shard_count)
+
+            # main() sets up the logging of the shard run itself, with the log file in the shard folder
+            stop_logging(log_listener)
+
+            try:
+                with LeaseRenewer(claim_table, shard, owner) as lease:
+                    main(
+                        orchestrator_connection=orchestrator_connection,
+                        masseforsendelse_folder_path=shard_folders[shard],
+                        employee_list_filename=employee_list_filename,
+                        employee_list_sheet_name=employee_list_sheet_name,
+                        log_level=log_level,
+                        orchestrator_log_level=orchestrator_log_level,
+                        **main_options,
+                    )
+
+            except Exception as error:
+                log_listener = start_logging()
+
+                logger.exception("Shard %d failed - it is released, so it can be claimed again", shard)
+
+                claim_table.release(shard, owner, error=str(error))
+
+                raise
+
+            log_listener = start_logging()
+
+            if lease.lost:
+                # Another robot took over the shard, and marks it done when it finishes
+                logger.warning("The lease on shard %d was lost while %s worked on it", shard, owner)
+
+                continue
+
+            claim_table.complete(shard, owner)
+
+            logger.info("Shard %d is done", shard)
+
+        if not claim_table.all_done():
+            logger.info("No shard left to claim - the shards still claimed by other robots are merged by the robot finishing last")
+
+            return "No shard left to claim"
+
+        with claim_table.locked():
+            shard_claims.merge_shard_results(shard_folders, masseforsendelse_folder_path, ["employee_case_ids.csv", "journalized_docs.csv"])
+
+    finally:
+        stop_logging(log_listener)
+
+    return "Successfully ran masseforsendelse script, all shards done and merged"
+
+
 if __name__ == "__main__":
 
     # !!! DELETE THIS !!!
@@ -118,4 +580,7 @@ if __name__ == "__main__":
         document_category="Udgående",
         case_type="PER",
         case_title="Ansættelse og lønaftaler",
+        resolution_workers=4,
+        go_requests_per_second=10,
+        upload_workers=4,
     )
@@ -0,0 +1,432 @@
+"""
+The queue-driven mode of the robot, with one OpenOrchestrator queue element per employee.
+
+The employee list is read once, and an element is created in the queue for every employee, with the employee and case data as JSON.
+Any number of robots then work the queue - each pulls a batch of elements, resolves the salary cases and uploads the documents with the same
+functions as the other modes, and marks every element Done or Failed, with the outcome as its message. A failed employee is retried on its own
+by setting its element back to New in Orchestrator, without reading the sheet again.
+
+Every element carries the case type, case title, document title and document category of its mailing, so elements from different mailings
+can share a queue - the cases are resolved and the documents uploaded per mailing, and the outcomes of every other mailing than the robot's own
+are kept in a run state of their own, so the same employee can be in several mailings.
+"""
+import hashlib
+import hmac
+import json
+import logging
+import os
+
+from OpenOrchestrator.database.queues import QueueStatus
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from mbu_dev_shared_components.getorganized.objects import CaseDataJson
+
+from handle_journalization import batch_steps
+from handle_journalization import main as journalization
+
+from helper_scripts import run_state_store
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.file_handler import FileHandler
+from helper_scripts.logging_setup import CprRedactingFilter, PeriodicSummary
+from helper_scripts.run_state_store import RunStateStore
+
+from identify_employee_folders import main as identification
+
+logger = logging.getLogger(__name__)
+
+# The queue elements are created in chunks of this size, and the existing elements are read in pages of this size
+QUEUE_PAGE_SIZE = 1000
+
+# The upload statuses that complete a queue element - a skipped document only does so for the employees in CPRS_TO_IGNORE,
+# since any other skip means the employee had no document in the files to journalize
+_DONE_UPLOAD_STATUSES = (run_state_store.DOC_UPLOADED, run_state_store.DOC_ALREADY_JOURNALIZED)
+
+# The Orchestrator credential whose password the references of the queue elements are derived with - unlike the GetOrganized password,
+# it must not be rotated while a mailing is queued, as the employees already queued would then be queued again
+QUEUE_REFERENCE_CREDENTIAL = "masseforsendelse_queue_reference"
+
+# The data of a queue element that makes up its mailing
+MAILING_KEYS = ("case_type", "case_title", "journalized_filename", "document_category")
+
+
+def queue_reference(secret: str, case_title: str, journalized_filename: str, cpr: str) -> str:
+    """
+    Returns the reference of an employee's queue element in a mailing - an HMAC of the case title, the document title and the CPR number,
+    so the reference holds no CPR number, and the same employee in another mailing gets another reference.
+    """
+
+    message = json.dumps([case_title, journalized_filename, cpr], ensure_ascii=False)
+
+    return f"employee#{hmac.new(secret.encode('utf-8'), message.encode('utf-8'), hashlib.sha256).hexdigest()}"
+
+
+def enqueue_employees(
+    orchestrator_connection: OrchestratorConnection,
+    file_handler: FileHandler,
+    queue_name: str,
+    employee_list_filename: str,
+    employee_list_sheet_name: str,
+    case_type: str,
+    case_title: str,
+    journalized_filename: str,
+    document_category: str,
+    reference_secret: str,
+) -> int:
+    """
+    Creates a queue element for every employee in the employee list that is not in the queue for the mailing yet, with the data of the mailing.
+
+    The reference of each element is the queue_reference of the mailing and the CPR number, with reference_secret, so the CPR number itself
+    is only kept in the data of the element. An employee already in the queue for the same case title and document title, with any status,
+    is not added again, so enqueuing the same list twice is harmless - while the next mailing to the same employees is queued as it should be.
+
+    Returns:
+        The number of queue elements created.
+    """
+
+    cpr_dicts, rejected_rows = file_handler.build_cpr_mapping(filename=employee_list_filename, sheet_name=employee_list_sheet_name)
+
+    for rejected_row in rejected_rows:
+        logger.warning("Skipping row %s in the employee list, with CPR '%s': %s", rejected_row["row"], rejected_row["cpr"], rejected_row["reason"])
+
+    existing_references = set()
+
+    offset = 0
+
+    while True:
+        queue_elements = orchestrator_connection.get_queue_elements(queue_name, offset=offset, limit=QUEUE_PAGE_SIZE)
+
+        existing_references.update(queue_element.reference for queue_element in queue_elements)
+
+        if len(queue_elements) < QUEUE_PAGE_SIZE:
+            break
+
+        offset += QUEUE_PAGE_SIZE
+
+    references, data = [], []
+
+    for cpr, employee_data in cpr_dicts.items():
+        reference = queue_reference(reference_secret, case_title, journalized_filename, cpr)
+
+        if reference in existing_references:
+            continue
+
+        references.append(reference)
+
+        data.append(json.dumps(
+            {
+                "cpr": cpr,
+                **employee_data,
+                "case_type": case_type,
+                "case_title": case_title,
+                "journalized_filename": journalized_filename,
+                "document_category": document_category,
+            },
+            ensure_ascii=False,
+        ))
+
+    for start in range(0, len(references), QUEUE_PAGE_SIZE):
+        orchestrator_connection.bulk_create_queue_elements(
+            queue_name,
+            references=tuple(references[start:start + QUEUE_PAGE_SIZE]),
+            data=tuple(data[start:start + QUEUE_PAGE_SIZE]),
+            created_by="Masseforsendelse",
+        )
+
+    logger.info("Created %d queue element(s) in %s, %d employee(s) were already queued", len(references), queue_name, len(cpr_dicts) - len(references))
+
+    return len(references)
+
+
+def work_queue(
+    orchestrator_connection: OrchestratorConnection,
+    file_handler: FileHandler,
+    case_handler: CaseHandler,
+    case_data_handler: CaseDataJson,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    queue_name: str,
+    files_to_journalize_path: str,
+    journalized_filename: str,
+    document_category: str,
+    cpr_redactor: CprRedactingFilter,
+    case_type: str = "",
+    case_title: str = "",
+    batch_size: int = 50,
+    resolution_workers: int = 1,
+    upload_workers: int = 1,
+    max_in_flight_bytes: int = 200 * 1024 * 1024,
+    summary_every: int = 100,
+    journalize_and_finalize: bool = False,
+    batch_chunk_size: int = 200,
+) -> str:
+    """
+    Works the queue until it has no new elements left, batch_size elements at a time.
+
+    The elements of a batch are handled per mailing. The salary cases are resolved by resolution_workers workers, and the documents uploaded
+    by upload_workers workers, and the outcome of every employee is stored in the run state of the mailing. The mailing of each element is read
+    from its data - case_type, case_title, journalized_filename and document_category are only used for the elements enqueued without them.
+    The robot's own mailing, the one of those arguments, uses run_state - every other mailing has a run state of its own next to the employee list,
+    masseforsendelse_state_<mailing>.db, so an employee in several mailings is handled in each of them. The documents already journalized are found
+    with one pre-scan per mailing, the first time the mailing is met. If journalize_and_finalize is set, the uploaded documents of a batch are
+    journalized and finalized before the elements are marked, so an element marked Done is completely handled.
+    If a batch is interrupted by an error, its unmarked elements are marked Failed before the error is raised.
+
+    Returns:
+        The path of journalized_docs.csv, exported from run_state at the end.
+    """
+
+    # Only the paths and sizes of the documents are indexed up front - each document is read right before it is uploaded
+    pdf_files = file_handler.index_files_by_cpr(folder_path=files_to_journalize_path, extension=".pdf")
+
+    mailing_defaults = {"case_type": case_type, "case_title": case_title, "journalized_filename": journalized_filename, "document_category": document_category}
+
+    own_mailing = tuple(mailing_defaults[key] for key in MAILING_KEYS)
+
+    run_states = {own_mailing: run_state}
+
+    # The pre-scan index of each mailing, keyed by case type and document title
+    journalized_documents_by_mailing = {}
+
+    element_counts = {QueueStatus.DONE: 0, QueueStatus.FAILED: 0}
+
+    try:
+        while True:
+            queue_elements = []
+
+            while len(queue_elements) < batch_size:
+                queue_element = orchestrator_connection.get_next_queue_element(queue_name)
+
+                if queue_element is None:
+                    break
+
+                queue_elements.append(queue_element)
+
+            if not queue_elements:
+                break
+
+            unmarked_elements = {queue_element.id: queue_element for queue_element in queue_elements}
+
+            try:
+                employees_by_mailing = _read_queue_elements(orchestrator_connection, unmarked_elements, mailing_defaults)
+
+                for mailing, employees in employees_by_mailing.items():
+                    if mailing not in run_states:
+                        run_states[mailing] = RunStateStore(os.path.join(file_handler.directory, f"masseforsendelse_state_{_mailing_id(mailing)}.db"))
+
+                    mailing_run_state = run_states[mailing]
+
+                    _resolve_batch(case_handler, case_data_handler, mailing_run_state, employees, mailing[0], mailing[1], resolution_workers, summary_every)
+
+                    _upload_batch(
+                        orchestrator_connection, document_handler, mailing_run_state, employees, mailing, pdf_files, journalized_documents_by_mailing,
+                        upload_workers, max_in_flight_bytes, summary_every,
+                    )
+
+                    if journalize_and_finalize:
+                        batch_steps.journalize_and_finalize_documents(document_handler=document_handler, run_state=mailing_run_state, chunk_size=batch_chunk_size)
+
+                    for cpr, (queue_element, _) in employees.items():
+                        status, message = _queue_outcome(mailing_run_state, cpr)
+
+                        orchestrator_connection.set_queue_element_status(queue_element.id, status, cpr_redactor.redact(message))
+
+                        element_counts[status] += 1
+
+                        del unmarked_elements[queue_element.id]
+
+            except Exception as error:
+                for queue_element in unmarked_elements.values():
+                    orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, cpr_redactor.redact(f"The batch failed: {error}"))
+
+                raise
+
+            logger.info("Queue %s: %d element(s) done, %d failed so far", queue_name, element_counts[QueueStatus.DONE], element_counts[QueueStatus.FAILED])
+
+        logger.info("No new elements left in %s", queue_name)
+
+        for mailing, mailing_run_state in run_states.items():
+            if mailing != own_mailing:
+                logger.info(
+                    "Journalized documents of the mailing %s exported to %s", mailing[2],
+                    mailing_run_state.export_csv("uploaded_docs", os.path.join(file_handler.directory, f"journalized_docs_{_mailing_id(mailing)}.csv")),
+                )
+
+    finally:
+        # The run state of the robot's own mailing is closed by the caller
+        for mailing, mailing_run_state in run_states.items():
+            if mailing != own_mailing:
+                mailing_run_state.close()
+
+    return run_state.export_csv("uploaded_docs", os.path.join(file_handler.directory, "journalized_docs.csv"))
+
+
+def _mailing_id(mailing: tuple) -> str:
+    """Returns a short, stable ID of a mailing, naming the files of its run state."""
+
+    return hashlib.sha256(json.dumps(mailing, ensure_ascii=False).encode("utf-8")).hexdigest()[:16]
+
+
+def _read_queue_elements(orchestrator_connection: OrchestratorConnection, unmarked_elements: dict, mailing_defaults: dict) -> dict[tuple, dict]:
+    """
+    Returns the queue element and the data of each employee in a batch, per mailing - an element with invalid data is marked Failed, and left out.
+    The mailing is the tuple of the MAILING_KEYS of the element, and the values of mailing_defaults are used for those missing from an element.
+    """
+
+    employees_by_mailing = {}
+
+    for queue_element in list(unmarked_elements.values()):
+        try:
+            employee_data = {**mailing_defaults, **json.loads(queue_element.data)}
+
+            cpr = employee_data["cpr"]
+
+        except (TypeError, ValueError, KeyError):
+            orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, "The data of the queue element is not a valid employee")
+
+            del unmarked_elements[queue_element.id]
+
+            continue
+
+        employees = employees_by_mailing.setdefault(tuple(employee_data[key] for key in MAILING_KEYS), {})
+
+        if cpr in employees:
+            orchestrator_connection.set_queue_element_status(queue_element.id, QueueStatus.FAILED, "The employee is queued twice for the mailing in the same batch")
+
+            del unmarked_elements[queue_element.id]
+
+            continue
+
+        employees[cpr] = (queue_element, employee_data)
+
+    return employees_by_mailing
+
+
+def _resolve_batch(
+    case_handler: CaseHandler,
+    case_data_handler: CaseDataJson,
+    run_state: RunStateStore,
+    employees: dict,
+    case_type: str,
+    case_title: str,
+    max_workers: int,
+    summary_every: int,
+) -> None:
+    """
+    Resolves the salary cases of a batch of employees of one mailing, and stores the outcomes in the run state of the mailing.
+
+    Only the employees with a resolved case from an earlier batch or run are left out - unlike the other modes, an employee whose case was not found
+    is searched for again, since its element was set back to New to retry it.
+    """
+
+    run_state.upsert_employees({cpr: employee_data for cpr, (_, employee_data) in employees.items()})
+
+    cprs_to_resolve = []
+
+    for index, (cpr, (_, employee_data)) in enumerate(employees.items()):
+        case_outcome = run_state.get_outcome("resolved_cases", cpr)
+
+        if case_outcome is None or case_outcome["status"] != run_state_store.CASE_RESOLVED:
+            cprs_to_resolve.append((index, cpr, employee_data))
+
+    if not cprs_to_resolve:
+        return
+
+    indexed_case_ids = identification.find_indexed_cases(case_handler, cprs_to_resolve, case_title)
+
+    outcomes = identification.resolve_cases(
+        case_handler, case_data_handler, cprs_to_resolve, case_type, case_title, max_workers=max_workers, indexed_case_ids=indexed_case_ids
+    )
+
+    for _ in identification.record_outcomes(outcomes, run_state, total=len(cprs_to_resolve), summary_every=summary_every):
+        pass
+
+
+def _upload_batch(
+    orchestrator_connection: OrchestratorConnection,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    employees: dict,
+    mailing: tuple,
+    pdf_files: dict,
+    journalized_documents_by_mailing: dict,
+    max_workers: int,
+    max_in_flight_bytes: int,
+    summary_every: int,
+) -> None:
+    """
+    Uploads the documents of the employees of one mailing in a batch that have a resolved case, and no document uploaded yet.
+    The documents already journalized are pre-scanned the first time the mailing is met, and kept in journalized_documents_by_mailing.
+    """
+
+    case_type, _, journalized_filename, document_category = mailing
+
+    resolved_employees = []
+
+    for cpr in employees:
+        case_outcome = run_state.get_outcome("resolved_cases", cpr)
+
+        if case_outcome["status"] == run_state_store.CASE_RESOLVED and not _is_upload_done(run_state, cpr):
+            resolved_employees.append((cpr, case_outcome["case_id"]))
+
+    if not resolved_employees:
+        return
+
+    if case_type and (case_type, journalized_filename) not in journalized_documents_by_mailing:
+        journalized_documents_by_mailing[(case_type, journalized_filename)] = journalization.find_journalized_documents(
+            document_handler, journalized_filename, case_type
+        )
+
+    journalization.upload_employee_documents(
+        orchestrator_connection, document_handler, run_state, resolved_employees, pdf_files, journalized_filename, document_category,
+        journalized_documents=journalized_documents_by_mailing.get((case_type, journalized_filename)),
+        max_workers=max_workers,
+        max_in_flight_bytes=max_in_flight_bytes,
+        summary=PeriodicSummary(logger, "Journalization", every=summary_every, total=len(resolved_employees)),
+    )
+
+
+def _is_upload_done(run_state: RunStateStore, cpr: str) -> bool:
+    """Returns True if the document of an employee is uploaded, already journalized, or skipped on purpose - and so must not be uploaded again."""
+
+    upload_outcome = run_state.get_outcome("uploaded_docs", cpr)
+
+    if upload_outcome is None:
+        return False
+
+    return upload_outcome["status"] in _DONE_UPLOAD_STATUSES or _is_ignored_skip(upload_outcome)
+
+
+def _is_ignored_skip(upload_outcome: dict) -> bool:
+    """Returns True if an upload outcome is the skip of an employee in CPRS_TO_IGNORE."""
+
+    return upload_outcome["status"] == run_state_store.DOC_SKIPPED and upload_outcome["case_id"] == journalization.SPECIAL_CASE_ID
+
+
+def _queue_outcome(run_state: RunStateStore, cpr: str) -> tuple[QueueStatus, str]:
+    """Returns the status and message of an employee's queue element, from the outcomes in the run state."""
+
+    case_outcome = run_state.get_outcome("resolved_cases", cpr)
+
+    if case_outcome["status"] != run_state_store.CASE_RESOLVED:
+        return QueueStatus.FAILED, f"Case {case_outcome['status']}: {case_outcome['error']}"
+
+    upload_outcome = run_state.get_outcome("uploaded_docs", cpr)
+
+    if upload_outcome is None:
+        return QueueStatus.FAILED, f"No document was uploaded to case {case_outcome['case_id']}"
+
+    if _is_ignored_skip(upload_outcome):
+        return QueueStatus.DONE, "The employee is in CPRS_TO_IGNORE - no document uploaded"
+
+    if upload_outcome["status"] == run_state_store.DOC_SKIPPED:
+        return QueueStatus.FAILED, f"No document for the employee in the files to journalize - nothing uploaded to case {case_outcome['case_id']}"
+
+    if upload_outcome["status"] not in _DONE_UPLOAD_STATUSES:
+        return QueueStatus.FAILED, f"Document {upload_outcome['status']} in case {case_outcome['case_id']}: {upload_outcome['error']}"
+
+    if upload_outcome.get("batch_error"):
+        return QueueStatus.FAILED, f"Document {upload_outcome['doc_id']} in case {case_outcome['case_id']} was not journalized: {upload_outcome['batch_error']}"
+
+    return QueueStatus.DONE, f"Document {upload_outcome['doc_id']} {upload_outcome['status']} in case {case_outcome['case_id']}"
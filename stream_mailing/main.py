@@ -0,0 +1,147 @@
+"""
+The streaming mode of the robot, fusing the two phases into a single pass over the employee list.
+
+In the two-phase mode, identify_employee_folders resolves the salary case of every employee before handle_journalization uploads the first document.
+Here each employee moves on to the upload as soon as its salary case is known - the case resolution workers and the upload workers run at the same time,
+as separate pools, so the uploads no longer wait for the last case lookup. Both stages store their outcomes in the same run state as the two-phase mode,
+so a run can be resumed in either mode.
+"""
+import logging
+import os
+
+from typing import Iterator
+
+from mbu_dev_shared_components.getorganized.objects import CaseDataJson
+
+from OpenOrchestrator.orchestrator_connection.connection import OrchestratorConnection
+
+from handle_journalization import main as journalization
+
+from helper_scripts import run_state_store
+
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.file_handler import FileHandler
+from helper_scripts.logging_setup import PeriodicSummary
+from helper_scripts.progress_reporter import ProgressReporter
+from helper_scripts.run_state_store import RunStateStore
+
+from identify_employee_folders import main as identification
+
+logger = logging.getLogger(__name__)
+
+
+def stream_mailing(
+    orchestrator_connection: OrchestratorConnection,
+    file_handler: FileHandler,
+    case_handler: CaseHandler,
+    case_data_handler: CaseDataJson,
+    document_handler: DocumentHandler,
+    run_state: RunStateStore,
+    employee_list_filename: str,
+    employee_list_sheet_name: str,
+    files_to_journalize_path: str,
+    journalized_filename: str,
+    document_category: str,
+    case_type: str,
+    case_title: str,
+    search_start_date: str = "2000-01-01",
+    search_end_date: str = "",
+    resolution_workers: int = 1,
+    upload_workers: int = 1,
+    max_in_flight_bytes: int = 200 * 1024 * 1024,
+    write_batch_size: int = 50,
+    summary_every: int = 100,
+    journalize_and_finalize: bool = False,
+    batch_chunk_size: int = 200,
+    resolution_progress: ProgressReporter = None,
+    upload_progress: ProgressReporter = None,
+) -> tuple[str, str]:
+    """
+    Resolves the salary case of every employee and uploads their document, as one stream.
+
+    The employees resolved in an earlier run, but without an uploaded document, are uploaded first, while the case resolution of the rest starts.
+    After that, every employee whose salary case is resolved is handed to the upload pipeline right away, in the order of the employee list.
+    resolution_workers and upload_workers set the size of each pool, and the other parameters are the same as in the two-phase mode.
+    The progress reporters, if given, are fed the outcome of every case resolution and every upload.
+
+    Returns:
+        A tuple of the paths of employee_case_ids.csv and journalized_docs.csv.
+    """
+
+    cpr_dicts, cprs_to_resolve, indexed_case_ids = identification.prepare_cprs_to_resolve(
+        file_handler, case_handler, run_state, employee_list_filename, employee_list_sheet_name, max_workers=resolution_workers, case_title=case_title
+    )
+
+    # Only the paths and sizes of the documents are indexed up front - each document is read right before it is uploaded, and released again afterwards
+    pdf_files = file_handler.index_files_by_cpr(folder_path=files_to_journalize_path, extension=".pdf")
+
+    # The pre-scan does not depend on the case IDs, so it is done once before the stream starts
+    journalized_documents = journalization.find_journalized_documents(
+        document_handler, journalized_filename, case_type, search_start_date=search_start_date, search_end_date=search_end_date
+    )
+
+    resumed_employees = [
+        (ssn, employees_salary_case_id)
+        for ssn, employees_salary_case_id in run_state.get_resolved_cases().items()
+        if not run_state.is_document_uploaded(ssn)
+    ]
+
+    logger.info("%d employee(s) to resolve, and %d resolved employee(s) still to upload", len(cprs_to_resolve), len(resumed_employees))
+
+    if resolution_progress:
+        resolution_progress.start(total=len(cprs_to_resolve), already_done=len(cpr_dicts) - len(cprs_to_resolve))
+
+    # At most every employee still to resolve, and every resumed employee, is uploaded - the CPRs without a salary case are never handed on
+    upload_total = len(cprs_to_resolve) + len(resumed_employees)
+
+    if upload_progress:
+        upload_progress.start(total=upload_total)
+
+    def employees_to_upload() -> Iterator[tuple]:
+        # This generator is consumed by the loader thread of the upload pipeline, so the case resolution runs alongside the uploads
+        yield from resumed_employees
+
+        outcomes = identification.resolve_cases(
+            case_handler, case_data_handler, cprs_to_resolve, case_type, case_title, max_workers=resolution_workers, indexed_case_ids=indexed_case_ids
+        )
+
+        recorded_outcomes = identification.record_outcomes(
+            outcomes,
+            run_state,
+            total=len(cprs_to_resolve),
+            write_batch_size=write_batch_size,
+            summary_every=summary_every,
+            progress=resolution_progress,
+        )
+
+        for ssn, employees_salary_case_id, status, _ in recorded_outcomes:
+            if status == run_state_store.CASE_RESOLVED:
+                yield ssn, employees_salary_case_id
+
+    journalization.upload_employee_documents(
+        orchestrator_connection=orchestrator_connection,
+        document_handler=document_handler,
+        run_state=run_state,
+        employees=employees_to_upload(),
+        pdf_files=pdf_files,
+        journalized_filename=journalized_filename,
+        document_category=document_category,
+        journalized_documents=journalized_documents,
+        max_workers=upload_workers,
+        max_in_flight_bytes=max_in_flight_bytes,
+        write_batch_size=write_batch_size,
+        summary=PeriodicSummary(logger, "Journalization", every=summary_every, total=upload_total),
+        progress=upload_progress,
+    )
+
+    logger.info("Case resolution outcomes: %s", run_state.count_by_status("resolved_cases"))
+
+    # The run state is exported for the business users, who work with the CSV files
+    employee_case_ids_csv_file = run_state.export_csv("resolved_cases", os.path.join(file_handler.directory, "employee_case_ids.csv"))
+
+    journalized_docs_csv_file = journalization.finish_journalization(
+        file_handler, document_handler, run_state, journalize_and_finalize=journalize_and_finalize, batch_chunk_size=batch_chunk_size
+    )
+
+    return employee_case_ids_csv_file, journalized_docs_csv_file
@@ -0,0 +1,100 @@
+"""
+Fixtures shared by the tests, which run the robot end-to-end against the local stub of GetOrganized, as benchmarks/run_offline.py does.
+
+Run from the repository root with:
+    python -m pytest
+"""
+import os
+
+import pandas as pd
+import pytest
+
+from benchmarks.run_offline import EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME, PDF_BYTES, OfflineOrchestratorConnection
+from benchmarks.stub_go_server import start_stub_server
+
+import main as masseforsendelse
+
+# The employment code of every employee folder of the stub server - an employee with another one has no salary case
+STUB_EMPLOYMENT_CODE = "12345"
+
+CASE_TYPE = "PER"
+
+CASE_TITLE = "Ansættelse og lønaftaler"
+
+
+@pytest.fixture
+def stub_server():
+    """Returns a function starting a stub server with the given options, and returning it and an OfflineOrchestratorConnection to it."""
+
+    servers = []
+
+    def start(**stub_options) -> tuple:
+        server, api_endpoint = start_stub_server(**stub_options)
+
+        servers.append(server)
+
+        return server, OfflineOrchestratorConnection(api_endpoint)
+
+    yield start
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def write_mailing(folder_path: str, employment_codes: dict, documents: list = None) -> str:
+    """
+    Writes the employee list of a mailing, and a PDF for each employee, into the folder.
+
+    Parameters:
+    - employment_codes (dict): The employment code of each CPR number in the employee list.
+    - documents (list): The CPR numbers to write a PDF for - by default every employee in the list.
+
+    Returns:
+    - str: The path of the files to journalize.
+    """
+
+    pd.DataFrame({
+        "Tjenestenummer": list(employment_codes.values()),
+        "CPR": list(employment_codes),
+        "Navn": [f"Testperson {cpr}" for cpr in employment_codes],
+        "Stilling": "Pædagog",
+    }).to_excel(os.path.join(folder_path, EMPLOYEE_LIST_FILENAME), sheet_name=EMPLOYEE_LIST_SHEET_NAME, index=False)
+
+    files_to_journalize_path = os.path.join(folder_path, "udsendte_dokumenter")
+
+    os.makedirs(files_to_journalize_path, exist_ok=True)
+
+    for cpr in employment_codes if documents is None else documents:
+        with open(os.path.join(files_to_journalize_path, f"{cpr}.pdf"), mode="wb") as pdf_file:
+            pdf_file.write(PDF_BYTES)
+
+    return files_to_journalize_path
+
+
+def mailing_options(folder_path: str, **options) -> dict:
+    """Returns the arguments of main.main for a mailing in the folder, written with write_mailing - the given options override the defaults."""
+
+    return {
+        "masseforsendelse_folder_path": folder_path,
+        "employee_list_filename": EMPLOYEE_LIST_FILENAME,
+        "employee_list_sheet_name": EMPLOYEE_LIST_SHEET_NAME,
+        "files_to_journalize_path": os.path.join(folder_path, "udsendte_dokumenter"),
+        "final_journalized_filename": "Offline test",
+        "document_category": "Udgående",
+        "case_type": CASE_TYPE,
+        "case_title": CASE_TITLE,
+        "resolution_workers": 2,
+        "upload_workers": 2,
+        "journalize_and_finalize": True,
+        "log_level": "WARNING",
+        "log_filename": "",
+        "progress_report_seconds": 10,
+        **options,
+    }
+
+
+def run_mailing(orchestrator_connection: OfflineOrchestratorConnection, folder_path: str, **options) -> str:
+    """Runs main.main on a mailing in the folder, written with write_mailing."""
+
+    return masseforsendelse.main(orchestrator_connection=orchestrator_connection, **mailing_options(folder_path, **options))
@@ -0,0 +1,64 @@
+"""Tests of the batched journalize and finalize steps - see handle_journalization/batch_steps.py."""
+import pytest
+
+from handle_journalization import batch_steps
+
+from helper_scripts import run_state_store
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.retry_policy import RetryPolicy
+from helper_scripts.run_state_store import RunStateStore
+
+DOCUMENT_COUNT = 16
+
+
+@pytest.fixture(name="run_state")
+def run_state_fixture(tmp_path):
+    """A run state with DOCUMENT_COUNT uploaded documents, with the document IDs 1 and up."""
+
+    store = RunStateStore(str(tmp_path / "masseforsendelse_state.db"))
+
+    store.record_uploaded_docs([
+        (f"{number:010d}", f"PER-2025-{number:06d}-001", str(number), run_state_store.DOC_UPLOADED, None) for number in range(1, DOCUMENT_COUNT + 1)
+    ])
+
+    yield store
+
+    store.close()
+
+
+def _document_handler(orchestrator_connection) -> DocumentHandler:
+    return DocumentHandler(
+        orchestrator_connection.constants["go_api_endpoint"], "offline", "offline", retry_policy=RetryPolicy(max_attempts=2, base_delay=0, max_delay=0)
+    )
+
+
+def test_rejected_document_is_isolated(run_state, stub_server):
+    """A document GetOrganized rejects is isolated by splitting its chunk, and every other document is journalized and finalized."""
+
+    _, orchestrator_connection = stub_server(rejected_document_ids={5})
+
+    all_stats = batch_steps.journalize_and_finalize_documents(_document_handler(orchestrator_connection), run_state, chunk_size=8)
+
+    # The chunk of documents 1 to 8 is split into halves of 4, 2 and 1 on the way to document 5 - the chunk of documents 9 to 16 is sent once
+    assert all_stats["journalize"] == batch_steps.BatchStepStats(documents=16, succeeded=15, failed=1, unsent=0, calls=8)
+    assert all_stats["finalize"] == batch_steps.BatchStepStats(documents=15, succeeded=15, failed=0, unsent=0, calls=2)
+
+    assert run_state.get_outcome("uploaded_docs", "0000000005")["batch_error"].startswith("400 Client Error")
+    assert run_state.get_outcome("uploaded_docs", "0000000006")["batch_error"] is None
+
+
+@pytest.mark.parametrize("fault_status", [500, 503])
+def test_outage_stops_the_step_without_splitting(run_state, stub_server, fault_status):
+    """A server error stops the step after a single call, and every document is left for the next run."""
+
+    server, orchestrator_connection = stub_server(fault_rate=1.0, fault_status=fault_status)
+
+    all_stats = batch_steps.journalize_and_finalize_documents(_document_handler(orchestrator_connection), run_state, chunk_size=8)
+
+    assert all_stats == {"journalize": batch_steps.BatchStepStats(documents=16, succeeded=0, failed=0, unsent=16, calls=1)}
+
+    # The one call is sent twice by the retry policy of the document handler, and nothing more
+    assert server.counters["requests"] == 2
+
+    assert run_state.get_documents_for_batch_step("journalize") == [(f"{number:010d}", str(number)) for number in range(1, DOCUMENT_COUNT + 1)]
+    assert all(run_state.get_outcome("uploaded_docs", cpr)["batch_error"] for cpr, _ in run_state.get_documents_for_batch_step("journalize"))
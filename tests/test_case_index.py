@@ -0,0 +1,139 @@
+"""Tests of the staleness and the refresh of the local case index - see helper_scripts/case_index.py."""
+import json
+import time
+
+from datetime import date, timedelta
+
+import pytest
+
+from conftest import CASE_TITLE, CASE_TYPE, STUB_EMPLOYMENT_CODE, run_mailing, write_mailing
+
+from helper_scripts import case_index as case_index_module
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.case_index import CaseIndexStore, build_case_index
+
+MAX_AGE_SECONDS = 7 * 24 * 60 * 60
+
+
+@pytest.fixture(name="case_index")
+def case_index_fixture(tmp_path):
+    """An empty case index, trusting its entries for a week."""
+
+    store = CaseIndexStore(str(tmp_path / "case_index.db"), max_age_seconds=MAX_AGE_SECONDS)
+
+    yield store
+
+    store.close()
+
+
+def _put_days_ago(monkeypatch, case_index: CaseIndexStore, days: float, rows: list[tuple]) -> None:
+    indexed_at = time.time() - days * 24 * 60 * 60
+
+    with monkeypatch.context() as patch:
+        patch.setattr(case_index_module.time, "time", lambda: indexed_at)
+
+        case_index.put_many(rows)
+
+
+def test_stale_entry_is_not_returned(monkeypatch, case_index):
+    """An entry older than the max age is not trusted, while a recent one is."""
+
+    _put_days_ago(monkeypatch, case_index, 10, [("0000000001", "12345", CASE_TITLE, "PER-2025-000001-001", None)])
+    _put_days_ago(monkeypatch, case_index, 1, [("0000000002", "XA12345", CASE_TITLE, "PER-2025-000002-001", None)])
+
+    assert case_index.lookup("0000000001", "12345", CASE_TITLE) is None
+    assert case_index.lookup("0000000002", "12345", CASE_TITLE) == "PER-2025-000002-001"
+    assert case_index.count() == 2
+
+
+def test_recent_build_confirms_old_entries(monkeypatch, case_index):
+    """An unchanged entry, not touched by an incremental refresh, is trusted as long as the last build of its case title is recent."""
+
+    _put_days_ago(monkeypatch, case_index, 10, [("0000000001", "12345", CASE_TITLE, "PER-2025-000001-001", None)])
+
+    case_index.set_last_build(CASE_TYPE, CASE_TITLE, date.today().isoformat())
+
+    assert case_index.lookup("0000000001", "12345", CASE_TITLE) == "PER-2025-000001-001"
+
+    case_index.set_last_build(CASE_TYPE, CASE_TITLE, (date.today() - timedelta(days=10)).isoformat())
+
+    assert case_index.lookup("0000000001", "12345", CASE_TITLE) is None
+
+
+def test_refresh_keeps_lowest_sub_case_of_the_same_folder(case_index):
+    """A refreshed entry keeps the lower numbered sub-case of its folder, and takes the new case if the employee moved to another folder."""
+
+    case_index.put_many([("0000000001", "12345", CASE_TITLE, "PER-2025-000001-002", None)])
+    case_index.put_many([("0000000001", "12345", CASE_TITLE, "PER-2025-000001-001", None)])
+    case_index.put_many([("0000000001", "12345", CASE_TITLE, "PER-2025-000001-003", None)])
+
+    assert case_index.lookup("0000000001", "12345", CASE_TITLE) == "PER-2025-000001-001"
+
+    case_index.put_many([("0000000001", "12345", CASE_TITLE, "PER-2025-000009-004", None)])
+
+    assert case_index.lookup("0000000001", "12345", CASE_TITLE) == "PER-2025-000009-004"
+
+
+def test_build_and_refresh_against_the_stub_server(case_index, stub_server):
+    """A full build indexes every employee folder found, and a refresh records its date, so the entries stay trusted."""
+
+    _, orchestrator_connection = stub_server(case_folders=20)
+
+    case_handler = CaseHandler(orchestrator_connection.constants["go_api_endpoint"], "offline", "offline")
+
+    stored_count = build_case_index(case_handler, case_index, CASE_TYPE, CASE_TITLE, start_date="2024-01-01")
+
+    assert stored_count == case_index.count() == 20
+    assert case_index.lookup("0000000007", STUB_EMPLOYMENT_CODE, CASE_TITLE) == "PER-2025-000007-001"
+    assert case_index.get_last_build(CASE_TYPE, CASE_TITLE) == date.today().isoformat()
+
+    # The stub server finds the cases by creation date, so a refresh of the cases modified since today finds none - the entries are kept
+    assert build_case_index(case_handler, case_index, CASE_TYPE, CASE_TITLE, incremental=True) == 0
+    assert case_index.lookup("0000000007", STUB_EMPLOYMENT_CODE, CASE_TITLE) == "PER-2025-000007-001"
+
+
+def test_indexed_employees_are_not_searched_for(tmp_path, stub_server):
+    """A mailing with a built case index resolves the salary cases without any case search."""
+
+    server, orchestrator_connection = stub_server(case_folders=5)
+
+    write_mailing(str(tmp_path), {f"{number:010d}": STUB_EMPLOYMENT_CODE for number in range(1, 6)})
+
+    run_mailing(
+        orchestrator_connection, str(tmp_path),
+        case_index_path=str(tmp_path / "case_index.db"), case_index_refresh="full", case_index_start_date="2024-01-01",
+    )
+
+    with open(tmp_path / "go_call_metrics.json", mode="r", encoding="utf-8") as metrics_file:
+        endpoints = {row["endpoint"] for row in json.load(metrics_file)}
+
+    assert server.counters["documents"] == 5
+    assert "POST /_goapi/cases/findbycaseproperties/" not in endpoints
+    assert "POST /_goapi/Documents/AddToCase" in endpoints
+
+
+def test_persisted_metadata_holds_no_contact_data(tmp_path, stub_server):
+    """The case metadata cache written after a run with the case index holds no contact data, while the index still has every CPR number."""
+
+    _, orchestrator_connection = stub_server(case_folders=5)
+
+    write_mailing(str(tmp_path), {f"{number:010d}": STUB_EMPLOYMENT_CODE for number in range(1, 6)})
+
+    run_mailing(
+        orchestrator_connection, str(tmp_path),
+        case_index_path=str(tmp_path / "case_index.db"), case_index_refresh="full", case_index_start_date="2024-01-01",
+    )
+
+    with open(tmp_path / "case_metadata_cache.json", mode="r", encoding="utf-8") as cache_file:
+        cached_attributes = [attributes for _, attributes in json.load(cache_file).values()]
+
+    assert cached_attributes
+    assert all(set(attributes) <= {"ows_CaseID", "ows_Title", "ows_EmploymentCode"} for attributes in cached_attributes)
+
+    case_index = CaseIndexStore(str(tmp_path / "case_index.db"), max_age_seconds=MAX_AGE_SECONDS)
+
+    try:
+        assert case_index.count() == 5
+
+    finally:
+        case_index.close()
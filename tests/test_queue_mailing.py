@@ -0,0 +1,117 @@
+"""Tests of the outcome of the queue elements in the queue-driven mode - see queue_mailing/main.py."""
+import json
+import os
+
+from OpenOrchestrator.database.queues import QueueStatus
+
+from conftest import CASE_TITLE, CASE_TYPE, STUB_EMPLOYMENT_CODE, run_mailing, write_mailing
+
+from benchmarks.run_offline import EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME
+
+from helper_scripts.file_handler import FileHandler
+
+from queue_mailing.main import enqueue_employees
+
+QUEUE_NAME = "Masseforsendelse test"
+
+
+def _elements_by_cpr(orchestrator_connection) -> dict:
+    return {json.loads(queue_element.data)["cpr"]: queue_element for queue_element in orchestrator_connection.queues[QUEUE_NAME]}
+
+
+def test_elements_are_done_or_failed_with_the_outcome(tmp_path, stub_server):
+    """An employee with an uploaded document is Done, and an employee without a document in the files to journalize is Failed."""
+
+    server, orchestrator_connection = stub_server()
+
+    write_mailing(str(tmp_path), {"0000000001": STUB_EMPLOYMENT_CODE, "0000000002": STUB_EMPLOYMENT_CODE}, documents=["0000000001"])
+
+    run_mailing(orchestrator_connection, str(tmp_path), queue_name=QUEUE_NAME)
+
+    elements = _elements_by_cpr(orchestrator_connection)
+
+    assert elements["0000000001"].status == QueueStatus.DONE
+    assert elements["0000000001"].message.startswith("Document 1 uploaded in case")
+
+    assert elements["0000000002"].status == QueueStatus.FAILED
+    assert elements["0000000002"].message.startswith("No document for the employee")
+
+    assert server.counters["documents"] == 1
+
+
+def test_unresolved_element_is_retried(tmp_path, stub_server):
+    """An element Failed because its salary case was not found is searched for again when it is set back to New."""
+
+    server, orchestrator_connection = stub_server()
+
+    write_mailing(str(tmp_path), {"0000000001": STUB_EMPLOYMENT_CODE, "0000000002": "99999"})
+
+    run_mailing(orchestrator_connection, str(tmp_path), queue_name=QUEUE_NAME)
+
+    failed_element = _elements_by_cpr(orchestrator_connection)["0000000002"]
+
+    assert failed_element.status == QueueStatus.FAILED
+    assert failed_element.message.startswith("Case ")
+
+    # The employment code is corrected in the element, which is set back to New, and a robot only working the queue picks it up
+    failed_element.data = json.dumps({**json.loads(failed_element.data), "tjenestenummer": STUB_EMPLOYMENT_CODE})
+    failed_element.status = QueueStatus.NEW
+
+    run_mailing(orchestrator_connection, str(tmp_path), queue_name=QUEUE_NAME, employee_list_filename="")
+
+    assert failed_element.status == QueueStatus.DONE
+    assert server.counters["documents"] == 2
+
+
+def test_mixed_mailings_use_the_mailing_of_each_element(tmp_path, stub_server):
+    """
+    Elements of two mailings in one queue are uploaded with the document title and category of their own mailing - an employee in both mailings
+    is queued and uploaded once per mailing, and enqueuing a mailing again adds nobody.
+    """
+
+    server, orchestrator_connection = stub_server()
+
+    mailings = (
+        ("mailing_a", ["0000000001", "0000000002"], "Mailing A", "Udgående"),
+        ("mailing_b", ["0000000002", "0000000003"], "Mailing B", "Indgående"),
+        ("mailing_a", ["0000000001", "0000000002"], "Mailing A", "Udgående"),
+    )
+
+    created_counts = []
+
+    for mailing_folder, cprs, journalized_filename, document_category in mailings:
+        folder_path = str(tmp_path / mailing_folder)
+
+        os.makedirs(folder_path, exist_ok=True)
+
+        write_mailing(folder_path, dict.fromkeys(cprs, STUB_EMPLOYMENT_CODE))
+
+        created_counts.append(enqueue_employees(
+            orchestrator_connection,
+            FileHandler(directory=folder_path),
+            QUEUE_NAME,
+            EMPLOYEE_LIST_FILENAME,
+            EMPLOYEE_LIST_SHEET_NAME,
+            CASE_TYPE,
+            CASE_TITLE,
+            journalized_filename,
+            document_category,
+            "offline",
+        ))
+
+    assert created_counts == [2, 2, 0]
+
+    # The robot working the queue is started with the arguments of a third mailing, and all the documents in one folder
+    worker_folder_path = str(tmp_path / "worker")
+
+    os.makedirs(worker_folder_path)
+
+    write_mailing(worker_folder_path, dict.fromkeys(["0000000001", "0000000002", "0000000003"], STUB_EMPLOYMENT_CODE))
+
+    run_mailing(
+        orchestrator_connection, worker_folder_path,
+        queue_name=QUEUE_NAME, employee_list_filename="", final_journalized_filename="Mailing C", document_category="Intern",
+    )
+
+    assert orchestrator_connection.count_queue_statuses() == {QueueStatus.DONE.value: 4}
+    assert server.uploaded_files == {("Mailing A.pdf", "Udgående"): 2, ("Mailing B.pdf", "Indgående"): 2}
@@ -0,0 +1,126 @@
+"""Tests of the retry policy and the circuit breaker against the stub server with injected faults - see helper_scripts/retry_policy.py."""
+import time
+
+import pytest
+import requests
+
+from helper_scripts import go_client
+from helper_scripts.case_handler import CaseHandler
+from helper_scripts.document_handler import DocumentHandler
+from helper_scripts.retry_policy import CircuitBreaker, RetryPolicy
+
+METADATA_PATH = "/_goapi/Cases/Metadata/PER-2025-000001-001"
+
+UPLOAD_PATH = "/_goapi/Documents/AddToCase"
+
+
+def _recorded_sleeps(monkeypatch) -> list:
+    """Records the backoff of the client instead of sleeping it."""
+
+    sleeps = []
+
+    monkeypatch.setattr(go_client.time, "sleep", sleeps.append)
+
+    return sleeps
+
+
+@pytest.mark.parametrize("fault_status", [502, 503])
+def test_lookup_is_sent_again(stub_server, fault_status):
+    """A GET turned away or failed by GetOrganized is sent again, until the attempts run out."""
+
+    server, orchestrator_connection = stub_server(fault_rate=1.0, fault_status=fault_status)
+
+    case_handler = CaseHandler(
+        orchestrator_connection.constants["go_api_endpoint"], "offline", "offline", retry_policy=RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    )
+
+    assert case_handler.get_case_metadata(METADATA_PATH).status_code == fault_status
+    assert server.counters["requests"] == 3
+
+
+def test_upload_is_not_sent_again_after_502(stub_server):
+    """An upload failed with a 502 may have been handled, so it is not sent again."""
+
+    server, orchestrator_connection = stub_server(fault_rate=1.0, fault_status=502)
+
+    document_handler = DocumentHandler(
+        orchestrator_connection.constants["go_api_endpoint"], "offline", "offline", retry_policy=RetryPolicy(max_attempts=3, base_delay=0, max_delay=0)
+    )
+
+    assert document_handler.upload_document({"Bytes": ""}, UPLOAD_PATH).status_code == 502
+    assert server.counters["requests"] == 1
+
+
+def test_upload_is_not_sent_again_after_read_timeout(stub_server):
+    """An upload timing out after it was sent is raised, and not sent again, since GetOrganized may still create the document."""
+
+    server, orchestrator_connection = stub_server(latency=0.5)
+
+    document_handler = DocumentHandler(
+        orchestrator_connection.constants["go_api_endpoint"], "offline", "offline",
+        timeout=0.1, retry_policy=RetryPolicy(max_attempts=3, base_delay=0, max_delay=0),
+    )
+
+    with pytest.raises(requests.ReadTimeout):
+        document_handler.upload_document({"Bytes": ""}, UPLOAD_PATH)
+
+    # The server counts a request once its latency has passed - long enough for a request sent again to be counted as well
+    time.sleep(0.8)
+
+    assert server.counters["requests"] == 1
+    assert server.counters["documents"] == 1
+
+
+@pytest.mark.parametrize("retry_after, max_delay, expected_delay", [(0.2, 5.0, 0.2), (30, 0.1, 0.1)])
+def test_retry_after_is_honoured_and_capped(monkeypatch, stub_server, retry_after, max_delay, expected_delay):
+    """The wait before an attempt is the Retry-After of the server, capped at max_delay, instead of the backoff."""
+
+    sleeps = _recorded_sleeps(monkeypatch)
+
+    server, orchestrator_connection = stub_server(fault_rate=1.0, fault_status=503, retry_after=retry_after)
+
+    case_handler = CaseHandler(
+        orchestrator_connection.constants["go_api_endpoint"], "offline", "offline",
+        retry_policy=RetryPolicy(max_attempts=2, base_delay=0, max_delay=max_delay),
+    )
+
+    case_handler.get_case_metadata(METADATA_PATH)
+
+    assert sleeps == [expected_delay]
+    assert server.counters["requests"] == 2
+
+
+def test_breaker_opens_after_failures_in_a_row_and_resets_on_success(stub_server):
+    """The circuit opens after failure_threshold failures in a row, a success in between resets the count, and an open circuit holds requests back."""
+
+    server, orchestrator_connection = stub_server(fault_rate=1.0, fault_status=500)
+
+    circuit_breaker = CircuitBreaker(failure_threshold=3, cooldown_seconds=0.3)
+
+    case_handler = CaseHandler(orchestrator_connection.constants["go_api_endpoint"], "offline", "offline", circuit_breaker=circuit_breaker)
+
+    def send(times: int) -> None:
+        for _ in range(times):
+            case_handler.get_case_metadata(METADATA_PATH)
+
+    send(2)
+
+    server.faults.rate = 0.0
+    send(1)
+
+    server.faults.rate = 1.0
+    send(2)
+
+    assert circuit_breaker.counters["opened"] == 0
+
+    send(1)
+
+    assert circuit_breaker.counters["opened"] == 1
+
+    server.faults.rate = 0.0
+
+    start = time.perf_counter()
+
+    assert case_handler.get_case_metadata(METADATA_PATH).ok
+    assert time.perf_counter() - start >= 0.2
+    assert circuit_breaker.counters["paused_seconds"] > 0
@@ -0,0 +1,157 @@
+"""Tests of the shard claims, the lease expiry and the merge of the shard results - see helper_scripts/shard_claims.py."""
+import csv
+import json
+import os
+import time
+
+import pytest
+
+from conftest import STUB_EMPLOYMENT_CODE, mailing_options, write_mailing
+
+from benchmarks.run_offline import EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME
+
+from helper_scripts import shard_claims
+from helper_scripts.file_handler import FileHandler
+from helper_scripts.shard_claims import ShardClaimTable
+
+import main as masseforsendelse
+
+
+def _plan(claim_table: ShardClaimTable, shard_count: int, fingerprint: str = "employee list") -> None:
+    claim_table.ensure_plan(shard_count, shard_claims.SHARD_BY_HASH, fingerprint, lambda: None)
+
+
+def _read_csv(file_path: str) -> list[list[str]]:
+    with open(file_path, mode="r", newline="", encoding="utf-8") as csv_file:
+        return list(csv.reader(csv_file))
+
+
+def test_robots_claim_different_shards(tmp_path):
+    """Every robot claims a shard of its own, until none is left."""
+
+    claim_table = ShardClaimTable(str(tmp_path))
+
+    _plan(claim_table, shard_count=2)
+
+    assert claim_table.claim("robot-a") == 0
+    assert claim_table.claim("robot-b") == 1
+    assert claim_table.claim("robot-c") is None
+
+    claim_table.complete(0, "robot-a")
+    claim_table.complete(1, "robot-b")
+
+    assert claim_table.all_done()
+
+
+def test_plan_of_another_employee_list_is_rejected(tmp_path):
+    """The shards can not be planned again from another employee list, or with another number of shards."""
+
+    claim_table = ShardClaimTable(str(tmp_path))
+
+    _plan(claim_table, shard_count=2)
+
+    with pytest.raises(ValueError):
+        _plan(claim_table, shard_count=2, fingerprint="another employee list")
+
+    with pytest.raises(ValueError):
+        _plan(claim_table, shard_count=3)
+
+
+def test_expired_lease_is_claimed_again(tmp_path):
+    """A shard is claimed by another robot when its lease runs out, and the first robot loses it."""
+
+    claim_table = ShardClaimTable(str(tmp_path), lease_seconds=0.2)
+
+    _plan(claim_table, shard_count=1)
+
+    assert claim_table.claim("dead-robot") == 0
+    assert claim_table.claim("robot-b") is None
+
+    time.sleep(0.3)
+
+    assert claim_table.claim("robot-b") == 0
+
+    # The robot that lost the lease finds out on its next renewal
+    assert not claim_table.renew(0, "dead-robot")
+    assert claim_table.renew(0, "robot-b")
+
+
+def test_released_shard_is_claimed_straight_away(tmp_path):
+    """A shard given back after a failure is claimed again without waiting for the lease."""
+
+    claim_table = ShardClaimTable(str(tmp_path))
+
+    _plan(claim_table, shard_count=1)
+
+    claim_table.claim("robot-a")
+    claim_table.release(0, "robot-a", error="GetOrganized is down")
+
+    assert claim_table.claim("robot-b") == 0
+    assert not claim_table.all_done()
+
+
+def test_merge_orders_rows_by_cpr_and_skips_missing_files(tmp_path):
+    """The result files of the shards are combined, ordered by CPR number, and a shard without a file is left out."""
+
+    shard_folders = [str(tmp_path / f"shard_{shard}") for shard in range(3)]
+
+    for shard_folder, rows in zip(shard_folders[:2], ([["0000000003", "PER-3"], ["0000000001", "PER-1"]], [["0000000002", "PER-2"]])):
+        os.makedirs(shard_folder)
+
+        with open(os.path.join(shard_folder, "employee_case_ids.csv"), mode="w", newline="", encoding="utf-8") as csv_file:
+            csv.writer(csv_file).writerows([["cpr", "case_id"], *rows])
+
+    merged_paths = shard_claims.merge_shard_results(shard_folders, str(tmp_path), ["employee_case_ids.csv", "journalized_docs.csv"])
+
+    assert merged_paths == [str(tmp_path / "employee_case_ids.csv")]
+    assert _read_csv(merged_paths[0]) == [["cpr", "case_id"], ["0000000001", "PER-1"], ["0000000002", "PER-2"], ["0000000003", "PER-3"]]
+
+
+def test_sharded_run_takes_over_expired_shard_and_merges(tmp_path, stub_server):
+    """A sharded run against the stub server takes over the shard of a dead robot, and merges the results of every shard."""
+
+    server, orchestrator_connection = stub_server()
+
+    folder_path = str(tmp_path)
+
+    cprs = [f"{number:010d}" for number in range(1, 13)]
+
+    write_mailing(folder_path, dict.fromkeys(cprs, STUB_EMPLOYMENT_CODE))
+
+    shards_folder_path = os.path.join(folder_path, "shards")
+    shard_folders = [os.path.join(shards_folder_path, f"shard_{shard:03d}") for shard in range(3)]
+
+    os.makedirs(shards_folder_path)
+
+    # A robot planned the shards and claimed the first one, and then died
+    def write_shards():
+        cpr_dicts, _ = FileHandler(directory=folder_path).build_cpr_mapping(filename=EMPLOYEE_LIST_FILENAME, sheet_name=EMPLOYEE_LIST_SHEET_NAME)
+
+        shard_cprs = shard_claims.plan_shards(list(cpr_dicts), 3)
+
+        shard_claims.write_shard_employee_lists(cpr_dicts, shard_folders, shard_cprs, EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME)
+
+    dead_claim_table = ShardClaimTable(shards_folder_path, lease_seconds=0.2)
+
+    dead_claim_table.ensure_plan(
+        3, shard_claims.SHARD_BY_HASH, shard_claims.fingerprint_file(os.path.join(folder_path, EMPLOYEE_LIST_FILENAME)), write_shards
+    )
+
+    assert dead_claim_table.claim("dead-robot") == 0
+
+    time.sleep(0.3)
+
+    result = masseforsendelse.main_sharded(orchestrator_connection=orchestrator_connection, shard_count=3, **mailing_options(folder_path))
+
+    assert result == "Successfully ran masseforsendelse script, all shards done and merged"
+    assert dead_claim_table.all_done()
+
+    with open(os.path.join(shards_folder_path, shard_claims.CLAIMS_FILENAME), mode="r", encoding="utf-8") as table_file:
+        assert [claim["claims"] for claim in json.load(table_file)["shards"]] == [2, 1, 1]
+
+    assert server.counters["documents"] == len(cprs)
+
+    merged_rows = _read_csv(os.path.join(folder_path, "employee_case_ids.csv"))
+
+    assert [row[0] for row in merged_rows[1:]] == cprs
+    assert len(_read_csv(os.path.join(folder_path, "journalized_docs.csv"))) == len(cprs) + 1
@@ -0,0 +1,56 @@
+"""Tests of the snapshot of the employee sheet - see helper_scripts/sheet_snapshot.py."""
+import json
+
+import pytest
+
+from conftest import STUB_EMPLOYMENT_CODE, write_mailing
+
+from benchmarks.run_offline import EMPLOYEE_LIST_FILENAME, EMPLOYEE_LIST_SHEET_NAME
+
+from helper_scripts import sheet_snapshot
+
+COLUMNS = ["CPR", "Tjenestenummer", "Navn", "Stilling"]
+
+
+def test_snapshot_is_json_and_reused(tmp_path, monkeypatch):
+    """The columns read are stored as JSON, and a second load uses the snapshot without parsing the workbook."""
+
+    write_mailing(str(tmp_path), {"0000000001": STUB_EMPLOYMENT_CODE, "0000000002": STUB_EMPLOYMENT_CODE})
+
+    file_path = str(tmp_path / EMPLOYEE_LIST_FILENAME)
+    snapshot_path = str(tmp_path / "sheet.snapshot.json")
+
+    df = sheet_snapshot.load_sheet_columns(file_path, EMPLOYEE_LIST_SHEET_NAME, COLUMNS, snapshot_path=snapshot_path)
+
+    with open(snapshot_path, mode="r", encoding="utf-8") as snapshot_file:
+        assert json.load(snapshot_file)["columns"]["CPR"] == ["0000000001", "0000000002"]
+
+    monkeypatch.setattr(sheet_snapshot, "read_sheet_columns", lambda *args: pytest.fail("The workbook was parsed again"))
+
+    assert sheet_snapshot.load_sheet_columns(file_path, EMPLOYEE_LIST_SHEET_NAME, COLUMNS, snapshot_path=snapshot_path).equals(df)
+
+
+def test_malformed_snapshot_is_a_cache_miss(tmp_path):
+    """A snapshot with the right key, but not holding a list of strings for each column, is ignored and written again."""
+
+    write_mailing(str(tmp_path), {"0000000001": STUB_EMPLOYMENT_CODE})
+
+    file_path = str(tmp_path / EMPLOYEE_LIST_FILENAME)
+    snapshot_path = str(tmp_path / "sheet.snapshot.json")
+
+    sheet_snapshot.load_sheet_columns(file_path, EMPLOYEE_LIST_SHEET_NAME, COLUMNS, snapshot_path=snapshot_path)
+
+    with open(snapshot_path, mode="r", encoding="utf-8") as snapshot_file:
+        snapshot = json.load(snapshot_file)
+
+    snapshot["columns"]["CPR"] = [{"not": "a string"}]
+
+    with open(snapshot_path, mode="w", encoding="utf-8") as snapshot_file:
+        json.dump(snapshot, snapshot_file)
+
+    df = sheet_snapshot.load_sheet_columns(file_path, EMPLOYEE_LIST_SHEET_NAME, COLUMNS, snapshot_path=snapshot_path)
+
+    assert df["CPR"].tolist() == ["0000000001"]
+
+    with open(snapshot_path, mode="r", encoding="utf-8") as snapshot_file:
+        assert json.load(snapshot_file)["columns"]["CPR"] == ["0000000001"]